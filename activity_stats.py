@@ -0,0 +1,209 @@
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Часовые корзины хранятся двое суток (точные окна до 48 ч), дневные - DAILY_RETENTION дней
+HOURLY_RETENTION = 48
+DAILY_RETENTION = 90
+
+
+class HyperLogLog:
+    """Компактная оценка количества уникальных значений (2^p байт, ошибка ~1.04/sqrt(2^p))"""
+
+    def __init__(self, p: int = 10, registers: Optional[bytearray] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value) -> None:
+        x = int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        return HyperLogLog(self.p, bytearray(map(max, self.registers, other.registers)))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_str(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+    @classmethod
+    def from_str(cls, data: str, p: int = 10) -> "HyperLogLog":
+        return cls(p, bytearray(base64.b64decode(data)))
+
+
+class _Bucket:
+    __slots__ = ('events', 'templates', 'users')
+
+    def __init__(self):
+        self.events: Counter = Counter()
+        self.templates: Counter = Counter()
+        self.users = HyperLogLog()
+
+    def to_dict(self) -> Dict:
+        return {'events': dict(self.events), 'templates': dict(self.templates), 'users': self.users.to_str()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "_Bucket":
+        bucket = cls()
+        bucket.events.update(data.get('events', {}))
+        bucket.templates.update(data.get('templates', {}))
+        if data.get('users'):
+            bucket.users = HyperLogLog.from_str(data['users'])
+        return bucket
+
+
+class ActivityStats:
+    """
+    Инкрементальные счетчики активности пользователей
+
+    Счетчики обновляются при каждом событии и периодически сохраняются в небольшой
+    JSON-файл, поэтому /stats не читает журнал активности. Окна до 48 часов
+    считаются по часовым корзинам, более длинные - по дневным.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.total = _Bucket()
+        self.hourly: Dict[int, _Bucket] = {}
+        self.daily: Dict[int, _Bucket] = {}
+        self.dirty = False
+        self.load()
+
+    def record(self, event: str, user_id: Optional[int] = None, template: Optional[str] = None,
+               count: int = 1, timestamp: Optional[float] = None) -> None:
+        """Учесть событие"""
+        timestamp = timestamp or time.time()
+        hour = int(timestamp // HOUR) * HOUR
+        day = int(timestamp // DAY) * DAY
+        for bucket in (self.total, self._bucket(self.hourly, hour), self._bucket(self.daily, day)):
+            bucket.events[event] += count
+            if template and event in ('DOCUMENT_FILLED', 'BATCH_FILLED'):
+                bucket.templates[template] += count
+            if user_id is not None:
+                bucket.users.add(user_id)
+        self.dirty = True
+
+    @staticmethod
+    def _bucket(buckets: Dict[int, _Bucket], key: int) -> _Bucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = _Bucket()
+        return bucket
+
+    def summary(self, window_seconds: Optional[int] = None) -> Dict:
+        """
+        Сводка за последние window_seconds секунд (None - за все время)
+
+        Стоимость не зависит от объема истории: суммируется не больше
+        HOURLY_RETENTION или DAILY_RETENTION корзин.
+        """
+        if window_seconds is None:
+            buckets = [self.total]
+        else:
+            now = time.time()
+            if window_seconds <= HOURLY_RETENTION * HOUR:
+                since = int((now - window_seconds) // HOUR) * HOUR
+                buckets = [bucket for hour, bucket in self.hourly.items() if hour >= since]
+            else:
+                since = int((now - window_seconds) // DAY) * DAY
+                buckets = [bucket for day, bucket in self.daily.items() if day >= since]
+
+        events: Counter = Counter()
+        templates: Counter = Counter()
+        users = HyperLogLog()
+        for bucket in buckets:
+            events.update(bucket.events)
+            templates.update(bucket.templates)
+            users = users.merge(bucket.users)
+        return {'events': events, 'templates': templates, 'unique_users': users.count()}
+
+    def _prune(self):
+        now = time.time()
+        for buckets, retention in ((self.hourly, HOURLY_RETENTION * HOUR), (self.daily, DAILY_RETENTION * DAY)):
+            for key in [key for key in buckets if key < now - retention]:
+                del buckets[key]
+
+    def _serialize(self) -> str:
+        self._prune()
+        return json.dumps({
+            'total': self.total.to_dict(),
+            'hourly': {str(key): bucket.to_dict() for key, bucket in self.hourly.items()},
+            'daily': {str(key): bucket.to_dict() for key, bucket in self.daily.items()},
+        }, ensure_ascii=False)
+
+    def _write(self, content: str):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+    async def flush(self):
+        """Сохранить счетчики, если они изменились (запись выполняется вне event loop)"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        try:
+            await asyncio.to_thread(self._write, self._serialize())
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Ошибка сохранения статистики {self.path}: {e}")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.total = _Bucket.from_dict(data.get('total', {}))
+            self.hourly = {int(key): _Bucket.from_dict(value) for key, value in data.get('hourly', {}).items()}
+            self.daily = {int(key): _Bucket.from_dict(value) for key, value in data.get('daily', {}).items()}
+        except Exception as e:
+            logger.error(f"Ошибка загрузки статистики {self.path}: {e}")
+
+    def import_text_log(self, log_path: str) -> int:
+        """
+        Однократно перенести историю из текстового журнала user_activity.log
+
+        Returns:
+            количество учтенных событий
+        """
+        line_re = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - (\w+) - User: (\d+)(.*)$")
+        template_re = re.compile(r" - Template: (.+?)(?: - |$)")
+        imported = 0
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = line_re.match(line.rstrip('\n'))
+                if not match:
+                    continue
+                timestamp = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").timestamp()
+                template_match = template_re.search(match.group(4))
+                template = template_match.group(1) if template_match else None
+                self.record(match.group(2), int(match.group(3)), template, timestamp=timestamp)
+                imported += 1
+        return imported
@@ -1,32 +1,38 @@
 import os
-from typing import Set
+from typing import Optional
 import logging
 
+from state_storage import MemorySessionStore, SessionStore
+
 logger = logging.getLogger(__name__)
 
 class AuthManager:
-    def __init__(self):
+    def __init__(self, session_store: Optional[SessionStore] = None):
         self.admin_password = os.getenv("ADMIN_PASSWORD", "default_password")
-        self.authenticated_users: Set[int] = set()
+        self.sessions = session_store or MemorySessionStore(ttl=0)
 
-    def authenticate(self, user_id: int, password: str) -> bool:
+    async def authenticate(self, user_id: int, password: str) -> bool:
         """Аутентифицировать пользователя"""
         if password == self.admin_password:
-            self.authenticated_users.add(user_id)
+            await self.sessions.add(user_id)
             logger.info(f"Пользователь {user_id} успешно аутентифицирован")
             return True
         logger.warning(f"Неудачная попытка аутентификации пользователя {user_id}")
         return False
 
-    def is_authenticated(self, user_id: int) -> bool:
-        """Проверить, аутентифицирован ли пользователь"""
-        return user_id in self.authenticated_users
+    async def is_authenticated(self, user_id: int) -> bool:
+        """Проверить, аутентифицирован ли пользователь (и не истекла ли его сессия)"""
+        return await self.sessions.contains(user_id)
 
-    def logout(self, user_id: int):
+    async def logout(self, user_id: int):
         """Выйти из системы"""
-        self.authenticated_users.discard(user_id)
+        await self.sessions.discard(user_id)
         logger.info(f"Пользователь {user_id} вышел из системы")
 
+    async def active_sessions(self) -> int:
+        """Количество действующих сессий"""
+        return await self.sessions.count()
+
     def require_auth(self, func):
         """Декоратор для проверки аутентификации"""
         async def wrapper(*args, **kwargs):
@@ -35,7 +41,7 @@ class AuthManager:
             if not message or not hasattr(message, 'from_user'):
                 return await message.answer("❌ Ошибка аутентификации")
 
-            if not self.is_authenticated(message.from_user.id):
+            if not await self.is_authenticated(message.from_user.id):
                 return await message.answer(
                     "🔐 Доступ запрещен. Введите команду /login <пароль> для входа в систему."
                 )
@@ -0,0 +1,231 @@
+from PIL import Image
+import asyncio
+import csv
+import io
+import os
+import re
+import zipfile
+from datetime import date, datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import logging
+
+from output_profiles import BUILTIN_PROFILES, OutputProfile, encode_images
+from render_executor import RenderQueueFull
+
+logger = logging.getLogger(__name__)
+
+BATCH_EXTENSIONS = ('.csv', '.xlsx')
+
+_UNSAFE_CHARS_RE = re.compile(r'[^\w.-]+', re.UNICODE)
+_ROW_NUMBER_RE = re.compile(r'\d+')
+
+
+class BatchError(Exception):
+    """Ошибка в файле пакетного заполнения"""
+
+
+def _cell_to_str(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime("%d.%m.%Y") if value.time() == datetime.min.time() else value.strftime("%d.%m.%Y %H:%M")
+    if isinstance(value, date):
+        return value.strftime("%d.%m.%Y")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _read_csv(content: bytes) -> List[Tuple[int, List[str]]]:
+    for encoding in ('utf-8-sig', 'cp1251'):
+        try:
+            text = content.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise BatchError("не удалось определить кодировку CSV (ожидается UTF-8 или Windows-1251)")
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO(text), dialect)
+    table = []
+    line = 1
+    for row in reader:
+        # Значение в кавычках может занимать несколько строк файла: номер - первая из них
+        table.append((line, [cell.strip() for cell in row]))
+        line = reader.line_num + 1
+    return table
+
+
+def _read_xlsx(content: bytes) -> List[Tuple[int, List[str]]]:
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise BatchError("для чтения XLSX установите пакет openpyxl")
+
+    workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # Пустые строки листа тоже перебираются, поэтому номер совпадает с номером строки в Excel
+        return [(number, [_cell_to_str(cell) for cell in row])
+                for number, row in enumerate(sheet.iter_rows(min_row=1, values_only=True), 1)]
+    finally:
+        workbook.close()
+
+
+def read_rows(content: bytes, filename: str) -> Tuple[List[str], List[Tuple[int, Dict[str, str]]]]:
+    """
+    Прочитать таблицу: первая строка - названия полей, далее по строке на документ
+
+    Returns:
+        (названия колонок, строки в виде (номер строки в файле с учетом заголовка,
+        {'поле': 'значение'} без пустых значений))
+
+    Raises:
+        BatchError: неподдерживаемый или некорректный файл
+    """
+    extension = os.path.splitext(filename.lower())[1]
+    if extension == '.csv':
+        table = _read_csv(content)
+    elif extension == '.xlsx':
+        table = _read_xlsx(content)
+    else:
+        raise BatchError(f"поддерживаются только файлы {', '.join(BATCH_EXTENSIONS)}")
+
+    table = [(number, values) for number, values in table if any(values)]
+    if len(table) < 2:
+        raise BatchError("в файле нет строк с данными")
+
+    columns = [column.strip() for column in table[0][1]]
+    rows = []
+    for number, values in table[1:]:
+        row = {column: value for column, value in zip(columns, values) if column and value}
+        if row:
+            rows.append((number, row))
+    return columns, rows
+
+
+class ZipPartWriter:
+    """Потоковая запись документов в ZIP-архивы, разбитые на части по размеру"""
+
+    def __init__(self, directory: str, basename: str, max_part_bytes: int):
+        self.directory = directory
+        self.basename = basename
+        self.max_part_bytes = max_part_bytes
+        self.parts: List[str] = []
+        self._zip: Optional[zipfile.ZipFile] = None
+        self._part_bytes = 0
+
+    def add(self, name: str, content: bytes):
+        """Добавить документ в текущую часть (или начать новую, если она переполнится)"""
+        if self._zip is None or (self._part_bytes and self._part_bytes + len(content) > self.max_part_bytes):
+            self._open_part()
+        # Изображения уже сжаты, поэтому храним их без повторного сжатия
+        self._zip.writestr(name, content, compress_type=zipfile.ZIP_STORED)
+        self._part_bytes += len(content)
+
+    def _open_part(self):
+        self.close()
+        path = os.path.join(self.directory, f"{self.basename}_{len(self.parts) + 1}.zip")
+        self._zip = zipfile.ZipFile(path, 'w')
+        self._part_bytes = 0
+        self.parts.append(path)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+class PdfPartWriter:
+    """
+    Сборка документов пакета в многостраничные PDF, разбитые на части по числу страниц
+
+    Страницы приходят в произвольном порядке (строки рендерятся параллельно),
+    поэтому до close() они хранятся сжатыми PNG и только затем по порядку строк
+    декодируются и кодируются профилем вывода, по одной части за раз.
+    """
+
+    # Страницы рендерятся без потерь и быстро: сжимает их уже профиль PDF
+    page_profile = BUILTIN_PROFILES['png_fast']
+
+    def __init__(self, directory: str, basename: str, profile: OutputProfile, max_pages: int):
+        self.directory = directory
+        self.basename = basename
+        self.profile = profile
+        self.max_pages = max(1, max_pages)
+        self.parts: List[str] = []
+        self._pages: Dict[str, bytes] = {}
+
+    def add(self, name: str, content: bytes):
+        self._pages[name] = content
+
+    def close(self):
+        # Имена документов начинаются с номера строки
+        names = sorted(self._pages, key=lambda name: int(_ROW_NUMBER_RE.match(name).group()))
+        for start in range(0, len(names), self.max_pages):
+            pages = [Image.open(io.BytesIO(self._pages[name])) for name in names[start:start + self.max_pages]]
+            path = os.path.join(self.directory, f"{self.basename}_{len(self.parts) + 1}.pdf")
+            with open(path, 'wb') as f:
+                f.write(encode_images(pages, self.profile, 'PNG'))
+            self.parts.append(path)
+        self._pages.clear()
+
+
+def document_filename(index: int, row: Dict[str, str], extension: str) -> str:
+    """Имя файла в архиве: номер строки в файле и первое значение строки"""
+    label = next(iter(row.values()), '')
+    label = _UNSAFE_CHARS_RE.sub('_', label).strip('_')[:40]
+    return f"{index:04d}_{label}{extension}" if label else f"{index:04d}{extension}"
+
+
+async def render_batch(processor, template_name: str, rows: List[Tuple[int, Dict[str, str]]], profile: OutputProfile,
+                       writer: ZipPartWriter, extension: str, concurrency: int,
+                       on_progress: Optional[Callable[[int, int], Awaitable]] = None,
+                       owner: Optional[int] = None, priority: bool = False) -> List[int]:
+    """
+    Заполнить документ для каждой строки и записать результаты в архив
+
+    Одновременно в пуле рендеринга находится не больше concurrency документов,
+    поэтому в памяти хранятся только они, а пакет не занимает всю очередь.
+    Документы пакета встают в очередь владельца owner и чередуются с документами
+    других пользователей.
+
+    Args:
+        rows: строки таблицы с их номерами в файле (как возвращает read_rows)
+
+    Returns:
+        номера строк в файле, которые не удалось заполнить
+    """
+    pending = iter(rows)
+    failed: List[int] = []
+    write_lock = asyncio.Lock()
+    done = 0
+
+    async def worker():
+        nonlocal done
+        for index, row in pending:
+            while True:
+                try:
+                    content = await processor.fill_document_bytes_async(
+                        template_name, row, profile, owner=owner, priority=priority
+                    )
+                    break
+                except RenderQueueFull:
+                    await asyncio.sleep(1)
+
+            if content is None:
+                failed.append(index)
+            else:
+                async with write_lock:
+                    await asyncio.to_thread(writer.add, document_filename(index, row, extension), content)
+            done += 1
+            if on_progress:
+                await on_progress(done, len(rows))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    await asyncio.to_thread(writer.close)
+    return sorted(failed)
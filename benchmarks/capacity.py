@@ -0,0 +1,348 @@
+"""
+Сквозной тест емкости бота: N пользователей заполняют документы одновременно
+
+Бот работает против локальной заглушки Bot API (benchmarks.mock_bot_api) в режиме
+polling. Каждый пользователь проходит весь сценарий: /login -> /fill -> выбор шаблона
+кнопкой -> ввод данных -> (черновик и кнопка «Заполнить») -> готовый документ.
+Замеряются задержки каждого шага и всего заполнения (от /fill до документа),
+пропускная способность и задержка event loop. Заглушка и сценарий работают в том же
+event loop, что и бот, поэтому задержка event loop включает и их (небольшую) нагрузку.
+
+Значения полей по умолчанию уникальны для каждого заполнения, чтобы кэш file_id не
+подменял рендеринг; --repeat-data отправляет одинаковые данные.
+
+Запуск из корня проекта:
+    python -m benchmarks.capacity --users 50 --rounds 2
+    python -m benchmarks.capacity --users 100 --no-preview --json capacity.json
+    python -m benchmarks.capacity --save-baseline benchmarks/capacity_baseline.json
+    python -m benchmarks.capacity --baseline benchmarks/capacity_baseline.json --threshold e2e_ms_p95=0.3
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.fill import compare, parse_thresholds
+from benchmarks.mock_bot_api import MockBotApi
+
+TOKEN = "123456:CAPACITY-TEST-TOKEN"
+USER_ID_BASE = 300000
+
+# Допустимое ухудшение по умолчанию (доля от базового значения) и направление метрики
+THRESHOLDS: Dict[str, Tuple[str, float]] = {
+    'e2e_ms_p50': ('lower_is_better', 0.15),
+    'e2e_ms_p95': ('lower_is_better', 0.25),
+    'throughput_per_s': ('higher_is_better', 0.15),
+    'loop_lag_ms_p99': ('lower_is_better', 0.50),
+}
+
+
+class ScenarioError(Exception):
+    """Бот ответил не так, как ожидает сценарий"""
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize_ms(values: List[float]) -> Dict:
+    if not values:
+        return {}
+    return {
+        'p50': round(statistics.median(values) * 1000, 2),
+        'p95': round(percentile(values, 0.95) * 1000, 2),
+        'p99': round(percentile(values, 0.99) * 1000, 2),
+        'max': round(max(values) * 1000, 2),
+    }
+
+
+class Scenario:
+    """Сценарий заполнения документа для множества пользователей поверх заглушки Bot API"""
+
+    def __init__(self, api: MockBotApi, template: str, fields: List[str], password: str, preview: bool,
+                 timeout: float, repeat_data: bool):
+        self.api = api
+        self.template = template
+        self.fields = fields
+        self.password = password
+        self.preview = preview
+        self.timeout = timeout
+        self.repeat_data = repeat_data
+        self.steps: Dict[str, List[float]] = defaultdict(list)
+        self.e2e: List[float] = []
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.queued = 0
+        self._update_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _send_text(self, user_id: int, text: str):
+        update_id = next(self._update_ids)
+        self.api.push_update({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        })
+
+    def _press(self, user_id: int, message: Dict, data: str):
+        update_id = next(self._update_ids)
+        self.api.push_update({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "message": message,
+                "data": data,
+            },
+        })
+
+    async def _reply(self, user_id: int, methods: Tuple[str, ...] = ("sendMessage",)) -> Dict:
+        """Дождаться ответа бота; уведомления о позиции в очереди пропускаются"""
+        while True:
+            method, message = await self.api.next_reply(user_id, self.timeout)
+            text = message.get("text") or message.get("caption") or ""
+            if method == "sendMessage" and text.startswith("⏳"):
+                self.queued += 1
+                continue
+            if method not in methods or text.startswith(("❌", "⚠️")):
+                raise ScenarioError(f"{method}: {text[:80]}")
+            return message
+
+    @staticmethod
+    def _button(message: Dict, predicate) -> Optional[str]:
+        for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+            for button in row:
+                if predicate(button):
+                    return button.get("callback_data")
+        return None
+
+    async def _step(self, name: str, action, *args):
+        started = time.perf_counter()
+        result = await action(*args)
+        self.steps[name].append(time.perf_counter() - started)
+        return result
+
+    async def _login(self, user_id: int):
+        self._send_text(user_id, f"/login {self.password}")
+        message = await self._reply(user_id)
+        if not message["text"].startswith("✅"):
+            raise ScenarioError(f"вход не выполнен: {message['text'][:80]}")
+
+    async def _fill(self, user_id: int, round_index: int):
+        self._send_text(user_id, "/fill")
+        message = await self._reply(user_id)
+        callback_data = self._button(message, lambda button: button.get("text") == self.template)
+
+        if callback_data:
+            self._press(user_id, message, callback_data)
+        else:
+            # Шаблона нет на первой странице - выбор по названию
+            self._send_text(user_id, self.template)
+        await self._step("select", self._reply, user_id)
+
+        suffix = "" if self.repeat_data else f" {user_id}-{round_index}"
+        self._send_text(user_id, "\n".join(f"{field}={field}{suffix}" for field in self.fields))
+        if self.preview:
+            message = await self._step("preview", self._reply, user_id, ("sendPhoto",))
+            callback_data = self._button(message, lambda button: button.get("callback_data") == "preview:ok")
+            if not callback_data:
+                raise ScenarioError("у черновика нет кнопки подтверждения")
+            self._press(user_id, message, callback_data)
+        await self._step("document", self._reply, user_id, ("sendPhoto", "sendDocument"))
+
+    async def run_user(self, index: int, rounds: int, delay: float):
+        user_id = USER_ID_BASE + index
+        self.api.subscribe(user_id)
+        await asyncio.sleep(delay)
+        try:
+            await self._step("login", self._login, user_id)
+            for round_index in range(rounds):
+                started = time.perf_counter()
+                try:
+                    await self._fill(user_id, round_index)
+                    self.e2e.append(time.perf_counter() - started)
+                except asyncio.TimeoutError:
+                    self.errors["timeout"] += 1
+                except ScenarioError as e:
+                    self.errors[str(e).split(":", 1)[0]] += 1
+                    # Ответ на ошибку мог прийти раньше остальных сообщений шага
+                    await asyncio.sleep(0.1)
+                    self.api.drain(user_id)
+        except (asyncio.TimeoutError, ScenarioError):
+            self.errors["login"] += 1
+        finally:
+            self.api.unsubscribe(user_id)
+
+
+async def monitor_loop_lag(samples: List[float], interval: float = 0.01):
+    """Насколько позже запланированного просыпается задача (задержка event loop)"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+async def run_capacity(users: int, rounds: int, template: Optional[str], preview: bool, ramp: float,
+                       timeout: float, repeat_data: bool) -> Dict:
+    from bot import DocumentBot
+
+    api = MockBotApi()
+    await api.start()
+    bot = DocumentBot(TOKEN, api_url=api.url)
+    processor = bot.document_processor
+
+    template = template or next(
+        (name for name in processor.get_available_templates() if processor.get_template_config(name)), None
+    )
+    config = processor.get_template_config(template) if template else None
+    if not config:
+        await bot.bot.session.close()
+        await api.stop()
+        raise SystemExit("Нет шаблона с конфигурацией для сценария (укажите --template)")
+
+    # Частые значения полей растеризуются так же, как при обычном запуске бота
+    await processor.storage.run(processor.warm_text_tiles)
+
+    scenario = Scenario(api, template, list(config.field_names), os.environ["ADMIN_PASSWORD"], preview,
+                        timeout, repeat_data)
+    lag: List[float] = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag))
+    polling = asyncio.create_task(bot.dp.start_polling(bot.bot, handle_signals=False, polling_timeout=1))
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            scenario.run_user(i, rounds, ramp * i / users) for i in range(users)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        lag_task.cancel()
+        await bot.dp.stop_polling()
+        await polling
+        processor.render_executor.shutdown(wait=False)
+        await api.stop()
+
+    e2e = summarize_ms(scenario.e2e)
+    lag_ms = summarize_ms(lag)
+    return {
+        'case': f"users{users}_rounds{rounds}_{'preview' if preview else 'direct'}",
+        'template': template,
+        'documents': len(scenario.e2e),
+        'errors': dict(scenario.errors),
+        'queued_notifications': scenario.queued,
+        'elapsed_s': round(elapsed, 2),
+        'throughput_per_s': round(len(scenario.e2e) / elapsed, 2),
+        'e2e_ms_p50': e2e.get('p50'),
+        'e2e_ms_p95': e2e.get('p95'),
+        'e2e_ms_p99': e2e.get('p99'),
+        'e2e_ms_max': e2e.get('max'),
+        'steps_ms': {name: summarize_ms(values) for name, values in scenario.steps.items()},
+        'loop_lag_ms_p50': lag_ms.get('p50'),
+        'loop_lag_ms_p99': lag_ms.get('p99'),
+        'loop_lag_ms_max': lag_ms.get('max'),
+        'api_calls': dict(api.calls),
+        'uploaded_mb': round(api.uploaded_bytes / 1048576, 2),
+    }
+
+
+def configure_environment(preview: bool, store: bool, workdir: str):
+    """Окружение бота для теста: служебные файлы во временном каталоге, без ограничения частоты"""
+    os.environ.setdefault("ADMIN_PASSWORD", "capacity-test")
+    # Ограничение частоты проверяется отдельно, здесь оно исказило бы емкость
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    os.environ["FILL_PREVIEW"] = "1" if preview else "0"
+    os.environ["OUTPUT_STORAGE"] = os.getenv("OUTPUT_STORAGE", "async") if store else "off"
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("STORAGE_PATH", os.path.join(workdir, "bot_state.db"))
+    os.environ["STATS_PATH"] = os.path.join(workdir, "activity_stats.json")
+    os.environ["EVENT_LOG_PATH"] = os.path.join(workdir, "user_activity.jsonl")
+    os.environ["RETENTION_MANIFEST_PATH"] = os.path.join(workdir, "filled_documents.db")
+    os.environ["OUTPUT_DIR"] = os.path.join(workdir, "filled_documents")
+    os.environ["CATALOG_INDEX_PATH"] = os.path.join(workdir, "template_catalog.json")
+    os.environ.setdefault("TEMPLATE_SHARED_DIR", os.path.join(workdir, "template_raw"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозная емкость бота: задержки, пропускная способность, event loop")
+    parser.add_argument('--users', type=int, default=50, help="одновременных пользователей")
+    parser.add_argument('--rounds', type=int, default=1, help="заполнений на пользователя")
+    parser.add_argument('--template', help="шаблон (по умолчанию - первый с конфигурацией)")
+    parser.add_argument('--no-preview', dest='preview', action='store_false', help="заполнять без черновика")
+    parser.add_argument('--store', action='store_true', help="сохранять готовые документы на диск (OUTPUT_STORAGE)")
+    parser.add_argument('--repeat-data', action='store_true', help="одинаковые данные у всех заполнений")
+    parser.add_argument('--ramp', type=float, default=0.0, help="распределить старт пользователей на N секунд")
+    parser.add_argument('--timeout', type=float, default=60.0, help="ожидание ответа бота на шаг, секунд")
+    parser.add_argument('--json', dest='json_path', help="сохранить результаты в JSON")
+    parser.add_argument('--baseline', help="сравнить с базовыми результатами из JSON")
+    parser.add_argument('--save-baseline', help="сохранить результаты как базовые")
+    parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=FRACTION',
+                        help="допустимое ухудшение метрики, например e2e_ms_p95=0.3")
+    args = parser.parse_args()
+    thresholds = parse_thresholds(args.threshold, THRESHOLDS)
+
+    with tempfile.TemporaryDirectory(prefix="capacity_") as workdir:
+        configure_environment(args.preview, args.store, workdir)
+        row = asyncio.run(run_capacity(args.users, args.rounds, args.template, args.preview, args.ramp,
+                                       args.timeout, args.repeat_data))
+
+    print(f"Шаблон: {row['template']}, пользователей: {args.users}, заполнений: {row['documents']}, "
+          f"ошибок: {sum(row['errors'].values())} {row['errors'] or ''}")
+    print(f"Пропускная способность: {row['throughput_per_s']} документов/с за {row['elapsed_s']} с")
+    print(f"\n{'шаг':<12} {'p50, мс':>10} {'p95, мс':>10} {'p99, мс':>10} {'max, мс':>10}")
+    steps = dict(row['steps_ms'])
+    steps['всего'] = {'p50': row['e2e_ms_p50'], 'p95': row['e2e_ms_p95'],
+                      'p99': row['e2e_ms_p99'], 'max': row['e2e_ms_max']}
+    for name, values in steps.items():
+        if values.get('p50') is not None:
+            print(f"{name:<12} {values['p50']:>10} {values['p95']:>10} {values['p99']:>10} {values['max']:>10}")
+    print(f"\nЗадержка event loop: p50 {row['loop_lag_ms_p50']} мс, p99 {row['loop_lag_ms_p99']} мс, "
+          f"max {row['loop_lag_ms_max']} мс")
+    print(f"Вызовы Bot API: {row['api_calls']}, загружено {row['uploaded_mb']} МБ")
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pool': os.getenv("RENDER_POOL", "thread"),
+            'workers': os.getenv("RENDER_WORKERS", "0"),
+        },
+        'results': [row],
+    }
+    for path in (args.json_path, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare([row], baseline['results'], thresholds)
+        if regressions:
+            print("\nРегрессии относительно базовых результатов:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
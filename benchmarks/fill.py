@@ -0,0 +1,291 @@
+"""
+Бенчмарк заполнения документов на синтетических шаблонах
+
+Шаблоны формата A4 (150, 300 и 600 DPI) и конфигурации на 5-200 полей генерируются
+детерминированно, поэтому результаты воспроизводимы и не зависят от содержимого
+templates/ и config/. Каждый случай выполняется в отдельном процессе, чтобы пиковое
+потребление памяти относилось только к нему.
+
+Запуск из корня проекта:
+    python -m benchmarks.fill --json results.json
+    python -m benchmarks.fill --save-baseline benchmarks/baseline.json
+    python -m benchmarks.fill --baseline benchmarks/baseline.json --threshold latency_ms_p50=0.1
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+A4_INCHES = (8.27, 11.69)
+
+# Допустимое ухудшение по умолчанию (доля от базового значения) и направление метрики
+THRESHOLDS: Dict[str, Tuple[str, float]] = {
+    'latency_ms_p50': ('lower_is_better', 0.15),
+    'latency_ms_p95': ('lower_is_better', 0.25),
+    'batch_throughput_per_s': ('higher_is_better', 0.15),
+    'peak_rss_mb': ('lower_is_better', 0.20),
+    'output_bytes': ('lower_is_better', 0.05),
+}
+
+
+def case_id(dpi: int, fields: int) -> str:
+    return f"a4_{dpi}dpi_{fields}f"
+
+
+def a4_size(dpi: int) -> Tuple[int, int]:
+    return round(A4_INCHES[0] * dpi), round(A4_INCHES[1] * dpi)
+
+
+def field_layout(size: Tuple[int, int], fields: int, dpi: int) -> Dict[str, Dict]:
+    """Поля в сетке по всей странице: столбец на каждые 50 полей"""
+    width, height = size
+    margin = dpi // 2
+    columns = max(1, math.ceil(fields / 50))
+    rows = math.ceil(fields / columns)
+    row_step = (height - 2 * margin) / rows
+    column_step = (width - 2 * margin) / columns
+    font_size = max(8, round(10 * dpi / 72))
+    layout = {}
+    for i in range(fields):
+        column, row = divmod(i, rows)
+        layout[f"поле_{i:03d}"] = {
+            'x': int(margin + column * column_step),
+            'y': int(margin + row * row_step),
+            'font_size': font_size,
+            'color': '#000000',
+        }
+    return layout
+
+
+def generate_case(workdir: str, dpi: int, fields: int, mode: str, profile: Optional[str]) -> str:
+    """Создать шаблон и конфигурацию (если их еще нет), вернуть имя шаблона"""
+    from PIL import Image, ImageDraw
+
+    templates_dir = os.path.join(workdir, "templates")
+    config_dir = os.path.join(workdir, "config")
+    os.makedirs(templates_dir, exist_ok=True)
+    os.makedirs(config_dir, exist_ok=True)
+
+    size = a4_size(dpi)
+    layout = field_layout(size, fields, dpi)
+    template_name = f"{case_id(dpi, fields)}_{mode.lower()}.png"
+    template_path = os.path.join(templates_dir, template_name)
+
+    if not os.path.exists(template_path):
+        # Бланк: рамка и линия под каждым полем
+        image = Image.new("RGB", size, "white")
+        draw = ImageDraw.Draw(image)
+        border = dpi // 4
+        draw.rectangle((border, border, size[0] - border, size[1] - border), outline="black", width=max(1, dpi // 75))
+        for field in layout.values():
+            baseline = field['y'] + field['font_size'] + 2
+            draw.line((field['x'], baseline, field['x'] + dpi * 3, baseline), fill=(90, 90, 90), width=max(1, dpi // 150))
+        if mode == "P":
+            image = image.convert("P", palette=Image.ADAPTIVE, colors=16)
+        elif mode == "L":
+            image = image.convert("L")
+        image.save(template_path)
+
+    config = {'template_name': template_name, 'fields': layout}
+    if profile:
+        config['output'] = profile
+    config_path = os.path.join(config_dir, f"{template_name}.json")
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+    return template_name
+
+
+def sample_data(field_names: List[str], seed: int) -> Dict[str, str]:
+    """Детерминированные значения полей разной длины"""
+    rng = random.Random(seed)
+    words = ["Иванов", "Петр", "Сергеевич", "ООО", "Ромашка", "01.01.2024", "Москва", "ул.", "Ленина", "д. 15"]
+    return {name: " ".join(rng.choice(words) for _ in range(rng.randint(1, 4))) for name in field_names}
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def run_case(spec: Dict) -> Dict:
+    """Выполнить один случай (вызывается в отдельном процессе)"""
+    from image_processor import DocumentProcessor
+    from render_executor import RenderExecutor
+
+    template_name = generate_case(spec['workdir'], spec['dpi'], spec['fields'], spec['mode'], spec['profile'])
+    executor = RenderExecutor(workers=spec['concurrency'], mode=spec['pool'], max_queue=spec['batch'])
+    processor = DocumentProcessor(
+        os.path.join(spec['workdir'], "templates"), os.path.join(spec['workdir'], "config"), executor
+    )
+    config = processor.get_template_config(template_name)
+    data = sample_data(config.field_names, seed=spec['fields'])
+
+    with tempfile.TemporaryDirectory(prefix="bench_out_") as out_dir:
+        output_path = os.path.join(out_dir, "out", f"filled_{template_name}")
+
+        started = time.perf_counter()
+        if not processor.fill_document(template_name, data, output_path):
+            raise RuntimeError(f"Не удалось заполнить {template_name}")
+        cold_ms = (time.perf_counter() - started) * 1000
+        output_bytes = os.path.getsize(output_path)
+
+        timings = []
+        for _ in range(spec['runs']):
+            started = time.perf_counter()
+            processor.fill_document(template_name, data, output_path)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        async def batch() -> float:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(
+                processor.fill_document_async(template_name, data, os.path.join(out_dir, "batch", f"{i}.png"))
+                for i in range(spec['batch'])
+            ))
+            if not all(results):
+                raise RuntimeError(f"Пакет для {template_name} заполнен с ошибками")
+            return time.perf_counter() - started
+
+        batch_seconds = asyncio.run(batch())
+        executor.shutdown()
+
+    # ru_maxrss - килобайты в Linux и байты в macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+    mean_ms = statistics.mean(timings)
+    return {
+        'case': case_id(spec['dpi'], spec['fields']),
+        'dpi': spec['dpi'],
+        'fields': spec['fields'],
+        'size': list(a4_size(spec['dpi'])),
+        'cold_ms': round(cold_ms, 2),
+        'latency_ms_p50': round(statistics.median(timings), 2),
+        'latency_ms_p95': round(percentile(timings, 0.95), 2),
+        'latency_ms_min': round(min(timings), 2),
+        'throughput_per_s': round(1000 / mean_ms, 2),
+        'batch_size': spec['batch'],
+        'batch_wall_ms': round(batch_seconds * 1000, 1),
+        'batch_throughput_per_s': round(spec['batch'] / batch_seconds, 2),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'output_bytes': output_bytes,
+    }
+
+
+def run_isolated(spec: Dict) -> Dict:
+    """Выполнить случай в новом процессе (spawn), чтобы пиковая память не накапливалась между случаями"""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_case, (spec,))
+
+
+def compare(results: List[Dict], baseline: List[Dict], thresholds: Dict[str, Tuple[str, float]]) -> List[str]:
+    """Сравнить результаты с базовыми; вернуть описания регрессий"""
+    baseline_by_case = {row['case']: row for row in baseline}
+    regressions = []
+    for row in results:
+        base = baseline_by_case.get(row['case'])
+        if not base:
+            continue
+        for metric, (direction, limit) in thresholds.items():
+            if metric not in row or not base.get(metric):
+                continue
+            change = (row[metric] - base[metric]) / base[metric]
+            worse = change if direction == 'lower_is_better' else -change
+            if worse > limit:
+                regressions.append(
+                    f"{row['case']}: {metric} {base[metric]} -> {row[metric]} ({change:+.1%}, допустимо {limit:.0%})"
+                )
+    return regressions
+
+
+def parse_thresholds(overrides: List[str],
+                     defaults: Optional[Dict[str, Tuple[str, float]]] = None) -> Dict[str, Tuple[str, float]]:
+    thresholds = dict(defaults or THRESHOLDS)
+    for item in overrides:
+        metric, _, value = item.partition("=")
+        if metric not in thresholds or not value:
+            raise SystemExit(f"Неизвестный порог: {item} (доступны: {', '.join(thresholds)})")
+        thresholds[metric] = (thresholds[metric][0], float(value))
+    return thresholds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка, пропускная способность, память и размер результата fill_document")
+    parser.add_argument('--dpi', type=int, nargs='+', default=[150, 300, 600], help="разрешения шаблонов A4")
+    parser.add_argument('--fields', type=int, nargs='+', default=[5, 50, 200], help="количество полей")
+    parser.add_argument('--runs', type=int, default=10, help="последовательных заполнений на случай")
+    parser.add_argument('--batch', type=int, default=20, help="документов в параллельном пакете")
+    parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1, help="воркеров пула рендеринга")
+    parser.add_argument('--pool', choices=('thread', 'process'), default='thread', help="тип пула рендеринга")
+    parser.add_argument('--mode', choices=('RGB', 'P', 'L'), default='RGB', help="режим изображения шаблона")
+    parser.add_argument('--profile', help="профиль кодирования (по умолчанию - формат шаблона)")
+    parser.add_argument('--workdir', help="каталог для синтетических шаблонов (по умолчанию - временный)")
+    parser.add_argument('--json', dest='json_path', help="сохранить результаты в JSON")
+    parser.add_argument('--baseline', help="сравнить с базовыми результатами из JSON")
+    parser.add_argument('--save-baseline', help="сохранить результаты как базовые")
+    parser.add_argument('--threshold', action='append', default=[], metavar='METRIC=FRACTION',
+                        help="допустимое ухудшение метрики, например latency_ms_p50=0.1")
+    args = parser.parse_args()
+    thresholds = parse_thresholds(args.threshold)
+
+    with tempfile.TemporaryDirectory(prefix="bench_templates_") as tmp_dir:
+        workdir = args.workdir or tmp_dir
+        results = []
+        for dpi in args.dpi:
+            for fields in args.fields:
+                spec = {
+                    'workdir': workdir, 'dpi': dpi, 'fields': fields, 'mode': args.mode, 'profile': args.profile,
+                    'runs': args.runs, 'batch': args.batch, 'concurrency': args.concurrency, 'pool': args.pool,
+                }
+                row = run_isolated(spec)
+                results.append(row)
+                print(f"{row['case']:<20} p50 {row['latency_ms_p50']:>9.1f} мс  p95 {row['latency_ms_p95']:>9.1f} мс  "
+                      f"пакет {row['batch_throughput_per_s']:>7.1f}/с  RSS {row['peak_rss_mb']:>7.1f} МБ  "
+                      f"{row['output_bytes']:>10} байт")
+
+    from PIL import __version__ as pillow_version
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pillow': pillow_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pool': args.pool,
+            'concurrency': args.concurrency,
+            'mode': args.mode,
+            'profile': args.profile,
+        },
+        'results': results,
+    }
+
+    for path in (args.json_path, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], thresholds)
+        if regressions:
+            print("\nРегрессии относительно базовых результатов:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nРегрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочных тестов
+
+Бот подключается к ней через TELEGRAM_API_URL (или параметр api_url у DocumentBot).
+Заглушка отдает обновления через getUpdates и запоминает ответы бота, чтобы
+тест мог дождаться ответа в нужный чат и измерить задержку. Поддерживаются
+текстовые сообщения, фото и документы (загруженные файлы только считаются),
+редактирование сообщений и ответы на нажатия кнопок.
+"""
+from aiohttp import web
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Mock", "username": "mock_bot"}
+
+
+class MockBotApi:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._updates: List[Dict] = []
+        self._updates_event = asyncio.Event()
+        self._waiters: Dict[int, List[asyncio.Future]] = defaultdict(list)
+        self._replies: Dict[int, asyncio.Queue] = {}
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self.uploaded_bytes = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for waiters in self._waiters.values():
+            for future in waiters:
+                future.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+
+    def push_update(self, update: Dict):
+        """Поставить обновление в очередь getUpdates"""
+        self._updates.append(update)
+        self._updates_event.set()
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        """Future, который завершится, когда бот ответит в чат chat_id (значение - имя метода)"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return future
+
+    def subscribe(self, chat_id: int):
+        """Собирать все ответы бота в чат chat_id для next_reply"""
+        self._replies.setdefault(chat_id, asyncio.Queue())
+
+    def unsubscribe(self, chat_id: int):
+        self._replies.pop(chat_id, None)
+
+    def drain(self, chat_id: int) -> int:
+        """Отбросить непрочитанные ответы в чат; возвращает их количество"""
+        replies = self._replies.get(chat_id)
+        dropped = 0
+        while replies is not None and not replies.empty():
+            replies.get_nowait()
+            dropped += 1
+        return dropped
+
+    async def next_reply(self, chat_id: int, timeout: Optional[float] = None) -> Tuple[str, Dict]:
+        """
+        Следующий ответ бота в чат, на который оформлена подписка
+
+        Returns:
+            (имя метода, сообщение в формате Bot API)
+
+        Raises:
+            asyncio.TimeoutError: бот не ответил за timeout секунд
+        """
+        return await asyncio.wait_for(self._replies[chat_id].get(), timeout)
+
+    def _resolve(self, chat_id: int, method: str, message: Optional[Dict] = None):
+        replies = self._replies.get(chat_id)
+        if replies is not None:
+            replies.put_nowait((method, message))
+        waiters = self._waiters.get(chat_id)
+        while waiters:
+            future = waiters.pop(0)
+            if not future.done():
+                future.set_result(method)
+                return
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = {}
+        if request.can_read_body:
+            for key, value in (await request.post()).items():
+                if isinstance(value, web.FileField):
+                    # Содержимое файлов не хранится, только учитывается объем
+                    self.uploaded_bytes += len(value.file.read())
+                    value = {'filename': value.filename}
+                params[key] = value
+        handler = getattr(self, f"_method_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _method_getMe(self, params: Dict):
+        return BOT_USER
+
+    async def _method_getUpdates(self, params: Dict):
+        timeout = float(params.get("timeout", 0) or 0)
+        if not self._updates and timeout:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit", 100) or 100)
+        updates, self._updates = self._updates[:limit], self._updates[limit:]
+        return updates
+
+    def _message(self, params: Dict, **extra) -> Dict:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = json.loads(params["reply_markup"])
+        message.update(extra)
+        return message
+
+    def _file(self, params: Dict, key: str) -> Dict:
+        """Описание загруженного файла (или повторная отправка по file_id)"""
+        value = params.get(key)
+        file_id = value if isinstance(value, str) else f"mock-file-{next(self._file_ids)}"
+        return {"file_id": file_id, "file_unique_id": file_id}
+
+    async def _method_sendMessage(self, params: Dict):
+        message = self._message(params, text=str(params.get("text", "")))
+        self._resolve(message["chat"]["id"], "sendMessage", message)
+        return message
+
+    async def _method_sendPhoto(self, params: Dict):
+        photo = dict(self._file(params, "photo"), width=1, height=1)
+        message = self._message(params, photo=[photo], caption=str(params.get("caption", "")))
+        self._resolve(message["chat"]["id"], "sendPhoto", message)
+        return message
+
+    async def _method_sendDocument(self, params: Dict):
+        document = self._file(params, "document")
+        if isinstance(params.get("document"), dict):
+            document["file_name"] = params["document"]["filename"]
+        message = self._message(params, document=document, caption=str(params.get("caption", "")))
+        self._resolve(message["chat"]["id"], "sendDocument", message)
+        return message
+
+    async def _method_editMessageText(self, params: Dict):
+        message = self._message(params, text=str(params.get("text", "")), edit_date=int(time.time()))
+        message["message_id"] = int(params["message_id"])
+        self._resolve(message["chat"]["id"], "editMessageText", message)
+        return message
+
+    async def _method_editMessageReplyMarkup(self, params: Dict):
+        return True
+
+    async def _method_answerCallbackQuery(self, params: Dict):
+        return True
@@ -0,0 +1,78 @@
+"""
+Бенчмарк профилей кодирования готовых документов
+
+Запуск из корня проекта:
+    python -m benchmarks.output_profiles
+    python -m benchmarks.output_profiles --template vacation_request.png --runs 10 --json profiles.json
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from typing import Dict, List
+
+from image_processor import DocumentProcessor
+from output_profiles import BUILTIN_PROFILES, IMAGE_FORMATS, encode_image
+
+
+def sample_data(field_names) -> Dict[str, str]:
+    """Тестовые значения для всех полей шаблона"""
+    return {name: f"Иванов Иван Иванович {i}" for i, name in enumerate(field_names)}
+
+
+def benchmark_template(processor: DocumentProcessor, template_name: str, runs: int) -> List[Dict]:
+    config = processor.get_template_config(template_name)
+    if not config:
+        print(f"Пропуск {template_name}: нет конфигурации")
+        return []
+
+    image = processor.render_document(template_name, sample_data(config.field_names))
+    template_format = IMAGE_FORMATS.get(os.path.splitext(template_name)[1].lower(), 'PNG')
+
+    results = []
+    for name, profile in BUILTIN_PROFILES.items():
+        timings = []
+        content = b''
+        for _ in range(runs):
+            started = time.perf_counter()
+            content = encode_image(image, profile, template_format)
+            timings.append((time.perf_counter() - started) * 1000)
+        results.append({
+            'template': template_name,
+            'size': list(image.size),
+            'profile': name,
+            'encode_ms_median': round(statistics.median(timings), 3),
+            'encode_ms_min': round(min(timings), 3),
+            'bytes': len(content),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время кодирования и размер документа для каждого профиля вывода")
+    parser.add_argument('--template', action='append', help="шаблон (по умолчанию - все с конфигурацией)")
+    parser.add_argument('--runs', type=int, default=5, help="повторов на профиль")
+    parser.add_argument('--json', dest='json_path', help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    processor = DocumentProcessor()
+    templates = args.template or [name for name in processor.get_available_templates()
+                                  if processor.get_template_config(name)]
+
+    results = []
+    for template_name in templates:
+        results.extend(benchmark_template(processor, template_name, args.runs))
+
+    print(f"{'шаблон':<30} {'профиль':<12} {'медиана, мс':>12} {'мин, мс':>10} {'байт':>10}")
+    for row in results:
+        print(f"{row['template']:<30} {row['profile']:<12} {row['encode_ms_median']:>12.2f} "
+              f"{row['encode_ms_min']:>10.2f} {row['bytes']:>10}")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Нагрузочный тест приема обновлений: polling против webhook
+
+Бот работает против локальной заглушки Bot API, поэтому тест не обращается к Telegram.
+Каждое синтетическое обновление - команда /start от отдельного пользователя; задержка
+измеряется от отправки обновления до получения заглушкой ответа бота.
+
+Запуск из корня проекта:
+    python -m benchmarks.update_load --updates 2000 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.mock_bot_api import MockBotApi
+from bot import DocumentBot
+from webhook import SECRET_HEADER, WebhookServer
+
+TOKEN = "123456:LOAD-TEST-TOKEN"
+SECRET = "load-test-secret"
+
+
+def make_update(update_id: int, chat_id: int, text: str = "/start") -> Dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"},
+            "text": text,
+        },
+    }
+
+
+def summarize(mode: str, latencies: List[float], elapsed: float) -> Dict:
+    latencies = sorted(latencies)
+    return {
+        'mode': mode,
+        'updates': len(latencies),
+        'throughput_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+    }
+
+
+async def run_polling(updates: int, concurrency: int) -> Dict:
+    api = MockBotApi()
+    await api.start()
+    bot = DocumentBot(TOKEN, api_url=api.url)
+    polling = asyncio.create_task(bot.dp.start_polling(bot.bot, handle_signals=False, polling_timeout=1))
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def send(i: int):
+        async with semaphore:
+            chat_id = 100000 + i
+            reply = api.expect_reply(chat_id)
+            started = time.perf_counter()
+            api.push_update(make_update(i + 1, chat_id))
+            await reply
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(send(i) for i in range(updates)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.dp.stop_polling()
+        await polling
+        await api.stop()
+    return summarize('polling', latencies, elapsed)
+
+
+async def run_webhook(updates: int, concurrency: int, max_concurrent: int) -> Dict:
+    api = MockBotApi()
+    await api.start()
+    bot = DocumentBot(TOKEN, api_url=api.url)
+    server = WebhookServer(bot.bot, bot.dp, path="/webhook", secret_token=SECRET, max_concurrent=max_concurrent)
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook"
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def send(session: aiohttp.ClientSession, i: int):
+        async with semaphore:
+            chat_id = 200000 + i
+            reply = api.expect_reply(chat_id)
+            started = time.perf_counter()
+            async with session.post(url, json=make_update(i + 1, chat_id), headers={SECRET_HEADER: SECRET}) as response:
+                response.raise_for_status()
+            await reply
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(send(session, i) for i in range(updates)))
+            elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+        await bot.bot.session.close()
+        await api.stop()
+    return summarize('webhook', latencies, elapsed)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность и p99 задержки для polling и webhook")
+    parser.add_argument('--updates', type=int, default=1000, help="количество обновлений на режим")
+    parser.add_argument('--concurrency', type=int, default=50, help="одновременно отправляемых обновлений")
+    parser.add_argument('--max-concurrent', type=int, default=50, help="лимит обработки в webhook-сервере")
+    parser.add_argument('--mode', choices=('both', 'polling', 'webhook'), default='both')
+    parser.add_argument('--json', dest='json_path', help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = []
+    if args.mode in ('both', 'polling'):
+        results.append(await run_polling(args.updates, args.concurrency))
+    if args.mode in ('both', 'webhook'):
+        results.append(await run_webhook(args.updates, args.concurrency, args.max_concurrent))
+
+    print(f"{'режим':<10} {'обновлений':>10} {'в секунду':>10} {'p50, мс':>10} {'p99, мс':>10} {'max, мс':>10}")
+    for row in results:
+        print(f"{row['mode']:<10} {row['updates']:>10} {row['throughput_per_s']:>10} "
+              f"{row['p50_ms']:>10} {row['p99_ms']:>10} {row['max_ms']:>10}")
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,18 +1,36 @@
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile, FSInputFile
+from aiohttp import web
 import asyncio
 import logging
 import os
+import re
+import shutil
+import tempfile
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 
+from activity_stats import DAY, HOUR, ActivityStats
 from auth import AuthManager
+from event_log import EventLog, format_entry
+from file_id_cache import FileIdCache
+from batch import BATCH_EXTENSIONS, BatchError, PdfPartWriter, ZipPartWriter, read_rows, render_batch
 from image_processor import DocumentProcessor
+from metrics import METRICS, STAGES, SamplingProfiler, start_metrics_server
+from output_profiles import BUILTIN_PROFILES
+from rate_limit import RateLimiter
+from render_executor import RenderQueueFull
+from retention import RetentionManager
+from state_storage import create_storage_from_env
+from webhook import WebhookServer
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -20,16 +38,24 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 user_logger = logging.getLogger('user_activity')
 
+TEMPLATES_PER_PAGE = 10
+
 class DocumentFillStates(StatesGroup):
     waiting_for_template = State()
     waiting_for_data = State()
     waiting_for_config = State()
+    waiting_for_batch_file = State()
+    waiting_for_confirmation = State()
 
 class DocumentBot:
-    def __init__(self, bot_token: str):
-        self.bot = Bot(token=bot_token)
-        self.dp = Dispatcher(storage=MemoryStorage())
-        self.auth_manager = AuthManager()
+    def __init__(self, bot_token: str, api_url: Optional[str] = None):
+        # Адрес Bot API можно переопределить (локальный Bot API сервер или заглушка для тестов)
+        api_url = api_url or os.getenv("TELEGRAM_API_URL")
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+        self.bot = Bot(token=bot_token, session=session)
+        storage, session_store = create_storage_from_env()
+        self.dp = Dispatcher(storage=storage)
+        self.auth_manager = AuthManager(session_store)
         self.document_processor = DocumentProcessor()
 
         # ID администратора из переменной окружения
@@ -41,6 +67,49 @@ class DocumentBot:
         else:
             logger.warning("No admin ID configured - admin commands will be disabled")
 
+        # Журнал активности для /logs (в него пишет логгер user_activity, см. main.py)
+        self.event_log = EventLog.from_env()
+
+        # Счетчики активности для /stats (обновляются при каждом событии)
+        self.activity_stats = ActivityStats(os.getenv("STATS_PATH", "data/activity_stats.json"))
+        self.stats_flush_interval = float(os.getenv("STATS_FLUSH_SECONDS", "30"))
+        self._stats_task: Optional[asyncio.Task] = None
+
+        # Файловые операции обработчиков выполняются вне event loop
+        self.storage = self.document_processor.storage
+        self.refresh_interval = float(os.getenv("CONFIG_RELOAD_INTERVAL", "5"))
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Готовые документы: каталоги по датам, манифест и очистка по правилам хранения
+        self.retention = RetentionManager.from_env()
+        self.retention_interval = float(os.getenv("RETENTION_SWEEP_INTERVAL_MINUTES", "60")) * 60
+        self._retention_task: Optional[asyncio.Task] = None
+
+        # file_id отправленных документов: повторный запрос с теми же данными не рендерится
+        self.file_id_cache = FileIdCache(
+            max_entries=int(os.getenv("FILE_ID_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("FILE_ID_CACHE_TTL_HOURS", "24")) * 3600
+        )
+        self.document_processor.config_registry.add_listener(self.file_id_cache.invalidate_templates)
+
+        # Метрики этапов рендеринга и профилировщик для /perf
+        self.metrics_port = int(os.getenv("METRICS_PORT", "0") or 0)
+        self.metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+        self._metrics_runner: Optional[web.AppRunner] = None
+        self.profiler = SamplingProfiler(interval=float(os.getenv("PROFILER_INTERVAL_MS", "5")) / 1000)
+        self._register_gauges()
+
+        # Частота заполнений на пользователя (администратор не ограничен)
+        self.rate_limiter = RateLimiter.from_env()
+
+        # Черновик перед заполнением в /fill (в /preview - всегда)
+        self.fill_preview = os.getenv("FILL_PREVIEW", "1").strip().lower() not in ("0", "false", "no")
+
+        # Ограничения пакетного заполнения
+        self.batch_max_rows = int(os.getenv("BATCH_MAX_ROWS", "1000"))
+        self.batch_part_bytes = int(os.getenv("BATCH_ZIP_PART_MB", "45")) * 1024 * 1024
+        self.batch_pdf_pages = int(os.getenv("BATCH_PDF_PAGES", "100"))
+
         # Регистрируем обработчики
         self._register_handlers()
 
@@ -52,16 +121,89 @@ class DocumentBot:
         self.dp.message.register(self.cmd_logout, Command("logout"))
         self.dp.message.register(self.cmd_templates, Command("templates"))
         self.dp.message.register(self.cmd_fill, Command("fill"))
+        self.dp.message.register(self.cmd_preview, Command("preview"))
+        self.dp.message.register(self.cmd_batch, Command("batch"))
         self.dp.message.register(self.cmd_config, Command("config"))
 
         # Админские команды
         self.dp.message.register(self.cmd_logs, Command("logs"))
         self.dp.message.register(self.cmd_stats, Command("stats"))
+        self.dp.message.register(self.cmd_perf, Command("perf"))
 
         # FSM handlers
         self.dp.message.register(self.process_template_selection, DocumentFillStates.waiting_for_template)
         self.dp.message.register(self.process_data_input, DocumentFillStates.waiting_for_data)
+        # Исправленные данные вместо нажатия кнопки - новый черновик
+        self.dp.message.register(self.process_data_input, DocumentFillStates.waiting_for_confirmation)
         self.dp.message.register(self.process_config_input, DocumentFillStates.waiting_for_config)
+        self.dp.message.register(self.process_batch_file, DocumentFillStates.waiting_for_batch_file)
+
+        # Кнопки каталога шаблонов
+        self.dp.callback_query.register(self.cb_templates_page, F.data.startswith("tpl_page:"))
+        self.dp.callback_query.register(self.cb_fill_page, DocumentFillStates.waiting_for_template,
+                                        F.data.startswith("fill_page:"))
+        self.dp.callback_query.register(self.cb_template_pick, DocumentFillStates.waiting_for_template,
+                                        F.data.startswith("tpl_pick:"))
+
+        # Кнопки черновика
+        self.dp.callback_query.register(self.cb_preview_confirm, DocumentFillStates.waiting_for_confirmation,
+                                        F.data == "preview:ok")
+        self.dp.callback_query.register(self.cb_preview_edit, DocumentFillStates.waiting_for_confirmation,
+                                        F.data == "preview:edit")
+        self.dp.callback_query.register(self.cb_preview_expired, F.data.startswith("preview:"))
+
+    def _register_gauges(self):
+        """Мгновенные значения пула рендеринга и кэшей для /metrics"""
+        executor = self.document_processor.render_executor
+        font_cache = self.document_processor.font_cache
+        template_cache = self.document_processor.template_cache
+        METRICS.add_gauge("docbot_render_queue_depth", "Документов в очереди рендеринга", lambda: executor.queue_depth)
+        METRICS.add_gauge("docbot_render_active", "Документов в работе", lambda: executor.active)
+        METRICS.add_gauge("docbot_render_waiting_users", "Пользователей с документами в очереди",
+                          lambda: executor.waiting_owners)
+        METRICS.add_gauge("docbot_rate_limited_total", "Запросов, отклоненных ограничением частоты",
+                          lambda: self.rate_limiter.limited)
+        METRICS.add_gauge("docbot_font_cache_hit_ratio", "Доля попаданий в кэш шрифтов",
+                          lambda: font_cache.stats()['hit_rate'])
+        METRICS.add_gauge("docbot_template_cache_hit_ratio", "Доля попаданий в кэш шаблонов",
+                          lambda: template_cache.stats()['hit_rate'])
+        METRICS.add_gauge("docbot_template_cache_bytes", "Размер кэша шаблонов, байт",
+                          lambda: template_cache.stats()['bytes'])
+        METRICS.add_gauge("docbot_file_id_cache_hit_ratio", "Доля документов, отправленных по file_id",
+                          lambda: self.file_id_cache.stats()['hit_rate'])
+        METRICS.add_gauge("docbot_template_cache_evictions", "Вытеснений из кэша шаблонов",
+                          lambda: template_cache.stats()['evictions'])
+
+    def _log_event(self, event: str, user: types.User, template: Optional[str] = None,
+                   details: str = "", level: int = logging.INFO, count: int = 1):
+        """Записать событие в журнал активности и учесть его в счетчиках статистики"""
+        text = f"{event} - User: {user.id} (@{user.username or 'Unknown'}, {user.first_name or 'Unknown'})"
+        if template:
+            text += f" - Template: {template}"
+        if details:
+            text += f" - {details}"
+        user_logger.log(level, text, extra={
+            'event': event, 'user_id': user.id, 'username': user.username,
+            'first_name': user.first_name, 'template': template, 'details': details or None
+        })
+        self.activity_stats.record(event, user.id, template, count)
+
+    def _is_admin(self, user_id: int) -> bool:
+        return self.admin_id is not None and user_id == self.admin_id
+
+    async def _check_rate_limit(self, message: types.Message, template: Optional[str]) -> bool:
+        """Проверить ограничение частоты заполнений; False - пользователь получил просьбу подождать"""
+        if self._is_admin(message.from_user.id):
+            return True
+        retry_after = self.rate_limiter.acquire(message.from_user.id)
+        if retry_after is None:
+            return True
+        self._log_event("RATE_LIMITED", message.from_user, template,
+                        details=f"Retry after: {retry_after:.0f}s", level=logging.WARNING)
+        await message.answer(
+            f"⏳ Слишком много документов подряд. Отправьте данные еще раз через {max(1, round(retry_after))} с."
+        )
+        return False
 
     async def cmd_start(self, message: types.Message):
         """Команда /start"""
@@ -76,6 +218,8 @@ class DocumentBot:
 📋 **Доступные команды:**
 `/templates` - показать доступные шаблоны
 `/fill` - заполнить документ
+`/preview` - заполнить документ с черновиком
+`/batch` - пакетное заполнение по таблице
 `/config` - настроить поля шаблона
 `/help` - помощь
 `/logout` - выйти из системы
@@ -92,7 +236,11 @@ class DocumentBot:
 **Основные команды:**
 • `/login <пароль>` - авторизация
 • `/templates` - список шаблонов документов
+• `/templates <запрос>` - поиск шаблона по названию, категории или тегам
 • `/fill` - заполнить документ данными
+• `/preview` - сначала показать черновик, затем заполнить документ
+• `/batch` - заполнить шаблон для каждой строки CSV/XLSX и получить ZIP-архив (`/batch pdf` - многостраничный PDF)
+• `/fill <формат>` - заполнить и получить в формате `original`, `png`, `png_fast`, `png_small`, `png_palette`, `jpeg`, `webp` или `pdf`
 • `/config` - настроить координаты полей
 
 **Процесс заполнения документа:**
@@ -119,7 +267,11 @@ class DocumentBot:
 
 **Команды администратора:**
 • `/logs` - просмотр логов активности пользователей
+• `/logs 50 user=<id> event=LOGIN_FAILED` - логи с фильтрами (также `template=<шаблон>`)
 • `/stats` - статистика использования бота
+• `/stats 24h`, `/stats 7d` - статистика за период
+• `/perf` - время этапов рендеринга
+• `/perf profile on|off` - профилировщик
             """
 
         await message.answer(help_text, parse_mode="Markdown")
@@ -127,92 +279,183 @@ class DocumentBot:
     async def cmd_login(self, message: types.Message):
         """Команда /login"""
         user_id = message.from_user.id
-        username = message.from_user.username or "Unknown"
-        first_name = message.from_user.first_name or "Unknown"
 
-        user_logger.info(f"LOGIN_ATTEMPT - User: {user_id} (@{username}, {first_name})")
+        self._log_event("LOGIN_ATTEMPT", message.from_user)
 
         args = message.text.split(' ', 1)
         if len(args) < 2:
-            user_logger.info(f"LOGIN_FAILED - User: {user_id} - Reason: No password provided")
+            self._log_event("LOGIN_FAILED", message.from_user, details="Reason: No password provided")
             await message.answer("❌ Укажите пароль: `/login <пароль>`", parse_mode="Markdown")
             return
 
         password = args[1]
-        if self.auth_manager.authenticate(user_id, password):
-            user_logger.info(f"LOGIN_SUCCESS - User: {user_id} (@{username}, {first_name})")
+        if await self.auth_manager.authenticate(user_id, password):
+            self._log_event("LOGIN_SUCCESS", message.from_user)
             await message.answer("✅ Успешная авторизация! Теперь вы можете использовать бота.")
         else:
-            user_logger.info(f"LOGIN_FAILED - User: {user_id} (@{username}, {first_name}) - Reason: Wrong password")
+            self._log_event("LOGIN_FAILED", message.from_user, details="Reason: Wrong password")
             await message.answer("❌ Неверный пароль. Доступ запрещен.")
 
     async def cmd_logout(self, message: types.Message):
         """Команда /logout"""
-        self.auth_manager.logout(message.from_user.id)
+        await self.auth_manager.logout(message.from_user.id)
         await message.answer("👋 Вы вышли из системы.")
 
+    def _templates_page(self, page: int, pick: bool) -> Tuple[str, Optional[types.InlineKeyboardMarkup]]:
+        """Сформировать текст и клавиатуру для страницы каталога шаблонов"""
+        catalog = self.document_processor.catalog
+        entries, total_pages = catalog.page(page, TEMPLATES_PER_PAGE)
+        page = min(max(page, 0), total_pages - 1)
+        start = page * TEMPLATES_PER_PAGE
+
+        text = "\n".join(f"{start + i + 1}. {entry.name}" for i, entry in enumerate(entries))
+        text += f"\n\nСтраница {page + 1}/{total_pages}, всего шаблонов: {len(catalog)}"
+
+        rows = []
+        if pick:
+            rows = [[types.InlineKeyboardButton(text=entry.name, callback_data=f"tpl_pick:{entry.id}")]
+                    for entry in entries]
+        prefix = "fill_page" if pick else "tpl_page"
+        nav = []
+        if page > 0:
+            nav.append(types.InlineKeyboardButton(text="◀️", callback_data=f"{prefix}:{page - 1}"))
+        if page < total_pages - 1:
+            nav.append(types.InlineKeyboardButton(text="▶️", callback_data=f"{prefix}:{page + 1}"))
+        if nav:
+            rows.append(nav)
+        return text, types.InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+    @staticmethod
+    def _pick_keyboard(entries) -> types.InlineKeyboardMarkup:
+        return types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text=entry.name, callback_data=f"tpl_pick:{entry.id}")]
+            for entry in entries
+        ])
+
     async def cmd_templates(self, message: types.Message):
         """Показать доступные шаблоны"""
-        if not self.auth_manager.is_authenticated(message.from_user.id):
+        if not await self.auth_manager.is_authenticated(message.from_user.id):
             await message.answer("🔐 Доступ запрещен. Введите команду /login <пароль> для входа в систему.")
             return
 
-        templates = self.document_processor.get_available_templates()
-
-        if not templates:
+        catalog = self.document_processor.catalog
+        if not len(catalog):
             await message.answer("📄 Шаблоны документов не найдены.")
             return
 
-        template_list = "\n".join([f"• {template}" for template in templates])
-        await message.answer(f"📋 Доступные шаблоны:\n\n{template_list}")
+        # /templates <запрос> - поиск по имени, категории и тегам
+        args = message.text.split(' ', 1)
+        if len(args) > 1 and args[1].strip():
+            results = catalog.search(args[1], limit=TEMPLATES_PER_PAGE)
+            if not results:
+                await message.answer("🔎 Ничего не найдено.")
+                return
+            template_list = "\n".join([f"• {entry.name}" for entry in results])
+            await message.answer(f"🔎 Найденные шаблоны:\n\n{template_list}")
+            return
+
+        text, keyboard = self._templates_page(0, pick=False)
+        await message.answer(f"📋 Доступные шаблоны:\n\n{text}", reply_markup=keyboard)
+
+    async def cb_templates_page(self, callback: types.CallbackQuery):
+        """Переключение страниц списка шаблонов"""
+        if not await self.auth_manager.is_authenticated(callback.from_user.id):
+            await callback.answer("🔐 Доступ запрещен.", show_alert=True)
+            return
+
+        page = int(callback.data.split(":", 1)[1])
+        text, keyboard = self._templates_page(page, pick=False)
+        await callback.message.edit_text(f"📋 Доступные шаблоны:\n\n{text}", reply_markup=keyboard)
+        await callback.answer()
 
     async def cmd_fill(self, message: types.Message, state: FSMContext):
         """Начать процесс заполнения документа"""
-        if not self.auth_manager.is_authenticated(message.from_user.id):
+        await self._start_template_selection(message, state, batch=False, preview=self.fill_preview)
+
+    async def cmd_preview(self, message: types.Message, state: FSMContext):
+        """Начать заполнение документа с черновиком"""
+        await self._start_template_selection(message, state, batch=False, preview=True)
+
+    async def cmd_batch(self, message: types.Message, state: FSMContext):
+        """Начать пакетное заполнение документа по таблице"""
+        await self._start_template_selection(message, state, batch=True)
+
+    async def _start_template_selection(self, message: types.Message, state: FSMContext, batch: bool,
+                                        preview: bool = False):
+        """Показать шаблоны для выбора в /fill, /preview и /batch"""
+        if not await self.auth_manager.is_authenticated(message.from_user.id):
             await message.answer("🔐 Доступ запрещен. Введите команду /login <пароль> для входа в систему.")
             return
 
-        templates = self.document_processor.get_available_templates()
-
-        if not templates:
+        if not len(self.document_processor.catalog):
             await message.answer("📄 Шаблоны документов не найдены.")
             return
 
-        template_list = "\n".join([f"{i+1}. {template}" for i, template in enumerate(templates)])
+        # /fill <профиль>, /preview <профиль>, /batch <профиль> - формат результата
+        args = message.text.split(' ', 1)
+        output_profile = args[1].strip() if len(args) > 1 and args[1].strip() else None
+        if output_profile and output_profile not in BUILTIN_PROFILES:
+            await message.answer(f"❌ Неизвестный формат. Доступные: {', '.join(BUILTIN_PROFILES)}")
+            return
 
+        text, keyboard = self._templates_page(0, pick=True)
         await message.answer(
-            f"📋 Выберите шаблон для заполнения:\n\n{template_list}\n\n"
-            "Отправьте номер шаблона или его название:"
+            f"📋 Выберите шаблон для заполнения:\n\n{text}\n\n"
+            "Нажмите на шаблон, отправьте его номер или часть названия для поиска:",
+            reply_markup=keyboard
         )
 
-        await state.update_data(templates=templates)
+        await state.set_data({'output_profile': output_profile, 'batch': batch, 'preview': preview})
         await state.set_state(DocumentFillStates.waiting_for_template)
 
+    async def cb_fill_page(self, callback: types.CallbackQuery):
+        """Переключение страниц при выборе шаблона для заполнения"""
+        page = int(callback.data.split(":", 1)[1])
+        text, keyboard = self._templates_page(page, pick=True)
+        await callback.message.edit_text(
+            f"📋 Выберите шаблон для заполнения:\n\n{text}\n\n"
+            "Нажмите на шаблон, отправьте его номер или часть названия для поиска:",
+            reply_markup=keyboard
+        )
+        await callback.answer()
+
+    async def cb_template_pick(self, callback: types.CallbackQuery, state: FSMContext):
+        """Выбор шаблона кнопкой"""
+        entry = self.document_processor.catalog.get_by_id(int(callback.data.split(":", 1)[1]))
+        if not entry:
+            await callback.answer("❌ Шаблон не найден.", show_alert=True)
+            return
+        await callback.answer()
+        await self._select_template(callback.message, state, entry.name)
+
     async def process_template_selection(self, message: types.Message, state: FSMContext):
         """Обработка выбора шаблона"""
-        data = await state.get_data()
-        templates = data.get('templates', [])
-
-        selected_template = None
+        catalog = self.document_processor.catalog
+        query = (message.text or "").strip()
 
         # Попытка найти шаблон по номеру или названию
-        try:
-            index = int(message.text) - 1
-            if 0 <= index < len(templates):
-                selected_template = templates[index]
-        except ValueError:
-            # Поиск по названию
-            for template in templates:
-                if message.text.lower() in template.lower():
-                    selected_template = template
-                    break
-
-        if not selected_template:
+        if query.isdigit():
+            entry = catalog.get_by_position(int(query) - 1)
+        else:
+            entry = catalog.find(query)
+            if not entry:
+                results = catalog.search(query, limit=TEMPLATES_PER_PAGE) if query else []
+                if len(results) > 1:
+                    await message.answer("🔎 Найдено несколько шаблонов, выберите нужный:",
+                                         reply_markup=self._pick_keyboard(results))
+                    return
+                entry = results[0] if results else None
+
+        if not entry:
             await message.answer("❌ Шаблон не найден. Попробуйте еще раз.")
             return
 
+        await self._select_template(message, state, entry.name)
+
+    async def _select_template(self, message: types.Message, state: FSMContext, selected_template: str):
+        """Проверить конфигурацию выбранного шаблона и запросить данные"""
         # Проверяем конфигурацию шаблона
-        config = self.document_processor.load_template_config(selected_template)
+        config = self.document_processor.get_template_config(selected_template)
         if not config:
             await message.answer(
                 f"❌ Конфигурация для шаблона '{selected_template}' не найдена.\n"
@@ -221,7 +464,7 @@ class DocumentBot:
             await state.clear()
             return
 
-        fields = list(config.get('fields', {}).keys())
+        fields = list(config.field_names)
         if not fields:
             await message.answer(f"❌ Поля для шаблона '{selected_template}' не настроены.")
             await state.clear()
@@ -229,6 +472,17 @@ class DocumentBot:
 
         fields_list = "\n".join([f"• {field}" for field in fields])
 
+        if (await state.get_data()).get('batch'):
+            await message.answer(
+                f"✅ Выбран шаблон: {selected_template}\n\n"
+                f"📎 Отправьте файл CSV или XLSX: первая строка - названия полей, "
+                f"далее по строке на каждый документ (не больше {self.batch_max_rows}).\n\n"
+                f"📝 Доступные поля:\n{fields_list}"
+            )
+            await state.update_data(selected_template=selected_template, fields=fields)
+            await state.set_state(DocumentFillStates.waiting_for_batch_file)
+            return
+
         await message.answer(
             f"✅ Выбран шаблон: {selected_template}\n\n"
             f"📝 Доступные поля:\n{fields_list}\n\n"
@@ -267,42 +521,313 @@ class DocumentBot:
             )
             return
 
-        # Генерируем документ
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"filled_{timestamp}_{selected_template}"
-        output_path = os.path.join("filled_documents", output_filename)
+        if not await self._check_rate_limit(message, selected_template):
+            return
 
-        success = self.document_processor.fill_document(
-            selected_template, fill_data, output_path
-        )
+        if data.get('preview'):
+            await self._send_preview(message, state, selected_template, fill_data)
+            return
 
-        if success:
-            try:
-                user_id = message.from_user.id
-                username = message.from_user.username or "Unknown"
-                user_logger.info(f"DOCUMENT_FILLED - User: {user_id} (@{username}) - Template: {selected_template} - Fields: {list(fill_data.keys())}")
+        await self._fill_and_send(message, message.from_user, state, data, fill_data)
 
-                # Отправляем заполненный документ
-                photo = FSInputFile(output_path)
+    async def _send_preview(self, message: types.Message, state: FSMContext, template_name: str,
+                            fill_data: Dict[str, str]):
+        """Отправить черновик в уменьшенном разрешении с кнопками подтверждения"""
+        user = message.from_user
+        try:
+            preview = await self.document_processor.render_preview_async(
+                template_name, fill_data, owner=user.id, priority=self._is_admin(user.id)
+            )
+        except RenderQueueFull:
+            self._log_event("RENDER_QUEUE_FULL", user, template_name, level=logging.WARNING)
+            await message.answer("⚠️ Сервер перегружен. Отправьте данные еще раз через минуту.")
+            return
+
+        if preview is None:
+            self._log_event("PREVIEW_ERROR", user, template_name, level=logging.ERROR)
+            await message.answer("❌ Ошибка при подготовке черновика.")
+            return
+
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[[
+            types.InlineKeyboardButton(text="✅ Заполнить", callback_data="preview:ok"),
+            types.InlineKeyboardButton(text="✏️ Исправить", callback_data="preview:edit"),
+        ]])
+        try:
+            with METRICS.timer("upload", template_name):
                 await message.answer_photo(
-                    photo,
-                    caption=f"✅ Документ успешно заполнен!\n\n"
-                           f"📄 Шаблон: {selected_template}\n"
-                           f"📝 Заполненные поля: {', '.join(fill_data.keys())}"
+                    BufferedInputFile(preview, filename="preview.jpg"),
+                    caption=(f"👀 Черновик: {template_name}\n\n"
+                             "Проверьте данные и нажмите «Заполнить» или отправьте исправленные данные."),
+                    reply_markup=keyboard
+                )
+        except Exception as e:
+            logger.error(f"Ошибка отправки черновика: {e}")
+            await message.answer("❌ Ошибка при отправке черновика.")
+            return
+
+        self._log_event("PREVIEW_SENT", user, template_name, details=f"Fields: {list(fill_data.keys())}")
+        await state.update_data(fill_data=fill_data)
+        await state.set_state(DocumentFillStates.waiting_for_confirmation)
+
+    async def cb_preview_confirm(self, callback: types.CallbackQuery, state: FSMContext):
+        """Черновик подтвержден - заполнить документ в полном разрешении"""
+        data = await state.get_data()
+        if not data.get('selected_template') or not data.get('fill_data'):
+            await callback.answer("❌ Черновик устарел. Начните заново: /fill", show_alert=True)
+            await state.clear()
+            return
+        await callback.answer()
+        # Состояние меняется сразу, чтобы повторное нажатие не заполнило документ дважды;
+        # если заполнить не удалось, пользователь может отправить данные еще раз
+        await state.set_state(DocumentFillStates.waiting_for_data)
+        try:
+            await callback.message.edit_reply_markup(reply_markup=None)
+        except Exception as e:
+            logger.debug(f"Не удалось убрать кнопки черновика: {e}")
+        await self._fill_and_send(callback.message, callback.from_user, state, data, data['fill_data'])
+
+    async def cb_preview_edit(self, callback: types.CallbackQuery, state: FSMContext):
+        """Исправить данные черновика"""
+        data = await state.get_data()
+        await callback.answer()
+        try:
+            await callback.message.edit_reply_markup(reply_markup=None)
+        except Exception as e:
+            logger.debug(f"Не удалось убрать кнопки черновика: {e}")
+        previous = "\n".join(f"{key}={value}" for key, value in data.get('fill_data', {}).items())
+        await callback.message.answer(
+            f"✏️ Отправьте исправленные данные в формате поле=значение.\n\nПредыдущие данные:\n{previous}"
+        )
+        await state.set_state(DocumentFillStates.waiting_for_data)
+
+    async def cb_preview_expired(self, callback: types.CallbackQuery):
+        """Кнопка черновика, который уже подтвержден или заменен"""
+        await callback.answer("Этот черновик уже не актуален.")
+
+    async def _fill_and_send(self, message: types.Message, user: types.User, state: FSMContext,
+                             data: Dict[str, Any], fill_data: Dict[str, str]):
+        """
+        Заполнить документ в полном разрешении и отправить его
+
+        Args:
+            message: сообщение, в чат которого отправляется документ
+            user: пользователь, заполняющий документ (при подтверждении черновика - не автор message)
+        """
+        selected_template = data['selected_template']
+        started = time.perf_counter()
+        profile = self.document_processor.resolve_output_profile(selected_template, data.get('output_profile'))
+        caption = (f"✅ Документ успешно заполнен!\n\n"
+                   f"📄 Шаблон: {selected_template}\n"
+                   f"📝 Заполненные поля: {', '.join(fill_data.keys())}")
+
+        # Тот же шаблон с теми же данными уже отправлялся - отправляем по file_id
+        cache_key = None
+        if self.file_id_cache.enabled:
+            cache_key = await self.document_processor.document_key_async(selected_template, fill_data, profile)
+            cached = self.file_id_cache.get(cache_key) if cache_key else None
+            try:
+                sent_cached = bool(cached) and await self._send_cached_document(
+                    message, selected_template, cached, caption
                 )
+            except Exception as e:
+                # Запрос мог дойти до Telegram: повторная отправка продублировала бы документ
+                logger.error(f"Ошибка отправки документа по file_id: {e}")
+                self._log_event("DOCUMENT_SEND_ERROR", user, selected_template,
+                                details=f"Error: {e}", level=logging.ERROR)
+                await message.answer("❌ Ошибка при отправке документа.")
+                await state.clear()
+                return
+            if sent_cached:
+                self._log_event("DOCUMENT_FILLED", user, selected_template,
+                                details=f"Fields: {list(fill_data.keys())} - Cached")
+                METRICS.observe("total", selected_template, time.perf_counter() - started)
+                await state.clear()
+                return
+            if cached:
+                self.file_id_cache.discard(cache_key)
+
+        # Генерируем документ (имя уникально даже для одновременных заполнений одного шаблона)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        template_stem, template_ext = os.path.splitext(selected_template)
+        output_filename = f"filled_{timestamp}_{user.id}_{template_stem}{profile.extension(template_ext)}"
+        output_path = self.retention.output_path(output_filename)
+
+        async def notify_queued(position: int):
+            await message.answer(f"⏳ Все обработчики заняты. Ваш документ в очереди, позиция {position}.")
+
+        try:
+            document = await self.document_processor.fill_document_bytes_async(
+                selected_template, fill_data, profile, on_queued=notify_queued,
+                owner=user.id, priority=self._is_admin(user.id)
+            )
+        except RenderQueueFull:
+            self._log_event("RENDER_QUEUE_FULL", user, selected_template, level=logging.WARNING)
+            await message.answer("⚠️ Сервер перегружен. Отправьте данные еще раз через минуту.")
+            return
+
+        if document is not None:
+            try:
+                self._log_event("DOCUMENT_FILLED", user, selected_template,
+                                details=f"Fields: {list(fill_data.keys())}")
+
+                with METRICS.timer("store", selected_template):
+                    user_id = user.id
+                    await self.document_processor.store_output(
+                        document, output_path,
+                        on_stored=lambda size: self.retention.record(output_path, user_id, selected_template, size)
+                    )
+
+                # Отправляем заполненный документ прямо из памяти
+                file = BufferedInputFile(document, filename=output_filename)
+                with METRICS.timer("upload", selected_template):
+                    if profile.as_document:
+                        sent = await message.answer_document(file, caption=caption)
+                    else:
+                        sent = await message.answer_photo(file, caption=caption)
+                METRICS.observe("total", selected_template, time.perf_counter() - started)
+                if cache_key:
+                    file_id = sent.document.file_id if sent.document else sent.photo[-1].file_id
+                    self.file_id_cache.put(cache_key, selected_template, file_id, profile.as_document)
             except Exception as e:
                 logger.error(f"Ошибка отправки документа: {e}")
-                user_logger.error(f"DOCUMENT_SEND_ERROR - User: {message.from_user.id} - Error: {e}")
+                self._log_event("DOCUMENT_SEND_ERROR", user, selected_template,
+                                details=f"Error: {e}", level=logging.ERROR)
                 await message.answer("❌ Ошибка при отправке документа.")
         else:
-            user_logger.error(f"DOCUMENT_FILL_ERROR - User: {message.from_user.id} - Template: {selected_template}")
+            self._log_event("DOCUMENT_FILL_ERROR", user, selected_template, level=logging.ERROR)
             await message.answer("❌ Ошибка при заполнении документа.")
 
         await state.clear()
 
+    async def _send_cached_document(self, message: types.Message, template_name: str,
+                                    cached: Tuple[str, bool], caption: str) -> bool:
+        """
+        Отправить ранее загруженный документ по file_id
+
+        Returns:
+            False, если Telegram отклонил file_id (документ нужно отрендерить заново)
+
+        Raises:
+            Exception: прочие ошибки отправки (сеть, таймаут) - запрос мог быть доставлен
+        """
+        file_id, as_document = cached
+        try:
+            with METRICS.timer("upload", template_name):
+                if as_document:
+                    await message.answer_document(file_id, caption=caption)
+                else:
+                    await message.answer_photo(file_id, caption=caption)
+            return True
+        except TelegramBadRequest as e:
+            logger.warning(f"Не удалось отправить документ по file_id, рендерим заново: {e}")
+            return False
+
+    async def process_batch_file(self, message: types.Message, state: FSMContext):
+        """Обработка таблицы для пакетного заполнения"""
+        data = await state.get_data()
+        selected_template = data.get('selected_template')
+        config = self.document_processor.get_template_config(selected_template) if selected_template else None
+        if not config:
+            await message.answer("❌ Ошибка: шаблон не выбран.")
+            await state.clear()
+            return
+
+        document = message.document
+        if not document or not (document.file_name or "").lower().endswith(BATCH_EXTENSIONS):
+            await message.answer("📎 Отправьте таблицу файлом в формате CSV или XLSX.")
+            return
+
+        if not await self._check_rate_limit(message, selected_template):
+            return
+
+        try:
+            content = (await self.bot.download(document)).getvalue()
+            columns, rows = await asyncio.to_thread(read_rows, content, document.file_name)
+        except BatchError as e:
+            await message.answer(f"❌ Ошибка в файле: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Ошибка чтения файла пакетного заполнения: {e}")
+            await message.answer("❌ Не удалось прочитать файл.")
+            return
+
+        known = [column for column in columns if column in config.field_names]
+        if not known:
+            await message.answer(
+                "❌ Ни одна колонка не совпадает с полями шаблона.\n\n"
+                f"Поля шаблона: {', '.join(config.field_names)}"
+            )
+            return
+        if len(rows) > self.batch_max_rows:
+            await message.answer(f"❌ Слишком много строк: {len(rows)}, максимум {self.batch_max_rows}.")
+            return
+
+        unknown = [column for column in columns if column and column not in config.field_names]
+        profile = self.document_processor.resolve_output_profile(selected_template, data.get('output_profile'))
+        template_stem, template_ext = os.path.splitext(selected_template)
+        await state.clear()
+
+        note = f"\n⚠️ Колонки не из шаблона пропущены: {', '.join(unknown)}" if unknown else ""
+        progress_message = await message.answer(f"⏳ Заполнение: 0/{len(rows)}{note}")
+        last_update = 0.0
+
+        async def report_progress(done: int, total: int):
+            nonlocal last_update
+            now = asyncio.get_running_loop().time()
+            if done < total and now - last_update < 2:
+                return
+            last_update = now
+            try:
+                await progress_message.edit_text(f"⏳ Заполнение: {done}/{total}{note}")
+            except Exception as e:
+                logger.debug(f"Не удалось обновить прогресс: {e}")
+
+        # Временный каталог создается и удаляется в потоке: архивы пакета могут быть большими
+        tmp_dir = await self.storage.run(tempfile.mkdtemp, prefix="batch_")
+        try:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            basename = f"{template_stem}_{timestamp}"
+            if profile.format == 'PDF':
+                # Один многостраничный PDF вместо архива одностраничных
+                writer = PdfPartWriter(tmp_dir, basename, profile, self.batch_pdf_pages)
+                page_profile = writer.page_profile
+            else:
+                writer = ZipPartWriter(tmp_dir, basename, self.batch_part_bytes)
+                page_profile = profile
+            try:
+                failed = await render_batch(
+                    self.document_processor, selected_template, rows, page_profile, writer,
+                    extension=page_profile.extension(template_ext),
+                    concurrency=self.document_processor.render_executor.workers,
+                    on_progress=report_progress,
+                    owner=message.from_user.id, priority=self._is_admin(message.from_user.id)
+                )
+            except Exception as e:
+                await asyncio.to_thread(writer.close)
+                logger.error(f"Ошибка пакетного заполнения: {e}")
+                self._log_event("BATCH_FILL_ERROR", message.from_user, selected_template,
+                                details=f"Error: {e}", level=logging.ERROR)
+                await message.answer("❌ Ошибка при пакетном заполнении.")
+                return
+
+            self._log_event("BATCH_FILLED", message.from_user, selected_template,
+                            details=f"Rows: {len(rows)} - Failed: {len(failed)}",
+                            count=len(rows) - len(failed))
+
+            for i, part_path in enumerate(writer.parts, 1):
+                suffix = f" (часть {i}/{len(writer.parts)})" if len(writer.parts) > 1 else ""
+                await message.answer_document(FSInputFile(part_path), caption=f"📦 {selected_template}{suffix}")
+        finally:
+            await self.storage.run(shutil.rmtree, tmp_dir, ignore_errors=True)
+
+        summary = f"✅ Готово: {len(rows) - len(failed)} из {len(rows)} документов."
+        if failed:
+            summary += f"\n❌ Не заполнены строки: {', '.join(str(index) for index in failed[:50])}"
+        await message.answer(summary)
+
     async def cmd_config(self, message: types.Message, state: FSMContext):
         """Настройка полей шаблона"""
-        if not self.auth_manager.is_authenticated(message.from_user.id):
+        if not await self.auth_manager.is_authenticated(message.from_user.id):
             await message.answer("🔐 Доступ запрещен. Введите команду /login <пароль> для входа в систему.")
             return
 
@@ -314,10 +839,13 @@ class DocumentBot:
             '  "template_name": "document.jpg",\n'
             '  "fields": {\n'
             '    "имя": {"x": 100, "y": 200, "font_size": 24},\n'
-            '    "дата": {"x": 300, "y": 400, "font_size": 20}\n'
+            '    "дата": {"x": 300, "y": 400, "font_size": 20},\n'
+            '    "адрес": {"x": 100, "y": 450, "font_size": 20, "width": 300, "height": 60}\n'
             "  }\n"
             "}\n"
-            "```",
+            "```\n\n"
+            "С `width` (и при необходимости `height`, `align`, `max_lines`) текст переносится и уменьшается, "
+            "чтобы поместиться в область.",
             parse_mode="Markdown"
         )
         await state.set_state(DocumentFillStates.waiting_for_config)
@@ -335,7 +863,7 @@ class DocumentBot:
                 await message.answer("❌ Неверный формат конфигурации.")
                 return
 
-            success = self.document_processor.save_template_config(template_name, config)
+            success = await self.document_processor.save_template_config_async(template_name, config)
 
             if success:
                 await message.answer(f"✅ Конфигурация для '{template_name}' сохранена!")
@@ -360,26 +888,38 @@ class DocumentBot:
             await message.answer("🚫 Доступ запрещен. Команда доступна только администратору.")
             return
 
+        # Фильтры: /logs [количество] [user=<id>] [event=<событие>] [template=<шаблон>]
+        limit, filters = 20, {}
+        for arg in message.text.split()[1:]:
+            key, _, value = arg.partition("=")
+            if not value and key.isdigit():
+                limit = min(int(key), 100)
+            elif key == "user" and value.isdigit():
+                filters['user_id'] = int(value)
+            elif key in ("event", "template") and value:
+                filters[key] = value.upper() if key == "event" else value
+            else:
+                await message.answer(
+                    "❌ Формат: `/logs [количество] [user=<id>] [event=<событие>] [template=<шаблон>]`",
+                    parse_mode="Markdown"
+                )
+                return
+
         try:
-            # Читаем последние 20 строк из user_activity.log
-            if os.path.exists("user_activity.log"):
-                with open("user_activity.log", "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-                    recent_logs = lines[-20:] if len(lines) > 20 else lines
-
-                if recent_logs:
-                    log_text = "".join(recent_logs)
-                    # Разбиваем на части если слишком длинно
-                    if len(log_text) > 4000:
-                        parts = [log_text[i:i+4000] for i in range(0, len(log_text), 4000)]
-                        for i, part in enumerate(parts):
-                            await message.answer(f"📊 Логи активности (часть {i+1}/{len(parts)}):\n\n```\n{part}\n```", parse_mode="Markdown")
-                    else:
-                        await message.answer(f"📊 Последние записи логов активности:\n\n```\n{log_text}\n```", parse_mode="Markdown")
+            # Журнал читается с конца, поэтому время не зависит от его размера
+            entries = await asyncio.to_thread(self.event_log.tail, limit, **filters)
+
+            if entries:
+                log_text = "\n".join(format_entry(entry) for entry in entries)
+                # Разбиваем на части если слишком длинно
+                if len(log_text) > 4000:
+                    parts = [log_text[i:i+4000] for i in range(0, len(log_text), 4000)]
+                    for i, part in enumerate(parts):
+                        await message.answer(f"📊 Логи активности (часть {i+1}/{len(parts)}):\n\n```\n{part}\n```", parse_mode="Markdown")
                 else:
-                    await message.answer("📊 Логи активности пусты.")
+                    await message.answer(f"📊 Последние записи логов активности:\n\n```\n{log_text}\n```", parse_mode="Markdown")
             else:
-                await message.answer("📊 Файл логов не найден.")
+                await message.answer("📊 Записей не найдено." if filters else "📊 Логи активности пусты.")
         except Exception as e:
             logger.error(f"Ошибка чтения логов: {e}")
             await message.answer("❌ Ошибка при чтении логов.")
@@ -394,58 +934,67 @@ class DocumentBot:
             await message.answer("🚫 Доступ запрещен. Команда доступна только администратору.")
             return
 
+        args = message.text.split(' ', 1)
+        window = None
+        if len(args) > 1:
+            match = re.fullmatch(r"(\d+)([hdчд])", args[1].strip().lower())
+            if not match:
+                await message.answer("❌ Укажите период: `/stats 24h`, `/stats 7d` или без аргумента - за все время", parse_mode="Markdown")
+                return
+            window = int(match.group(1)) * (HOUR if match.group(2) in "hч" else DAY)
+
         try:
-            # Анализируем логи для получения статистики
-            stats = {
-                'total_logins': 0,
-                'successful_logins': 0,
-                'failed_logins': 0,
-                'documents_filled': 0,
-                'unique_users': set()
-            }
-
-            if os.path.exists("user_activity.log"):
-                with open("user_activity.log", "r", encoding="utf-8") as f:
-                    for line in f:
-                        if "LOGIN_ATTEMPT" in line:
-                            stats['total_logins'] += 1
-                            # Извлекаем user_id из строки
-                            try:
-                                user_part = line.split("User: ")[1].split(" ")[0]
-                                stats['unique_users'].add(user_part)
-                            except:
-                                pass
-                        elif "LOGIN_SUCCESS" in line:
-                            stats['successful_logins'] += 1
-                        elif "LOGIN_FAILED" in line:
-                            stats['failed_logins'] += 1
-                        elif "DOCUMENT_FILLED" in line:
-                            stats['documents_filled'] += 1
+            summary = self.activity_stats.summary(window)
+            events = summary['events']
+            period = f"за {args[1].strip()}" if window is not None else "за все время"
+            top_templates = "\n".join(
+                f"• `{name}`: {count}" for name, count in summary['templates'].most_common(5)
+            ) or "• нет данных"
 
             # Подсчитываем шаблоны
-            templates = self.document_processor.get_available_templates()
-            template_count = len(templates) if templates else 0
+            template_count = len(self.document_processor.catalog)
 
             # Подсчитываем заполненные документы
-            filled_count = 0
-            if os.path.exists("filled_documents"):
-                filled_count = len([f for f in os.listdir("filled_documents") if f.endswith(('.jpg', '.png', '.jpeg'))])
+            stored_stats = self.retention.stats()
 
-            stats_text = f"""📈 **Статистика бота**
+            active_sessions = await self.auth_manager.active_sessions()
+            font_stats = self.document_processor.font_cache.stats()
+            template_stats = self.document_processor.template_cache.stats()
+            file_id_stats = self.file_id_cache.stats()
+            layer_stats = self.document_processor.static_layers.stats()
+            layout_stats = self.document_processor.text_layout.stats()
+            preview_stats = self.document_processor.previews.stats()
+            tile_stats = self.document_processor.text_tiles.stats()
+
+            stats_text = f"""📈 **Статистика бота {period}**
 
 👥 **Пользователи:**
-• Уникальных пользователей: {len(stats['unique_users'])}
-• Всего попыток входа: {stats['total_logins']}
-• Успешных входов: {stats['successful_logins']}
-• Неудачных входов: {stats['failed_logins']}
+• Уникальных пользователей: ~{summary['unique_users']}
+• Всего попыток входа: {events['LOGIN_ATTEMPT']}
+• Успешных входов: {events['LOGIN_SUCCESS']}
+• Неудачных входов: {events['LOGIN_FAILED']}
 
 📄 **Документы:**
 • Доступных шаблонов: {template_count}
-• Заполненных документов: {stats['documents_filled']}
-• Сохраненных файлов: {filled_count}
+• Заполненных документов: {events['DOCUMENT_FILLED'] + events['BATCH_FILLED']}
+• Черновиков: {events['PREVIEW_SENT']}
+• Сохраненных файлов: {stored_stats['count']} ({stored_stats['bytes'] / 1048576:.1f} МБ)
+
+🏆 **Популярные шаблоны:**
+{top_templates}
 
 🔐 **Система:**
-• Текущих авторизованных: {len(self.auth_manager.authenticated_users)}
+• Текущих авторизованных: {active_sessions}
+• Отклонено по частоте заполнений: {self.rate_limiter.limited}
+
+⚙️ **Кэши:**
+• Шрифты: {font_stats['size']}/{font_stats['max_size']}, попаданий {font_stats['hit_rate']:.0%}
+• Шаблоны: {template_stats['entries']} шт., {template_stats['bytes'] // 1048576}/{template_stats['max_bytes'] // 1048576} МБ, попаданий {template_stats['hit_rate']:.0%} ({template_stats['hits']}/{template_stats['misses']})
+• Сжатые полосы шаблонов: {layer_stats['entries']} шт., {layer_stats['bytes'] // 1048576}/{layer_stats['max_bytes'] // 1048576} МБ, попаданий {layer_stats['hit_rate']:.0%}
+• Раскладки текста: {layout_stats['size']}/{layout_stats['max_size']}, попаданий {layout_stats['hit_rate']:.0%}
+• Растеризованные строки: {tile_stats['entries']} шт., {tile_stats['bytes'] // 1048576}/{tile_stats['max_bytes'] // 1048576} МБ, попаданий {tile_stats['hit_rate']:.0%}
+• Черновики шаблонов: {preview_stats['entries']} шт., {preview_stats['bytes'] // 1048576}/{preview_stats['max_bytes'] // 1048576} МБ, попаданий {preview_stats['hit_rate']:.0%}
+• Готовые документы (file\\_id): {file_id_stats['entries']}/{file_id_stats['max_entries']}, повторных отправок {file_id_stats['hit_rate']:.0%}
 """
 
             await message.answer(stats_text, parse_mode="Markdown")
@@ -454,7 +1003,151 @@ class DocumentBot:
             logger.error(f"Ошибка получения статистики: {e}")
             await message.answer("❌ Ошибка при получении статистики.")
 
+    async def cmd_perf(self, message: types.Message):
+        """Сводка метрик рендеринга и управление профилировщиком (только для администратора)"""
+        if not self.admin_id:
+            await message.answer("❌ Администратор не настроен в системе.")
+            return
+
+        if message.from_user.id != self.admin_id:
+            await message.answer("🚫 Доступ запрещен. Команда доступна только администратору.")
+            return
+
+        args = message.text.split()[1:]
+        if args[:1] == ["profile"]:
+            await self._toggle_profiler(message, args[1] if len(args) > 1 else "")
+            return
+
+        stages = METRICS.stage_summary()
+        lines = ["⏱ Этапы (мс): кол-во / среднее / p50 / p95"]
+        for stage in STAGES:
+            histogram = stages.get(stage)
+            if histogram and histogram.count:
+                lines.append(f"{stage:<11}{histogram.count:>7} {histogram.sum / histogram.count * 1000:>8.1f} "
+                             f"{histogram.quantile(0.5) * 1000:>8.1f} {histogram.quantile(0.95) * 1000:>8.1f}")
+
+        templates = METRICS.template_summary("render")
+        slowest = sorted(templates.items(), key=lambda item: item[1].quantile(0.95), reverse=True)[:5]
+        if slowest:
+            lines.append("")
+            lines.append("🐢 Самые медленные шаблоны (p95 рендеринга, мс):")
+            for name, histogram in slowest:
+                lines.append(f"{histogram.quantile(0.95) * 1000:>8.1f}  {name} ({histogram.count})")
+
+        gauges = METRICS.gauges()
+        lines.append("")
+        lines.append(f"Очередь рендеринга: {gauges.get('docbot_render_queue_depth', 0):g}, "
+                     f"в работе: {gauges.get('docbot_render_active', 0):g}")
+        lines.append(f"Кэш шрифтов: {gauges.get('docbot_font_cache_hit_ratio', 0):.0%}, "
+                     f"кэш шаблонов: {gauges.get('docbot_template_cache_hit_ratio', 0):.0%}")
+        lines.append(f"Профилировщик: {'включен' if self.profiler.running else 'выключен'}")
+
+        await message.answer("```\n" + "\n".join(lines) + "\n```", parse_mode="Markdown")
+
+    async def _toggle_profiler(self, message: types.Message, action: str):
+        """/perf profile on - запустить профилировщик, /perf profile off - остановить и прислать отчет"""
+        if action == "on":
+            self.profiler.start()
+            await message.answer("🔬 Профилировщик запущен. Остановить и получить отчет: `/perf profile off`",
+                                 parse_mode="Markdown")
+        elif action == "off":
+            if not self.profiler.running:
+                await message.answer("🔬 Профилировщик не запущен.")
+                return
+            await asyncio.to_thread(self.profiler.stop)
+            top = "\n".join(f"{count:>6}  {name}" for name, count in self.profiler.top_functions())
+            await message.answer(f"🔬 Снимков: {self.profiler.samples}\n\n```\n{top or 'нет данных'}\n```",
+                                 parse_mode="Markdown")
+            if self.profiler.samples:
+                report = BufferedInputFile(self.profiler.collapsed().encode('utf-8'),
+                                           filename=f"profile_{datetime.now():%Y%m%d_%H%M%S}.txt")
+                await message.answer_document(report, caption="Стеки в формате collapsed (flamegraph, speedscope)")
+        else:
+            await message.answer("❌ Формат: `/perf profile on` или `/perf profile off`", parse_mode="Markdown")
+
     async def start_polling(self):
         """Запуск бота"""
         logger.info("Запуск бота...")
-        await self.dp.start_polling(self.bot)
\ No newline at end of file
+        await self._start_background_tasks()
+        try:
+            await self.dp.start_polling(self.bot)
+        finally:
+            await self._shutdown()
+
+    async def start_webhook(self, host: str, port: int, base_url: Optional[str] = None,
+                            path: str = "/webhook", secret_token: Optional[str] = None,
+                            max_concurrent: int = 50):
+        """
+        Запуск бота в режиме webhook
+
+        Args:
+            host, port: адрес, на котором слушает aiohttp-сервер
+            base_url: публичный адрес (https://...), который регистрируется в Telegram;
+                если не указан, webhook должен быть установлен заранее
+            path: путь для обновлений
+            secret_token: секрет, которым Telegram подписывает запросы
+            max_concurrent: лимит одновременно обрабатываемых обновлений
+        """
+        server = WebhookServer(
+            self.bot, self.dp, path=path, secret_token=secret_token, max_concurrent=max_concurrent,
+            health_info=lambda: {'render_queue': self.document_processor.render_executor.queue_depth}
+        )
+        await self._start_background_tasks()
+        runner = web.AppRunner(server.create_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Webhook-сервер запущен на {host}:{port}{path}")
+
+        try:
+            if base_url:
+                await self.bot.set_webhook(
+                    f"{base_url.rstrip('/')}{path}",
+                    secret_token=secret_token,
+                    max_connections=min(max_concurrent, 100),
+                    allowed_updates=self.dp.resolve_used_update_types()
+                )
+                logger.info(f"Webhook зарегистрирован: {base_url.rstrip('/')}{path}")
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            await self._shutdown()
+
+    async def _start_background_tasks(self):
+        """
+        Запустить фоновые задачи: перенос истории в счетчики статистики (при первом запуске),
+        их периодическое сохранение и синхронизацию конфигураций и каталога шаблонов
+        """
+        if not await self.storage.exists(self.activity_stats.path) and await self.storage.exists("user_activity.log"):
+            try:
+                imported = await asyncio.to_thread(self.activity_stats.import_text_log, "user_activity.log")
+                logger.info(f"Статистика перенесена из user_activity.log: {imported} событий")
+                await self.activity_stats.flush()
+            except Exception as e:
+                logger.error(f"Ошибка переноса статистики из user_activity.log: {e}")
+        self._stats_task = asyncio.create_task(self._flush_stats_periodically())
+        self._refresh_task = asyncio.create_task(self.document_processor.refresh_periodically(self.refresh_interval))
+        self._retention_task = asyncio.create_task(self.retention.run_periodically(self.retention_interval))
+        if self.metrics_port and self._metrics_runner is None:
+            self._metrics_runner = await start_metrics_server(self.metrics_host, self.metrics_port)
+
+    async def _flush_stats_periodically(self):
+        while True:
+            await asyncio.sleep(self.stats_flush_interval)
+            await self.activity_stats.flush()
+
+    async def _shutdown(self):
+        """Освободить ресурсы бота"""
+        if self._stats_task:
+            self._stats_task.cancel()
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        if self._retention_task:
+            self._retention_task.cancel()
+        self.profiler.stop()
+        if self._metrics_runner:
+            await self._metrics_runner.cleanup()
+        await self.activity_stats.flush()
+        self.document_processor.render_executor.shutdown(wait=False)
+        await self.auth_manager.sessions.close()
+        self.retention.close()
+        await self.bot.session.close()
\ No newline at end of file
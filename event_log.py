@@ -0,0 +1,252 @@
+import json
+import logging.handlers
+import os
+import queue
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Поля структурированного события, передаются через extra= в вызове логгера
+EVENT_FIELDS = ('event', 'user_id', 'username', 'first_name', 'template', 'details')
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def index_path(log_path: str) -> str:
+    """Путь к индексу для файла журнала (в том числе ротированного: events.jsonl.1 -> events.jsonl.1.idx)"""
+    return f"{log_path}.idx"
+
+
+def _index_value(value) -> str:
+    return "" if value is None else str(value).replace("\t", " ").replace("\n", " ")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Одна запись журнала - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='seconds'),
+            'level': record.levelname,
+        }
+        for field in EVENT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if 'event' not in entry:
+            entry['message'] = record.getMessage()
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class IndexedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Ротация по размеру с индексом рядом с каждым файлом журнала
+
+    Строка индекса - "смещение\\tuser_id\\tevent\\ttemplate": по ней фильтры /logs
+    находят нужные записи, не разбирая JSON всего журнала.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.setFormatter(JsonLinesFormatter())
+        self._index = None
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.seek(0, os.SEEK_END)
+            offset = self.stream.tell()
+            logging.StreamHandler.emit(self, record)
+            if self._index is None:
+                self._index = open(index_path(self.baseFilename), 'a', encoding='utf-8')
+            self._index.write("\t".join((
+                str(offset), _index_value(getattr(record, 'user_id', None)),
+                _index_value(getattr(record, 'event', None)), _index_value(getattr(record, 'template', None))
+            )) + "\n")
+            self._index.flush()
+        except Exception:
+            self.handleError(record)
+
+    def _close_index(self):
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def doRollover(self):
+        self._close_index()
+        super().doRollover()
+        if self.backupCount > 0:
+            for i in range(self.backupCount - 1, 0, -1):
+                source = index_path(f"{self.baseFilename}.{i}")
+                if os.path.exists(source):
+                    os.replace(source, index_path(f"{self.baseFilename}.{i + 1}"))
+            if os.path.exists(index_path(self.baseFilename)):
+                os.replace(index_path(self.baseFilename), index_path(f"{self.baseFilename}.1"))
+
+    def close(self):
+        self.acquire()
+        try:
+            self._close_index()
+        finally:
+            self.release()
+        super().close()
+
+
+def read_lines_reverse(path: str, block_size: int = READ_BLOCK_SIZE) -> Iterator[bytes]:
+    """
+    Строки файла от последней к первой
+
+    Файл читается блоками с конца, поэтому стоимость зависит от количества
+    прочитанных строк, а не от размера файла. Недописанная последняя строка
+    (без перевода строки) пропускается.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        trailing = True
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            if trailing and lines:
+                # После последнего перевода строки - пустая строка или недописанная запись
+                lines.pop()
+                trailing = False
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder and not trailing:
+            yield remainder
+
+
+class EventLog:
+    """Журнал активности пользователей в формате JSON Lines"""
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5):
+        """
+        Args:
+            path: файл журнала; рядом хранятся ротированные копии path.1 ... path.N и индексы *.idx
+            max_bytes: размер файла, после которого он ротируется
+            backup_count: сколько ротированных файлов хранить
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = max(backup_count, 1)
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    @classmethod
+    def from_env(cls) -> "EventLog":
+        return cls(
+            os.getenv("EVENT_LOG_PATH", "data/user_activity.jsonl"),
+            max_bytes=int(os.getenv("EVENT_LOG_MAX_MB", "10")) * 1024 * 1024,
+            backup_count=int(os.getenv("EVENT_LOG_BACKUPS", "5"))
+        )
+
+    def attach(self, target: logging.Logger):
+        """
+        Направить записи логгера в журнал
+
+        Логгер только кладет запись в очередь; запись в файл и индекс выполняет
+        поток QueueListener, поэтому обработчики бота не ждут диска.
+        """
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        handler = IndexedRotatingFileHandler(self.path, self.max_bytes, self.backup_count)
+        self._listener = logging.handlers.QueueListener(records, handler)
+        target.addHandler(logging.handlers.QueueHandler(records))
+        self._listener.start()
+
+    def close(self):
+        """Дописать записи из очереди и закрыть файлы"""
+        if self._listener:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+    def _files(self) -> List[str]:
+        """Файлы журнала от нового к старому"""
+        return [self.path] + [f"{self.path}.{i}" for i in range(1, self.backup_count + 1)]
+
+    def tail(self, limit: int = 20, user_id: Optional[int] = None, event: Optional[str] = None,
+             template: Optional[str] = None) -> List[Dict]:
+        """
+        Последние limit записей (от старой к новой), подходящих под фильтры
+
+        Без фильтров записи читаются с конца журнала; с фильтрами с конца читается
+        индекс, а из журнала - только найденные записи.
+        """
+        filtered = user_id is not None or event or template
+        entries: List[Dict] = []
+        for path in self._files():
+            if len(entries) >= limit:
+                break
+            if filtered:
+                lines = self._read_matching(path, limit - len(entries), user_id, event, template)
+            else:
+                lines = []
+                for line in read_lines_reverse(path):
+                    lines.append(line)
+                    if len(entries) + len(lines) >= limit:
+                        break
+            for line in lines:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        entries.reverse()
+        return entries
+
+    @staticmethod
+    def _read_matching(path: str, limit: int, user_id: Optional[int], event: Optional[str],
+                       template: Optional[str]) -> List[bytes]:
+        offsets = []
+        for line in read_lines_reverse(index_path(path)):
+            parts = line.decode('utf-8', errors='replace').split("\t")
+            if len(parts) != 4:
+                continue
+            if user_id is not None and parts[1] != str(user_id):
+                continue
+            if event and parts[2] != event:
+                continue
+            if template and parts[3] != template:
+                continue
+            offsets.append(int(parts[0]))
+            if len(offsets) >= limit:
+                break
+
+        lines = []
+        if offsets:
+            try:
+                with open(path, 'rb') as f:
+                    for offset in offsets:
+                        f.seek(offset)
+                        lines.append(f.readline().rstrip(b"\n"))
+            except FileNotFoundError:
+                pass
+        return lines
+
+
+def format_entry(entry: Dict) -> str:
+    """Строка записи журнала для /logs"""
+    parts = [entry.get('ts', ''), entry.get('event') or entry.get('level', '')]
+    if 'user_id' in entry:
+        user = str(entry['user_id'])
+        if entry.get('username'):
+            user += f" @{entry['username']}"
+        parts.append(user)
+    for field in ('template', 'details', 'message'):
+        if entry.get(field):
+            parts.append(str(entry[field]))
+    return " - ".join(parts)
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def document_key(template_name: str, template_version: str, config_version: str,
+                 data: Dict[str, str], field_names: Iterable[str], profile_spec: str) -> str:
+    """
+    Ключ готового документа: версия шаблона и конфигурации, профиль и нормализованные данные
+
+    В ключ попадают только поля из конфигурации шаблона (остальные не рисуются),
+    в порядке имен, поэтому порядок строк в сообщении не влияет на ключ.
+    """
+    fields = sorted((name, data[name]) for name in set(field_names) if name in data)
+    payload = json.dumps([template_name, template_version, config_version, profile_spec, fields], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _CachedFile:
+    __slots__ = ('file_id', 'as_document', 'template', 'expires_at')
+
+    def __init__(self, file_id: str, as_document: bool, template: str, expires_at: float):
+        self.file_id = file_id
+        self.as_document = as_document
+        self.template = template
+        self.expires_at = expires_at
+
+
+class FileIdCache:
+    """
+    LRU-кэш file_id уже отправленных документов
+
+    Повторный запрос с теми же данными отправляется по file_id: без рендеринга
+    и без загрузки файла в Telegram.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 24 * 3600):
+        """
+        Args:
+            max_entries: размер кэша (0 - кэш выключен)
+            ttl: время жизни записи в секундах
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _CachedFile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Optional[Tuple[str, bool]]:
+        """Вернуть (file_id, отправлять как документ) или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.file_id, entry.as_document
+
+    def put(self, key: str, template: str, file_id: str, as_document: bool):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = _CachedFile(file_id, as_document, template, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_templates(self, template_names: Iterable[str]):
+        """Удалить записи шаблонов, у которых изменилась конфигурация или файл"""
+        names = set(template_names)
+        if not names:
+            return
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.template in names]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            logger.info(f"Кэш file_id: удалено {len(stale)} записей для {len(names)} шаблонов")
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+        }
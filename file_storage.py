@@ -0,0 +1,129 @@
+import aiofiles
+import aiofiles.os
+import asyncio
+import itertools
+import json
+import os
+from typing import Any, Callable, List, Optional, Sequence
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FileStorage:
+    """
+    Неблокирующий доступ к файлам из event loop
+
+    Все операции выполняются в пуле потоков (через aiofiles), а семафор
+    ограничивает число одновременных операций: при всплеске нагрузки запросы
+    к диску ждут своей очереди, а не занимают все потоки пула.
+    Запись по умолчанию атомарная: во временный файл рядом и os.replace,
+    поэтому читатель никогда не увидит наполовину записанный файл.
+    """
+
+    def __init__(self, max_concurrency: int = 8, fsync: bool = True):
+        """
+        Args:
+            max_concurrency: сколько операций с диском выполнять одновременно
+            fsync: сбрасывать временный файл на диск перед переименованием
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.fsync = fsync
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._tmp_counter = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "FileStorage":
+        return cls(
+            max_concurrency=int(os.getenv("FILE_IO_CONCURRENCY", "8")),
+            fsync=os.getenv("FILE_IO_FSYNC", "1").strip().lower() not in ("0", "false", "no")
+        )
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Выполнить произвольную блокирующую функцию в потоке с учетом ограничения"""
+        async with self._semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def read_bytes(self, path: str) -> bytes:
+        async with self._semaphore:
+            async with aiofiles.open(path, 'rb') as f:
+                return await f.read()
+
+    async def read_text(self, path: str) -> str:
+        async with self._semaphore:
+            async with aiofiles.open(path, 'r', encoding='utf-8') as f:
+                return await f.read()
+
+    async def read_json(self, path: str) -> Any:
+        return json.loads(await self.read_text(path))
+
+    async def write_bytes(self, path: str, content: bytes, atomic: bool = True):
+        """
+        Записать файл (каталог создается при необходимости)
+
+        Args:
+            atomic: записать во временный файл и переименовать его в path
+        """
+        async with self._semaphore:
+            directory = os.path.dirname(path)
+            if directory:
+                await aiofiles.os.makedirs(directory, exist_ok=True)
+            if not atomic:
+                async with aiofiles.open(path, 'wb') as f:
+                    await f.write(content)
+                return
+
+            tmp_path = f"{path}.{os.getpid()}.{next(self._tmp_counter)}.tmp"
+            try:
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    await f.write(content)
+                    if self.fsync:
+                        await f.flush()
+                        await asyncio.to_thread(os.fsync, f.fileno())
+                await aiofiles.os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    await aiofiles.os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+    async def write_text(self, path: str, content: str, atomic: bool = True):
+        await self.write_bytes(path, content.encode('utf-8'), atomic=atomic)
+
+    async def write_json(self, path: str, data: Any, indent: Optional[int] = 2):
+        """Атомарно записать JSON (как json.dump с ensure_ascii=False)"""
+        await self.write_text(path, json.dumps(data, ensure_ascii=False, indent=indent))
+
+    async def exists(self, path: str) -> bool:
+        async with self._semaphore:
+            return await aiofiles.os.path.exists(path)
+
+    async def stat(self, path: str) -> os.stat_result:
+        async with self._semaphore:
+            return await aiofiles.os.stat(path)
+
+    async def listdir(self, path: str, suffixes: Optional[Sequence[str]] = None) -> List[str]:
+        """
+        Имена файлов каталога (пустой список, если каталога нет)
+
+        Args:
+            suffixes: оставить только имена с этими окончаниями (без учета регистра)
+        """
+        async with self._semaphore:
+            try:
+                names = await aiofiles.os.listdir(path)
+            except FileNotFoundError:
+                return []
+        if suffixes:
+            suffixes = tuple(suffix.lower() for suffix in suffixes)
+            names = [name for name in names if name.lower().endswith(suffixes)]
+        return names
+
+    async def remove(self, path: str, missing_ok: bool = True):
+        async with self._semaphore:
+            try:
+                await aiofiles.os.remove(path)
+            except FileNotFoundError:
+                if not missing_ok:
+                    raise
@@ -0,0 +1,149 @@
+from PIL import ImageFont
+from collections import OrderedDict
+import threading
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAMILY = "sans"
+DEFAULT_WEIGHT = "regular"
+
+# Кандидаты для каждого семейства и начертания, в порядке приоритета (с поддержкой кириллицы)
+FONT_CANDIDATES: Dict[Tuple[str, str], List[str]] = {
+    ("sans", "regular"): [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+        "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+        "/System/Library/Fonts/Arial.ttf",
+        "/Windows/Fonts/arial.ttf",
+        "arial.ttf",
+    ],
+    ("sans", "bold"): [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+        "/usr/share/fonts/truetype/noto/NotoSans-Bold.ttf",
+        "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+        "/Windows/Fonts/arialbd.ttf",
+        "arialbd.ttf",
+    ],
+    ("serif", "regular"): [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSerif-Regular.ttf",
+        "/usr/share/fonts/truetype/noto/NotoSerif-Regular.ttf",
+        "/System/Library/Fonts/Supplemental/Times New Roman.ttf",
+        "/Windows/Fonts/times.ttf",
+        "times.ttf",
+    ],
+    ("serif", "bold"): [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSerif-Bold.ttf",
+        "/usr/share/fonts/truetype/noto/NotoSerif-Bold.ttf",
+        "/System/Library/Fonts/Supplemental/Times New Roman Bold.ttf",
+        "/Windows/Fonts/timesbd.ttf",
+        "timesbd.ttf",
+    ],
+    ("mono", "regular"): [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationMono-Regular.ttf",
+        "/usr/share/fonts/truetype/noto/NotoSansMono-Regular.ttf",
+        "/System/Library/Fonts/Supplemental/Courier New.ttf",
+        "/Windows/Fonts/cour.ttf",
+        "cour.ttf",
+    ],
+    ("mono", "bold"): [
+        "/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationMono-Bold.ttf",
+        "/usr/share/fonts/truetype/noto/NotoSansMono-Bold.ttf",
+        "/System/Library/Fonts/Supplemental/Courier New Bold.ttf",
+        "/Windows/Fonts/courbd.ttf",
+        "courbd.ttf",
+    ],
+}
+
+
+def _is_loadable(font_path: str) -> bool:
+    """Проверить, что шрифт существует и открывается FreeType"""
+    try:
+        ImageFont.truetype(font_path, 10)
+        return True
+    except Exception:
+        return False
+
+
+class FontCache:
+    """Разрешение путей к шрифтам при старте и LRU-кэш объектов FreeTypeFont"""
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self.resolved: Dict[Tuple[str, str], Optional[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._fonts: "OrderedDict[Tuple[Optional[str], int], ImageFont.ImageFont]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        for family, weight in FONT_CANDIDATES:
+            self.resolve(family, weight)
+        logger.info(f"Шрифты разрешены: {self.resolved}")
+        if self.resolved.get((DEFAULT_FAMILY, DEFAULT_WEIGHT)) is None:
+            logger.warning("TrueType шрифт не найден, используется базовый - кириллица может отображаться некорректно")
+
+    def resolve(self, family: str = DEFAULT_FAMILY, weight: str = DEFAULT_WEIGHT) -> Optional[str]:
+        """
+        Найти путь к файлу шрифта для семейства и начертания
+
+        Семейство может быть именем из FONT_CANDIDATES или путем к .ttf/.otf файлу.
+        Результат запоминается, поэтому файловая система опрашивается один раз.
+        """
+        key = (family, weight)
+        if key in self.resolved:
+            return self.resolved[key]
+
+        if family.lower().endswith(('.ttf', '.otf', '.ttc')):
+            candidates = [family]
+        else:
+            candidates = FONT_CANDIDATES.get(key, [])
+            if not candidates:
+                logger.warning(f"Неизвестный шрифт {family}/{weight}, используется {DEFAULT_FAMILY}")
+
+        path = next((candidate for candidate in candidates if _is_loadable(candidate)), None)
+        if path is None and key != (DEFAULT_FAMILY, DEFAULT_WEIGHT):
+            fallback_weight = weight if (DEFAULT_FAMILY, weight) in FONT_CANDIDATES else DEFAULT_WEIGHT
+            path = self.resolve(DEFAULT_FAMILY, fallback_weight)
+
+        self.resolved[key] = path
+        return path
+
+    def get_font(self, size: int, family: str = DEFAULT_FAMILY,
+                 weight: str = DEFAULT_WEIGHT) -> ImageFont.ImageFont:
+        """Получить шрифт нужного размера из кэша"""
+        path = self.resolve(family, weight)
+        key = (path, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        font = ImageFont.truetype(path, size) if path else ImageFont.load_default()
+
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.max_size:
+                self._fonts.popitem(last=False)
+        return font
+
+    def stats(self) -> Dict:
+        """Статистика кэша шрифтов"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._fonts),
+            'max_size': self.max_size,
+            'resolved': dict(self.resolved),
+        }
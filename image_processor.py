@@ -1,132 +1,592 @@
-from PIL import Image, ImageDraw, ImageFont
-import json
+from PIL import Image, ImageDraw
+import asyncio
+import math
 import os
-from typing import Dict, List, Tuple, Optional
+import time
+from typing import Awaitable, Callable, Dict, List, Set, Tuple, Optional
 import logging
 
+from file_id_cache import document_key
+from file_storage import FileStorage
+from fonts import FontCache
+from metrics import METRICS
+from output_profiles import DEFAULT_PROFILE, IMAGE_FORMATS, OutputProfile, encode_image, get_profile
+from preview import PreviewCache
+from render_executor import RenderExecutor
+from shared_templates import SharedTemplateStore
+from static_layer import StaticLayerCache, band_encodable, palette_index, png_compress_level, text_rows
+from template_cache import TemplateCache
+from template_catalog import TemplateCatalog
+from template_config import ConfigRegistry, FieldConfig, TemplateConfig
+from text_layout import TextLayoutEngine
+from text_tiles import TextTileCache
+
 logger = logging.getLogger(__name__)
 
+# Экземпляры DocumentProcessor внутри процессов пула рендеринга
+_worker_processors: Dict[Tuple[str, str], "DocumentProcessor"] = {}
+
+
+def _call_in_worker(templates_dir: str, config_dir: str, method: str, *args):
+    """
+    Вызвать метод DocumentProcessor в процессе пула (процессор создается один раз на процесс)
+
+    Returns:
+        (результат, замеры этапов) - замеры учитываются в метриках основного процесса
+    """
+    key = (templates_dir, config_dir)
+    processor = _worker_processors.get(key)
+    if processor is None:
+        processor = DocumentProcessor(templates_dir, config_dir)
+        processor.warm_text_tiles()
+        # В воркере конфигурации перечитываются в его же потоке, там же растеризуются новые значения
+        processor.config_registry.add_listener(processor.warm_text_tiles)
+        _worker_processors[key] = processor
+    with METRICS.capture() as samples:
+        result = getattr(processor, method)(*args)
+    return result, samples
+
+
 class DocumentProcessor:
-    def __init__(self, templates_dir: str = "templates", config_dir: str = "config"):
+    def __init__(self, templates_dir: str = "templates", config_dir: str = "config",
+                 render_executor: Optional[RenderExecutor] = None):
         self.templates_dir = templates_dir
         self.config_dir = config_dir
         self.default_font_size = 24
+        self.render_executor = render_executor or RenderExecutor.from_env()
+        self.font_cache = FontCache(max_size=int(os.getenv("FONT_CACHE_SIZE", "64")))
+        self.text_layout = TextLayoutEngine(
+            self.font_cache.get_font, cache_size=int(os.getenv("TEXT_LAYOUT_CACHE_SIZE", "4096"))
+        )
+        self.text_tiles = TextTileCache(max_bytes=int(os.getenv("TEXT_TILE_CACHE_MB", "32")) * 1024 * 1024)
+        self.template_cache = TemplateCache(
+            max_bytes=int(os.getenv("TEMPLATE_CACHE_MB", "256")) * 1024 * 1024,
+            shared=SharedTemplateStore.from_env()
+        )
+        self.config_registry = ConfigRegistry(
+            config_dir, self.font_cache, check_interval=float(os.getenv("CONFIG_RELOAD_INTERVAL", "5"))
+        )
+        self.static_layers = StaticLayerCache(
+            max_bytes=int(os.getenv("STATIC_LAYER_CACHE_MB", "64")) * 1024 * 1024,
+            band_rows=int(os.getenv("STATIC_BAND_ROWS", "64"))
+        )
+        self.previews = PreviewCache(
+            max_side=int(os.getenv("PREVIEW_MAX_SIDE", "1024")),
+            max_bytes=int(os.getenv("PREVIEW_CACHE_MB", "64")) * 1024 * 1024
+        )
+        self.preview_profile = OutputProfile('preview', 'JPEG', {'quality': int(os.getenv("PREVIEW_QUALITY", "70"))})
+        self._catalog: Optional[TemplateCatalog] = None
+        self.output_storage = os.getenv("OUTPUT_STORAGE", "async").strip().lower()
+        self.default_output_profile = self._default_profile_from_env()
+        self._background_writes: Set[asyncio.Task] = set()
+        # Файловые операции из event loop (в процессах пула не используется)
+        self.storage = FileStorage.from_env()
+
+    @staticmethod
+    def _default_profile_from_env() -> OutputProfile:
+        """Профиль по умолчанию из OUTPUT_PROFILE (при ошибке - original, чтобы не падало каждое заполнение)"""
+        name = os.getenv("OUTPUT_PROFILE", DEFAULT_PROFILE).strip()
+        try:
+            return get_profile(name)
+        except ValueError as e:
+            logger.error(f"OUTPUT_PROFILE: {e}, используется профиль {DEFAULT_PROFILE}")
+            return get_profile(DEFAULT_PROFILE)
+
+    @property
+    def catalog(self) -> TemplateCatalog:
+        """Индекс шаблонов (создается при первом обращении, в процессах пула не нужен)"""
+        if self._catalog is None:
+            self._catalog = TemplateCatalog(
+                self.templates_dir,
+                index_path=os.getenv("CATALOG_INDEX_PATH", "template_catalog.json"),
+                metadata_lookup=self.load_template_config,
+            )
+            self.config_registry.add_listener(self._catalog.update_metadata)
+            self._catalog.update_metadata(self.config_registry.names())
+        return self._catalog
 
     def get_available_templates(self) -> List[str]:
         """Получить список доступных шаблонов"""
-        templates = []
-        if os.path.exists(self.templates_dir):
-            for file in os.listdir(self.templates_dir):
-                if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                    templates.append(file)
-        return templates
+        return self.catalog.names()
+
+    def get_template_config(self, template_name: str) -> Optional[TemplateConfig]:
+        """Получить скомпилированную конфигурацию шаблона из реестра"""
+        return self.config_registry.get(template_name)
 
     def load_template_config(self, template_name: str) -> Optional[Dict]:
         """Загрузить конфигурацию полей для шаблона"""
-        config_file = os.path.join(self.config_dir, f"{template_name}.json")
-        if os.path.exists(config_file):
-            try:
-                with open(config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Ошибка загрузки конфигурации {config_file}: {e}")
-        return None
+        config = self.config_registry.get(template_name)
+        return dict(config.raw) if config else None
 
     def save_template_config(self, template_name: str, config: Dict) -> bool:
         """Сохранить конфигурацию полей для шаблона"""
-        os.makedirs(self.config_dir, exist_ok=True)
-        config_file = os.path.join(self.config_dir, f"{template_name}.json")
         try:
-            with open(config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
+            self.config_registry.save(template_name, config)
             return True
         except Exception as e:
-            logger.error(f"Ошибка сохранения конфигурации {config_file}: {e}")
+            logger.error(f"Ошибка сохранения конфигурации {template_name}: {e}")
             return False
 
-    def fill_document(self, template_name: str, data: Dict[str, str], output_path: str) -> bool:
+    async def save_template_config_async(self, template_name: str, config: Dict) -> bool:
+        """Сохранить конфигурацию полей для шаблона, не блокируя event loop (атомарная запись)"""
+        try:
+            compiled = self.config_registry.compile(template_name, config)
+            config_file = self.config_registry.config_path(template_name)
+            await self.storage.write_json(config_file, config)
+            self.config_registry.publish(template_name, compiled, await self.storage.stat(config_file))
+            await self._warm_text_tiles_async([template_name])
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения конфигурации {template_name}: {e}")
+            return False
+
+    def document_key(self, template_name: str, data: Dict[str, str], profile: OutputProfile) -> Optional[str]:
+        """Ключ готового документа для кэша file_id (None - шаблон или конфигурация недоступны)"""
+        try:
+            stat = os.stat(os.path.join(self.templates_dir, template_name))
+        except OSError:
+            return None
+        return self._document_key(template_name, stat, data, profile)
+
+    async def document_key_async(self, template_name: str, data: Dict[str, str],
+                                 profile: OutputProfile) -> Optional[str]:
+        """То же, что document_key, но stat шаблона выполняется вне event loop"""
+        try:
+            stat = await self.storage.stat(os.path.join(self.templates_dir, template_name))
+        except OSError:
+            return None
+        return self._document_key(template_name, stat, data, profile)
+
+    def _document_key(self, template_name: str, stat: os.stat_result, data: Dict[str, str],
+                      profile: OutputProfile) -> Optional[str]:
+        config = self.config_registry.get(template_name)
+        if not config:
+            return None
+        return document_key(template_name, f"{stat.st_mtime_ns}:{stat.st_size}", config.version,
+                            data, config.field_names, repr(profile))
+
+    async def refresh_async(self):
+        """Проверить изменения конфигураций и каталога шаблонов вне event loop"""
+        changed = await self.storage.run(self.config_registry.refresh)
+        if changed:
+            await self._warm_text_tiles_async(changed)
+        # Сверяются сами файлы: шаблон, перезаписанный на месте, не меняет mtime каталога
+        if await self.storage.run(self.catalog.refresh, force=True) and self.template_cache.shared is not None:
+            paths = [os.path.join(self.templates_dir, name) for name in self.catalog.names()]
+            await self.storage.run(self.template_cache.shared.prune, paths)
+
+    async def refresh_periodically(self, interval: float):
         """
-        Заполнить документ данными
+        Фоновая синхронизация конфигураций и каталога шаблонов
+
+        Проверки при обращении отключаются: обработчики читают только память,
+        а сканирование каталогов выполняется здесь, в потоке.
+        """
+        await self.storage.run(lambda: self.catalog)
+        await self._warm_text_tiles_async()
+        self.config_registry.check_interval = math.inf
+        self.catalog.check_interval = math.inf
+        while True:
+            try:
+                await self.refresh_async()
+            except Exception as e:
+                logger.error(f"Ошибка обновления конфигураций и каталога шаблонов: {e}")
+            await asyncio.sleep(interval)
+
+    def render_document(self, template_name: str, data: Dict[str, str]) -> Optional[Image.Image]:
+        """
+        Нарисовать данные на копии шаблона
 
         Args:
             template_name: имя файла шаблона
             data: словарь с данными для заполнения {'field_name': 'value'}
-            output_path: путь для сохранения результата
         """
+        started = time.perf_counter()
+
+        # Получаем скомпилированную конфигурацию полей
+        config = self.config_registry.get(template_name)
+        if not config:
+            logger.error(f"Конфигурация не найдена для шаблона: {template_name}")
+            return None
+        config_loaded = time.perf_counter()
+        METRICS.observe("config", template_name, config_loaded - started)
+
+        # Загружаем изображение шаблона
+        template_path = os.path.join(self.templates_dir, template_name)
         try:
-            # Загружаем изображение шаблона
-            template_path = os.path.join(self.templates_dir, template_name)
-            if not os.path.exists(template_path):
-                logger.error(f"Шаблон не найден: {template_path}")
-                return False
+            image = self.template_cache.get(template_path)
+        except FileNotFoundError:
+            logger.error(f"Шаблон не найден: {template_path}")
+            return None
+        template_loaded = time.perf_counter()
+        METRICS.observe("template", template_name, template_loaded - config_loaded)
 
-            image = Image.open(template_path)
-            draw = ImageDraw.Draw(image)
+        draw = ImageDraw.Draw(image)
+
+        # Заполняем поля
+        font_seconds = 0.0
+        for field in config.fields:
+            if field.name in data:
+                font_seconds += self._draw_text(draw, data[field.name], field)
+        METRICS.observe("fonts", template_name, font_seconds)
+        METRICS.observe("draw", template_name, time.perf_counter() - template_loaded - font_seconds)
+        return image
+
+    def resolve_output_profile(self, template_name: str, requested: Optional[str] = None) -> OutputProfile:
+        """
+        Выбрать профиль кодирования: из запроса, из конфигурации шаблона или по умолчанию
+
+        Raises:
+            ValueError: неизвестный профиль
+        """
+        if requested:
+            return get_profile(requested)
+        config = self.config_registry.get(template_name)
+        if config and config.output_profile:
+            return config.output_profile
+        return self.default_output_profile
+
+    def fill_document_bytes(self, template_name: str, data: Dict[str, str],
+                            profile: Optional[OutputProfile] = None) -> Optional[bytes]:
+        """Заполнить документ и закодировать его в памяти, без записи на диск"""
+        try:
+            profile = profile or self.resolve_output_profile(template_name)
+            template_format = IMAGE_FORMATS.get(os.path.splitext(template_name)[1].lower(), 'PNG')
+
+            if self.static_layers.enabled:
+                content = self._fill_png_bands(template_name, data, profile, template_format)
+                if content is not None:
+                    return content
+
+            image = self.render_document(template_name, data)
+            if image is None:
+                return None
+
+            with METRICS.timer("encode", template_name):
+                return encode_image(image, profile, template_format)
+
+        except Exception as e:
+            logger.error(f"Ошибка заполнения документа: {e}")
+            return None
 
-            # Загружаем конфигурацию полей
-            config = self.load_template_config(template_name)
+    def _fill_png_bands(self, template_name: str, data: Dict[str, str], profile: OutputProfile,
+                        template_format: str) -> Optional[bytes]:
+        """
+        Собрать PNG из заранее сжатых полос шаблона, перерисовав только полосы с текстом
+
+        Полный шаблон не копируется и не сжимается заново: копируются и сжимаются
+        только полосы строк, которые пересекает текст полей.
+
+        Returns:
+            PNG или None, если профиль, шаблон или поля не подходят (тогда документ
+            рендерится целиком)
+        """
+        level = png_compress_level(profile, template_format)
+        config = self.config_registry.get(template_name)
+        if level is None or not config:
+            return None
+
+        started = time.perf_counter()
+        template_path = os.path.join(self.templates_dir, template_name)
+        try:
+            stat = os.stat(template_path)
+            base = self.template_cache.get_base(template_path)
+        except FileNotFoundError:
+            return None
+        if not band_encodable(base):
+            return None
+        layer = self.static_layers.get(template_path, (stat.st_mtime_ns, stat.st_size), base, level)
+        template_loaded = time.perf_counter()
+        METRICS.observe("template", template_name, template_loaded - started)
+
+        # Полосы, которые затрагивает текст каждого поля
+        dirty_fields: Dict[int, List] = {}
+        try:
+            for field in config.fields:
+                if field.name not in data:
+                    continue
+                fill = field.ink(base.mode)
+                if base.mode == 'P':
+                    # Цвет берется из палитры шаблона, чтобы индексы во всех полосах совпадали
+                    fill = palette_index(base, field.ink('RGB'))
+                    if fill is None:
+                        return None
+                if field.box is not None:
+                    top, bottom = self.text_layout.layout(field, data[field.name]).rows(field.y)
+                else:
+                    font = field.font or self.font_cache.get_font(field.font_size, field.font_family, field.font_weight)
+                    top, bottom = text_rows(field.position, data[field.name], font)
+                for index in layer.band_range(top, bottom):
+                    dirty_fields.setdefault(index, []).append((field, fill))
+        except Exception as e:
+            logger.debug(f"Поля {template_name} не удалось разметить по полосам: {e}")
+            return None
+
+        dirty = {}
+        for index, band_fields in dirty_fields.items():
+            box = layer.band_box(index)
+            band = base.crop(box)
+            draw = ImageDraw.Draw(band)
+            for field, fill in band_fields:
+                self._draw_text(draw, data[field.name], field, origin=box[:2], fill=fill)
+            dirty[index] = band
+        drawn = time.perf_counter()
+        METRICS.observe("draw", template_name, drawn - template_loaded)
+
+        content = layer.encode(dirty, level, base.getpalette() if base.mode == 'P' else None)
+        METRICS.observe("encode", template_name, time.perf_counter() - drawn)
+        return content
+
+    def render_preview_bytes(self, template_name: str, data: Dict[str, str]) -> Optional[bytes]:
+        """
+        Нарисовать черновик в уменьшенном разрешении и закодировать его в JPEG
+
+        Шрифты и координаты масштабируются вместе с шаблоном. Раскладка полей
+        с областью вычисляется в полном размере (и кэшируется для последующего
+        заполнения), поэтому переносы строк в черновике совпадают с документом.
+        """
+        try:
+            config = self.config_registry.get(template_name)
             if not config:
                 logger.error(f"Конфигурация не найдена для шаблона: {template_name}")
-                return False
-
-            # Заполняем поля
-            for field_name, field_config in config.get('fields', {}).items():
-                if field_name in data:
-                    self._draw_text(
-                        draw=draw,
-                        text=data[field_name],
-                        position=(field_config['x'], field_config['y']),
-                        font_size=field_config.get('font_size', self.default_font_size),
-                        color=field_config.get('color', '#000000')
-                    )
-
-            # Сохраняем результат
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            image.save(output_path, quality=95)
-            logger.info(f"Документ сохранен: {output_path}")
-            return True
+                return None
+            template_path = os.path.join(self.templates_dir, template_name)
+            image, scale = self.previews.get(template_path, self.template_cache.get_base)
+            draw = ImageDraw.Draw(image)
+            for field in config.fields:
+                if field.name in data:
+                    self._draw_preview_text(draw, data[field.name], field, scale)
+            return encode_image(image, self.preview_profile, 'JPEG')
+        except FileNotFoundError:
+            logger.error(f"Шаблон не найден: {template_name}")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка рендеринга черновика {template_name}: {e}")
+            return None
+
+    def _draw_preview_text(self, draw: ImageDraw.Draw, text: str, field: FieldConfig, scale: float):
+        if field.box is not None:
+            layout = self.text_layout.layout(field, text)
+            font = self.font_cache.get_font(max(1, round(layout.font_size * scale)), field.font_family, field.font_weight)
+            for line, dx, dy in layout.lines:
+                draw.text((round((field.x + dx) * scale), round((field.y + dy) * scale)), line,
+                          fill=field.ink(draw.mode), font=font)
+            return
+        font = self.font_cache.get_font(max(1, round(field.font_size * scale)), field.font_family, field.font_weight)
+        draw.text((round(field.x * scale), round(field.y * scale)), text, fill=field.ink(draw.mode), font=font)
 
+    def fill_document(self, template_name: str, data: Dict[str, str], output_path: str) -> bool:
+        """
+        Заполнить документ данными
+
+        Args:
+            template_name: имя файла шаблона
+            data: словарь с данными для заполнения {'field_name': 'value'}
+            output_path: путь для сохранения результата
+        """
+        content = self.fill_document_bytes(template_name, data)
+        if content is None:
+            return False
+        try:
+            self.write_output(content, output_path)
+            return True
         except Exception as e:
-            logger.error(f"Ошибка заполнения документа: {e}")
+            logger.error(f"Ошибка сохранения документа {output_path}: {e}")
             return False
 
-    def _draw_text(self, draw: ImageDraw.Draw, text: str, position: Tuple[int, int],
-                   font_size: int, color: str = '#000000'):
-        """Нарисовать текст на изображении"""
+    def write_output(self, content: bytes, output_path: str):
+        """Записать готовый документ на диск"""
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as f:
+            f.write(content)
+        logger.info(f"Документ сохранен: {output_path}")
+
+    async def store_output(self, content: bytes, output_path: str,
+                           on_stored: Optional[Callable[[int], Awaitable]] = None):
+        """
+        Сохранить готовый документ согласно режиму OUTPUT_STORAGE
+
+        sync - дождаться записи, async - записать в фоне, off - не сохранять.
+        Запись в любом случае выполняется вне event loop и атомарна.
+
+        Args:
+            on_stored: корутина, вызываемая с размером файла после записи
+        """
+        if self.output_storage == "off":
+            return
+        if self.output_storage == "sync":
+            await self._store(content, output_path, on_stored)
+            return
+
+        task = asyncio.create_task(self._store(content, output_path, on_stored))
+        self._background_writes.add(task)
+        task.add_done_callback(self._on_background_write_done)
+
+    async def _store(self, content: bytes, output_path: str, on_stored: Optional[Callable[[int], Awaitable]]):
+        # Документ уже готов: ошибка диска не должна мешать отправке его пользователю
         try:
-            # Пытаемся найти подходящий шрифт с поддержкой кириллицы
-            font_paths = [
-                "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-                "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-                "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
-                "/System/Library/Fonts/Arial.ttf",
-                "/Windows/Fonts/arial.ttf",
-                "arial.ttf"
-            ]
-
-            font = None
-            for font_path in font_paths:
-                try:
-                    font = ImageFont.truetype(font_path, font_size)
-                    break
-                except:
-                    continue
+            await self.storage.write_bytes(output_path, content)
+            logger.info(f"Документ сохранен: {output_path}")
+            if on_stored:
+                await on_stored(len(content))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения документа {output_path}: {e}")
 
-            if font is None:
-                # Если не удалось загрузить TrueType шрифт, используем базовый
-                font = ImageFont.load_default()
-                logger.warning("Используется базовый шрифт, кириллица может отображаться некорректно")
+    def _on_background_write_done(self, task: asyncio.Task):
+        self._background_writes.discard(task)
+
+    async def _run_in_pool(self, method: str, *args, on_queued: Optional[Callable[[int], Awaitable]] = None,
+                           owner: Optional[int] = None, priority: bool = False, stage: str = "render"):
+        # Первый аргумент всех методов рендеринга - имя шаблона; время этапа
+        # считается пулом после получения воркера, без ожидания в очереди
+        if self.render_executor.mode == "process":
+            result, samples = await self.render_executor.submit(
+                _call_in_worker, self.templates_dir, self.config_dir, method, *args,
+                on_queued=on_queued, owner=owner, priority=priority, stage=stage, template=args[0]
+            )
+            METRICS.observe_many(samples)
+            return result
+        return await self.render_executor.submit(
+            getattr(self, method), *args, on_queued=on_queued, owner=owner, priority=priority,
+            stage=stage, template=args[0]
+        )
+
+    async def fill_document_async(self, template_name: str, data: Dict[str, str], output_path: str,
+                                  on_queued: Optional[Callable[[int], Awaitable]] = None,
+                                  owner: Optional[int] = None, priority: bool = False) -> bool:
+        """
+        Заполнить документ в пуле рендеринга, не блокируя event loop
+
+        Args:
+            on_queued: корутина, вызываемая с позицией в очереди, если все воркеры заняты
+            owner: id пользователя - очереди пользователей обслуживаются по кругу
+            priority: обслужить раньше обычных задач (администратор)
+
+        Raises:
+            RenderQueueFull: очередь рендеринга переполнена
+        """
+        return await self._run_in_pool("fill_document", template_name, data, output_path,
+                                       on_queued=on_queued, owner=owner, priority=priority)
+
+    async def fill_document_bytes_async(self, template_name: str, data: Dict[str, str],
+                                        profile: Optional[OutputProfile] = None,
+                                        on_queued: Optional[Callable[[int], Awaitable]] = None,
+                                        owner: Optional[int] = None, priority: bool = False) -> Optional[bytes]:
+        """
+        Заполнить документ в пуле рендеринга и вернуть закодированное изображение
+
+        Raises:
+            RenderQueueFull: очередь рендеринга переполнена
+        """
+        return await self._run_in_pool("fill_document_bytes", template_name, data, profile,
+                                       on_queued=on_queued, owner=owner, priority=priority)
+
+    async def render_preview_async(self, template_name: str, data: Dict[str, str],
+                                   owner: Optional[int] = None, priority: bool = False) -> Optional[bytes]:
+        """
+        Нарисовать черновик в пуле рендеринга
+
+        Raises:
+            RenderQueueFull: очередь рендеринга переполнена
+        """
+        return await self._run_in_pool("render_preview_bytes", template_name, data,
+                                       owner=owner, priority=priority, stage="preview")
+
+    def _draw_text(self, draw: ImageDraw.Draw, text: str, field: FieldConfig,
+                   origin: Tuple[int, int] = (0, 0), fill=None) -> float:
+        """
+        Нарисовать текст поля на изображении
+
+        Args:
+            origin: координаты левого верхнего угла изображения в шаблоне (для фрагментов шаблона)
+            fill: цвет вместо цвета поля (например, индекс палитры); по умолчанию -
+                цвет поля в режиме изображения
+
+        Returns:
+            время получения шрифта и раскладки текста, секунды (для метрик)
+        """
+        started = time.perf_counter()
+        font_seconds = 0.0
+        position = (field.x - origin[0], field.y - origin[1])
+        fill = field.ink(draw.mode) if fill is None else fill
+        try:
+            if field.box is not None:
+                # Перенос по словам и подбор размера под область поля
+                layout = self.text_layout.layout(field, text)
+                font_seconds = time.perf_counter() - started
+                for line, dx, dy in layout.lines:
+                    self._draw_line(draw, (position[0] + dx, position[1] + dy), line, layout.font, fill)
+                return font_seconds
+
+            font = field.font or self.font_cache.get_font(field.font_size, field.font_family, field.font_weight)
+            font_seconds = time.perf_counter() - started
 
             # Рисуем текст с поддержкой кириллицы
-            draw.text(position, text, fill=color, font=font)
+            self._draw_line(draw, position, text, font, fill)
 
         except Exception as e:
             logger.error(f"Ошибка рисования текста: {e}")
             # Fallback - рисуем без шрифта
             try:
-                draw.text(position, text, fill=color)
+                draw.text(position, text, fill=fill)
             except Exception as fallback_error:
                 logger.error(f"Критическая ошибка рисования текста: {fallback_error}")
+        return font_seconds
+
+    def _draw_line(self, draw: ImageDraw.Draw, position: Tuple[int, int], text: str, font, fill):
+        """Вывести строку: повторяющиеся строки берутся готовыми масками из кэша"""
+        tile = self.text_tiles.get(text, font, draw.fontmode)
+        if tile is None:
+            draw.text(position, text, fill=fill, font=font)
+        else:
+            tile.draw(draw, position, fill)
+
+    async def _warm_text_tiles_async(self, template_names: Optional[List[str]] = None):
+        """Растеризовать частые значения вне event loop (в пуле процессов это делает каждый воркер)"""
+        if self.render_executor.mode == "process":
+            return
+        try:
+            await self.storage.run(self.warm_text_tiles, template_names)
+        except Exception as e:
+            logger.error(f"Ошибка растеризации частых значений полей: {e}")
+
+    def warm_text_tiles(self, template_names: Optional[List[str]] = None) -> int:
+        """
+        Растеризовать частые значения полей (common_values) заранее
+
+        Args:
+            template_names: шаблоны, конфигурации которых изменились (None - все)
+
+        Returns:
+            количество добавленных в кэш строк
+        """
+        if not self.text_tiles.enabled:
+            return 0
+        warmed = 0
+        for template_name in template_names if template_names is not None else self.config_registry.names():
+            config = self.config_registry.get(template_name)
+            if not config or not any(field.common_values for field in config.fields):
+                continue
+            try:
+                with Image.open(os.path.join(self.templates_dir, template_name)) as template:
+                    # Режим сглаживания, который ImageDraw выберет для этого шаблона
+                    fontmode = ImageDraw.Draw(Image.new(template.mode, (1, 1))).fontmode
+            except (OSError, ValueError):
+                continue
+            for field in config.fields:
+                for value in field.common_values:
+                    if field.box is not None:
+                        layout = self.text_layout.layout(field, value)
+                        lines = [(line, layout.font) for line, _, _ in layout.lines]
+                    else:
+                        font = field.font or self.font_cache.get_font(field.font_size, field.font_family,
+                                                                       field.font_weight)
+                        lines = [(value, font)]
+                    for line, font in lines:
+                        warmed += self.text_tiles.warm(line, font, fontmode)
+        if warmed:
+            logger.info(f"Растеризовано частых значений полей: {warmed}")
+        return warmed
 
     def create_template_config(self, template_name: str, fields: Dict[str, Dict]) -> bool:
         """
@@ -134,7 +594,9 @@ class DocumentProcessor:
 
         Args:
             template_name: имя файла шаблона
-            fields: словарь полей {'field_name': {'x': int, 'y': int, 'font_size': int, 'color': str}}
+            fields: словарь полей {'field_name': {'x': int, 'y': int, 'font_size': int, 'color': str,
+                    'font_family': 'sans' | 'serif' | 'mono' | путь к .ttf, 'font_weight': 'regular' | 'bold',
+                    'width': int, 'height': int, 'align': 'left' | 'center' | 'right', 'max_lines': int}}
         """
         config = {
             'template_name': template_name,
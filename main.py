@@ -4,6 +4,7 @@ import os
 from dotenv import load_dotenv
 
 from bot import DocumentBot
+from event_log import EventLog
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -18,11 +19,11 @@ logging.basicConfig(
     ]
 )
 
-# Настройка отдельного логгера для пользователей
+# Настройка отдельного логгера для пользователей: структурированный журнал с ротацией,
+# запись в файл выполняется в отдельном потоке
 user_logger = logging.getLogger('user_activity')
-user_handler = logging.FileHandler('user_activity.log')
-user_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-user_logger.addHandler(user_handler)
+event_log = EventLog.from_env()
+event_log.attach(user_logger)
 user_logger.setLevel(logging.INFO)
 
 logger = logging.getLogger(__name__)
@@ -37,21 +38,34 @@ async def main():
 
     # Создаем необходимые директории
     os.makedirs("templates", exist_ok=True)
-    os.makedirs("filled_documents", exist_ok=True)
+    os.makedirs(os.getenv("OUTPUT_DIR", "filled_documents"), exist_ok=True)
     os.makedirs("config", exist_ok=True)
 
     logger.info("Создание экземпляра бота...")
     bot = DocumentBot(bot_token)
 
     try:
-        logger.info("Запуск бота...")
-        await bot.start_polling()
+        # Режим работы: polling (по умолчанию) или webhook
+        mode = os.getenv("BOT_MODE", "polling").strip().lower()
+        logger.info(f"Запуск бота в режиме {mode}...")
+        if mode == "webhook":
+            await bot.start_webhook(
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", "8080")),
+                base_url=os.getenv("WEBHOOK_URL") or None,
+                path=os.getenv("WEBHOOK_PATH", "/webhook"),
+                secret_token=os.getenv("WEBHOOK_SECRET") or None,
+                max_concurrent=int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "50"))
+            )
+        else:
+            await bot.start_polling()
     except KeyboardInterrupt:
         logger.info("Получен сигнал остановки")
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
     finally:
         logger.info("Остановка бота...")
+        event_log.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,273 @@
+from aiohttp import web
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Шаблоны сверх этого количества учитываются под меткой OTHER_TEMPLATE (ограничение числа рядов)
+OTHER_TEMPLATE = "other"
+
+# Этапы обработки документа в порядке выполнения; preview - черновик целиком (без отправки)
+STAGES = ("queue_wait", "config", "template", "fonts", "draw", "encode", "render", "store", "upload", "total",
+          "preview")
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами (формат Prometheus)"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+class Metrics:
+    """
+    Метрики этапов рендеринга: гистограммы по (этап, шаблон) и мгновенные значения
+
+    Наблюдение - один bisect и несколько сложений под блокировкой, поэтому таймеры
+    можно ставить на горячий путь.
+    """
+
+    def __init__(self, max_templates: int = 200):
+        self.max_templates = max_templates
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._templates: set = set()
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+        self._capture = threading.local()
+
+    def _template_label(self, template: Optional[str]) -> str:
+        if not template:
+            return ""
+        if template in self._templates:
+            return template
+        if len(self._templates) >= self.max_templates:
+            return OTHER_TEMPLATE
+        self._templates.add(template)
+        return template
+
+    def observe(self, stage: str, template: Optional[str], seconds: float):
+        """Учесть длительность этапа"""
+        samples = getattr(self._capture, 'samples', None)
+        if samples is not None:
+            samples.append((stage, template, seconds))
+            return
+        with self._lock:
+            key = (stage, self._template_label(template))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_many(self, samples: List[Tuple[str, Optional[str], float]]):
+        for stage, template, seconds in samples:
+            self.observe(stage, template, seconds)
+
+    @contextmanager
+    def timer(self, stage: str, template: Optional[str] = None) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, template, time.perf_counter() - started)
+
+    @contextmanager
+    def capture(self) -> Iterator[List[Tuple[str, Optional[str], float]]]:
+        """
+        Собрать наблюдения текущего потока в список вместо гистограмм
+
+        Используется в процессах пула рендеринга: замеры возвращаются вместе
+        с результатом и учитываются в основном процессе.
+        """
+        samples: List[Tuple[str, Optional[str], float]] = []
+        self._capture.samples = samples
+        try:
+            yield samples
+        finally:
+            self._capture.samples = None
+
+    def add_gauge(self, name: str, help_text: str, func: Callable[[], float]):
+        """Зарегистрировать мгновенное значение, вычисляемое при экспорте"""
+        self._gauges[name] = (help_text, func)
+
+    def _snapshot(self) -> Dict[Tuple[str, str], Histogram]:
+        with self._lock:
+            snapshot = {}
+            for key, histogram in self._histograms.items():
+                copy = snapshot[key] = Histogram()
+                copy.merge(histogram)
+            return snapshot
+
+    def stage_summary(self) -> Dict[str, Histogram]:
+        """Гистограммы этапов, объединенные по всем шаблонам"""
+        stages: Dict[str, Histogram] = {}
+        for (stage, _), histogram in self._snapshot().items():
+            stages.setdefault(stage, Histogram()).merge(histogram)
+        return stages
+
+    def template_summary(self, stage: str = "render") -> Dict[str, Histogram]:
+        """Гистограммы одного этапа по шаблонам"""
+        return {template: histogram for (name, template), histogram in self._snapshot().items()
+                if name == stage and template}
+
+    def gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, (_, func) in self._gauges.items():
+            try:
+                values[name] = float(func())
+            except Exception as e:
+                logger.debug(f"Ошибка вычисления метрики {name}: {e}")
+        return values
+
+    def render_prometheus(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = [
+            "# HELP docbot_stage_seconds Длительность этапов обработки документа",
+            "# TYPE docbot_stage_seconds histogram",
+        ]
+        for (stage, template), histogram in sorted(self._snapshot().items()):
+            labels = f'stage="{stage}",template="{_escape(template)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'docbot_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'docbot_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'docbot_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}')
+            lines.append(f'docbot_stage_seconds_count{{{labels}}} {histogram.count}')
+
+        values = self.gauges()
+        for name, (help_text, _) in sorted(self._gauges.items()):
+            if name in values:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {values[name]:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Метрики процесса; в процессах пула рендеринга - собственный экземпляр
+METRICS = Metrics(max_templates=int(os.getenv("METRICS_MAX_TEMPLATES", "200")))
+
+
+class SamplingProfiler:
+    """
+    Статистический профилировщик, который можно включать во время работы
+
+    Отдельный поток раз в interval секунд снимает стеки всех потоков процесса
+    (sys._current_frames) и считает, сколько раз встретился каждый стек.
+    Накладные расходы - только в момент снятия стеков; выключенный профилировщик
+    ничего не стоит.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: collections.Counter = collections.Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.stacks.clear()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Профилировщик запущен, интервал {self.interval * 1000:g} мс")
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logger.info(f"Профилировщик остановлен, снимков: {self.samples}")
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def top_functions(self, limit: int = 15) -> List[Tuple[str, int]]:
+        """Функции, чаще всего находившиеся на вершине стека"""
+        own: collections.Counter = collections.Counter()
+        for stack, count in list(self.stacks.items()):
+            own[stack.rsplit(";", 1)[-1]] += count
+        return own.most_common(limit)
+
+    def collapsed(self) -> str:
+        """Стеки в формате collapsed stacks (для flamegraph.pl / speedscope)"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+async def start_metrics_server(host: str, port: int, metrics: Metrics = METRICS) -> web.AppRunner:
+    """Запустить HTTP-сервер с GET /metrics в формате Prometheus"""
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
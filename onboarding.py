@@ -0,0 +1,336 @@
+"""
+Массовая подготовка конфигураций шаблонов по изображениям
+
+На каждом шаблоне ищутся места для заполнения: горизонтальные линии и подчеркивания
+(над которыми пусто) и пустые рамки. Для них предлагается конфигурация
+config/<шаблон>.json в обычном формате; поля называются поле_1, поле_2, ... в порядке
+чтения - после проверки их остается переименовать.
+
+Шаблоны обрабатываются в пуле процессов. Сгенерированные конфигурации помечаются
+блоком "onboarding" с хэшем содержимого шаблона: неизмененные шаблоны пропускаются,
+а конфигурации, созданные или исправленные вручную (без этого блока), не
+перезаписываются без --force.
+
+Запуск из корня проекта:
+    python onboarding.py
+    python onboarding.py --dry-run --json proposals.json
+    python onboarding.py --only "invoice_*" --force
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import cv2
+import numpy as np
+
+from template_catalog import TEMPLATE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# Версия алгоритма: при ее изменении сгенерированные конфигурации пересоздаются
+DETECTOR_VERSION = 1
+
+# Доля закрашенных пикселей, при которой область считается пустой
+EMPTY_INK_RATIO = 0.01
+
+MIN_FONT_SIZE = 10
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _ink_ratio(integral: np.ndarray, x0: int, y0: int, x1: int, y1: int) -> float:
+    """Доля закрашенных пикселей в прямоугольнике [x0, x1) x [y0, y1) по интегральному изображению"""
+    if x1 <= x0 or y1 <= y0:
+        return 1.0
+    total = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    return total / ((x1 - x0) * (y1 - y0))
+
+
+def _overlaps(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> float:
+    """Доля площади меньшего из прямоугольников (x, y, w, h), занятая их пересечением"""
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    return width * height / min(a[2] * a[3], b[2] * b[3])
+
+
+def _text_font_size(text: np.ndarray, height: int, max_font_size: int) -> int:
+    """Размер шрифта, соответствующий печатному тексту шаблона (по медианной высоте символов)"""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(text, connectivity=8)
+    heights = stats[1:count, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:count, cv2.CC_STAT_WIDTH]
+    glyphs = heights[(heights >= 6) & (heights <= height // 20) & (widths <= heights * 3)]
+    if not glyphs.size:
+        return int(np.clip(height // 60, MIN_FONT_SIZE, max_font_size))
+    # Высота прописных букв - примерно 0.7 размера шрифта
+    return int(np.clip(round(np.median(glyphs) / 0.7), MIN_FONT_SIZE, max_font_size))
+
+
+def detect_fields(gray: np.ndarray) -> List[Dict]:
+    """
+    Найти места для заполнения на изображении в оттенках серого
+
+    Returns:
+        поля в формате конфигурации (без имен) в порядке чтения
+    """
+    height, width = gray.shape
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    ink = (binary > 0).astype(np.uint8)
+    integral = cv2.integral(ink)
+
+    # Морфологическое открытие оставляет только длинные горизонтальные и вертикальные штрихи
+    min_line = max(30, width // 30)
+    min_vertical = max(12, height // 100)
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (min_line, 1)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, min_vertical)))
+    lines = cv2.bitwise_or(horizontal, vertical)
+    max_thickness = max(4, height // 300)
+    max_font_size = max(MIN_FONT_SIZE, height // 35)
+    font_size = _text_font_size(cv2.bitwise_and(binary, cv2.bitwise_not(lines)), height, max_font_size)
+
+    # Рамки: прямоугольники из горизонтальных и вертикальных штрихов; заполнять можно только пустые
+    frames: List[Tuple[int, int, int, int]] = []
+    boxes: List[Tuple[int, int, int, int]] = []
+    contours, _ = cv2.findContours(lines, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < min_line or h < min_vertical or h > height // 4 or w > width * 0.95:
+            continue
+        edges = vertical[y:y + h, max(0, x - 2):x + 3].any(axis=1).mean(), \
+            vertical[y:y + h, max(0, x + w - 3):x + w + 2].any(axis=1).mean()
+        if min(edges) < 0.8:
+            continue
+        frames.append((x, y, w, h))
+        margin = max_thickness + 2
+        if _ink_ratio(integral, x + margin, y + margin, x + w - margin, y + h - margin) > EMPTY_INK_RATIO:
+            continue
+        # Внешний и внутренний контур одной рамки - оставляем внутренний
+        duplicate = next((i for i, box in enumerate(boxes) if _overlaps(box, (x, y, w, h)) > 0.8), None)
+        if duplicate is None:
+            boxes.append((x, y, w, h))
+        elif w * h < boxes[duplicate][2] * boxes[duplicate][3]:
+            boxes[duplicate] = (x, y, w, h)
+
+    fields: List[Dict] = []
+    for x, y, w, h in boxes:
+        padding = max_thickness + 3
+        inner_height = h - 2 * padding
+        size = int(np.clip(min(font_size, round(inner_height * 0.7)), MIN_FONT_SIZE, max_font_size))
+        field = {
+            'x': x + padding,
+            'y': y + padding + max(0, (inner_height - round(size * 1.2)) // 2),
+            'font_size': size,
+            'width': w - 2 * padding,
+        }
+        if inner_height >= size * 2.4:
+            field.update(y=y + padding, height=inner_height)
+        fields.append(field)
+
+    # Линии и подчеркивания: тонкие длинные компоненты, над которыми есть свободное место
+    count, _, stats, _ = cv2.connectedComponentsWithStats(horizontal, connectivity=8)
+    stats = stats[1:count]
+    stats = stats[(stats[:, cv2.CC_STAT_WIDTH] >= min_line) & (stats[:, cv2.CC_STAT_HEIGHT] <= max_thickness)]
+    search_height = max_font_size * 2
+    for x, y, w, h, _ in stats[np.argsort(stats[:, cv2.CC_STAT_TOP])]:
+        x, y, w, h = int(x), int(y), int(w), int(h)
+        # Стороны рамок и линии внутри них (например, таблиц) - не места для заполнения
+        if any(box[0] - 3 <= x and x + w <= box[0] + box[2] + 3 and box[1] - 3 <= y <= box[1] + box[3] + 3
+               for box in frames):
+            continue
+        # Расстояние от линии до ближайшей закрашенной строки над ней
+        top = max(0, y - search_height)
+        rows = ink[top:y, x:x + w].sum(axis=1) > w * EMPTY_INK_RATIO
+        filled = np.flatnonzero(rows)
+        gap = (y - top) - (filled[-1] + 1) if filled.size else y - top
+        if gap < MIN_FONT_SIZE * 1.2:
+            continue
+        size = int(np.clip(min(font_size, round(gap * 0.6)), MIN_FONT_SIZE, max_font_size))
+        padding = max(2, size // 4)
+        fields.append({
+            'x': x + padding,
+            'y': y - round(size * 0.95) - 2,
+            'font_size': size,
+            'width': w - 2 * padding,
+        })
+
+    # Порядок чтения: строки сверху вниз (с допуском на высоту строки текста), в строке - слева направо
+    fields.sort(key=lambda field: (round(field['y'] / font_size), field['x']))
+    for field in fields:
+        field['color'] = '#000000'
+    return fields
+
+
+def detect_template(task: Tuple[str, Optional[str]]) -> Dict:
+    """
+    Обработать один шаблон в процессе пула
+
+    Args:
+        task: (путь к шаблону, хэш из существующей сгенерированной конфигурации)
+    """
+    path, known_hash = task
+    started = time.perf_counter()
+    try:
+        source_hash = content_hash(path)
+        if source_hash == known_hash:
+            return {'path': path, 'status': 'unchanged', 'hash': source_hash}
+        data = np.fromfile(path, dtype=np.uint8)
+        gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            return {'path': path, 'status': 'error', 'error': "не удалось декодировать изображение"}
+        fields = detect_fields(gray)
+        return {'path': path, 'status': 'detected', 'hash': source_hash, 'fields': fields,
+                'seconds': time.perf_counter() - started}
+    except Exception as e:
+        return {'path': path, 'status': 'error', 'error': str(e)}
+
+
+def _init_worker():
+    # Параллельность обеспечивает пул процессов - внутренние потоки OpenCV только мешают
+    cv2.setNumThreads(1)
+
+
+def build_config(template_name: str, fields: List[Dict], source_hash: str,
+                 previous: Optional[Dict] = None) -> Dict:
+    """Конфигурация шаблона; category, tags и output переносятся из предыдущей сгенерированной версии"""
+    config = {
+        'template_name': template_name,
+        'fields': {f"поле_{i}": field for i, field in enumerate(fields, 1)},
+    }
+    for key in ('category', 'tags', 'output'):
+        if previous and key in previous:
+            config[key] = previous[key]
+    config['onboarding'] = {'source_sha256': source_hash, 'detector': DETECTOR_VERSION, 'fields': len(fields)}
+    return config
+
+
+def _load_config(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать {path}: {e}")
+        return None
+
+
+def _write_config(path: str, config: Dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def onboard(templates_dir: str, config_dir: str, workers: int = 0, force: bool = False,
+            dry_run: bool = False, only: Optional[str] = None) -> Dict:
+    """
+    Предложить конфигурации для всех шаблонов каталога
+
+    Returns:
+        {'counts': {статус: количество}, 'templates': {шаблон: результат}, 'seconds': время}
+    """
+    started = time.perf_counter()
+    names = sorted(name for name in os.listdir(templates_dir)
+                   if name.lower().endswith(TEMPLATE_EXTENSIONS) and (not only or fnmatch.fnmatch(name, only)))
+    os.makedirs(config_dir, exist_ok=True)
+
+    results: Dict[str, Dict] = {}
+    tasks = []
+    previous_configs: Dict[str, Optional[Dict]] = {}
+    for name in names:
+        previous = _load_config(os.path.join(config_dir, f"{name}.json"))
+        previous_configs[name] = previous
+        generated = previous.get('onboarding') if isinstance(previous, dict) else None
+        if previous is not None and not generated and not force:
+            results[name] = {'status': 'manual'}
+            continue
+        known_hash = None
+        if generated and not force and generated.get('detector') == DETECTOR_VERSION:
+            known_hash = generated.get('source_sha256')
+        tasks.append((os.path.join(templates_dir, name), known_hash))
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, min(16, len(tasks) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        for result in executor.map(detect_template, tasks, chunksize=chunksize):
+            name = os.path.basename(result['path'])
+            if result['status'] == 'detected':
+                if not result['fields']:
+                    result['status'] = 'empty'
+                else:
+                    previous = previous_configs.get(name)
+                    config = build_config(name, result['fields'], result['hash'],
+                                          previous if isinstance(previous, dict) else None)
+                    result['config'] = config
+                    result['status'] = 'updated' if previous is not None else 'created'
+                    if not dry_run:
+                        _write_config(os.path.join(config_dir, f"{name}.json"), config)
+            results[name] = result
+
+    counts: Dict[str, int] = {}
+    for result in results.values():
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'counts': counts, 'templates': results, 'seconds': time.perf_counter() - started}
+
+
+STATUS_LABELS = {
+    'created': "создано конфигураций",
+    'updated': "обновлено (шаблон изменился)",
+    'unchanged': "без изменений",
+    'manual': "пропущено (конфигурация настроена вручную, см. --force)",
+    'empty': "поля не найдены",
+    'error': "ошибки",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Автоматическое определение полей и создание конфигураций шаблонов")
+    parser.add_argument("--templates", default="templates", help="каталог шаблонов")
+    parser.add_argument("--config", default="config", help="каталог конфигураций")
+    parser.add_argument("--workers", type=int, default=0, help="процессов (0 - по числу ядер)")
+    parser.add_argument("--only", help="обработать только шаблоны по маске (например, 'invoice_*')")
+    parser.add_argument("--force", action="store_true",
+                        help="пересоздать конфигурации, в том числе настроенные вручную")
+    parser.add_argument("--dry-run", action="store_true", help="не записывать конфигурации")
+    parser.add_argument("--json", help="сохранить предложенные конфигурации и статусы в файл")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if not os.path.isdir(args.templates):
+        print(f"Каталог шаблонов не найден: {args.templates}", file=sys.stderr)
+        sys.exit(1)
+
+    report = onboard(args.templates, args.config, workers=args.workers, force=args.force,
+                     dry_run=args.dry_run, only=args.only)
+
+    total = sum(report['counts'].values())
+    print(f"Шаблонов: {total}, время: {report['seconds']:.1f} с")
+    for status, label in STATUS_LABELS.items():
+        if report['counts'].get(status):
+            print(f"  {label}: {report['counts'][status]}")
+    for name, result in sorted(report['templates'].items()):
+        if result['status'] == 'error':
+            print(f"  ❌ {name}: {result['error']}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+from PIL import Image
+from dataclasses import dataclass, field, replace
+import io
+from typing import Dict, List, Optional, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Формат сохранения по расширению файла шаблона
+IMAGE_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.jpeg': 'JPEG'}
+
+# Минимальное качество при подборе под целевой размер файла
+MIN_TARGET_QUALITY = 30
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """Профиль кодирования готового документа"""
+    name: str
+    format: Optional[str] = None  # None - формат шаблона
+    options: Dict = field(default_factory=dict)
+    palette_colors: Optional[int] = None
+    target_bytes: Optional[int] = None
+    as_document: bool = False
+
+    def extension(self, template_ext: str) -> str:
+        """Расширение файла результата"""
+        if self.format is None:
+            return template_ext
+        return {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp', 'PDF': '.pdf'}[self.format]
+
+
+BUILTIN_PROFILES: Dict[str, OutputProfile] = {
+    # Как раньше: формат шаблона, quality=95
+    'original': OutputProfile('original', options={'quality': 95}),
+    'png': OutputProfile('png', 'PNG', {'compress_level': 6}),
+    'png_fast': OutputProfile('png_fast', 'PNG', {'compress_level': 1}),
+    'png_small': OutputProfile('png_small', 'PNG', {'optimize': True}),
+    # Черный текст на белом бланке почти не теряет в качестве на 16 цветах
+    'png_palette': OutputProfile('png_palette', 'PNG', {'optimize': True}, palette_colors=16),
+    'jpeg': OutputProfile('jpeg', 'JPEG', {'quality': 85, 'optimize': True}),
+    'webp': OutputProfile('webp', 'WEBP', {'quality': 80, 'method': 4}, as_document=True),
+    'pdf': OutputProfile('pdf', 'PDF', {'resolution': 150.0}, as_document=True),
+}
+
+DEFAULT_PROFILE = 'original'
+
+
+def get_profile(spec: Union[str, Dict, OutputProfile, None]) -> OutputProfile:
+    """
+    Получить профиль по имени или описанию из конфигурации шаблона
+
+    Описание - имя встроенного профиля или объект вида
+    {"profile": "webp", "quality": 70, "target_kb": 300, "compress_level": 9, "colors": 4}
+
+    Raises:
+        ValueError: неизвестный профиль или некорректные параметры
+    """
+    if spec is None:
+        return BUILTIN_PROFILES[DEFAULT_PROFILE]
+    if isinstance(spec, OutputProfile):
+        return spec
+    if isinstance(spec, str):
+        if spec not in BUILTIN_PROFILES:
+            raise ValueError(f"неизвестный профиль вывода: {spec}")
+        return BUILTIN_PROFILES[spec]
+    if not isinstance(spec, dict):
+        raise ValueError("профиль вывода должен быть строкой или объектом")
+
+    profile = get_profile(spec.get('profile', DEFAULT_PROFILE))
+    options = dict(profile.options)
+    try:
+        if 'quality' in spec:
+            options['quality'] = int(spec['quality'])
+        if 'compress_level' in spec:
+            options['compress_level'] = int(spec['compress_level'])
+            options.pop('optimize', None)
+        if 'resolution' in spec:
+            options['resolution'] = float(spec['resolution'])
+        palette_colors = int(spec['colors']) if 'colors' in spec else profile.palette_colors
+        target_bytes = int(float(spec['target_kb']) * 1024) if 'target_kb' in spec else profile.target_bytes
+    except (TypeError, ValueError):
+        raise ValueError(f"некорректные параметры профиля вывода: {spec}")
+    if palette_colors is not None and not 2 <= palette_colors <= 256:
+        raise ValueError(f"количество цветов палитры должно быть от 2 до 256: {palette_colors}")
+    return replace(profile, options=options, palette_colors=palette_colors, target_bytes=target_bytes)
+
+
+def _prepare(image: Image.Image, image_format: str, palette_colors: Optional[int]) -> Image.Image:
+    """Привести изображение к режиму, который поддерживает формат"""
+    if palette_colors:
+        if image.mode not in ('RGB', 'L'):
+            image = _flatten(image)
+        return image.quantize(colors=palette_colors, method=Image.Quantize.FASTOCTREE)
+    if image_format in ('JPEG', 'PDF') and image.mode not in ('RGB', 'L', 'CMYK'):
+        return _flatten(image)
+    if image_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """Перевести изображение в RGB, подложив белый фон под прозрачные области"""
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def _save(images: List[Image.Image], image_format: str, options: Dict) -> bytes:
+    buffer = io.BytesIO()
+    if len(images) > 1:
+        images[0].save(buffer, format=image_format, save_all=True, append_images=images[1:], **options)
+    else:
+        images[0].save(buffer, format=image_format, **options)
+    return buffer.getvalue()
+
+
+def encode_images(images: List[Image.Image], profile: OutputProfile, template_format: str = 'PNG') -> bytes:
+    """
+    Закодировать одно или несколько изображений по профилю
+
+    Несколько изображений сохраняются в один файл (многостраничный PDF);
+    для остальных форматов используется только первое.
+    """
+    image_format = profile.format or template_format
+    if image_format != 'PDF':
+        images = images[:1]
+    images = [_prepare(image, image_format, profile.palette_colors) for image in images]
+    options = dict(profile.options)
+
+    if profile.target_bytes and image_format in ('JPEG', 'WEBP'):
+        return _encode_to_target(images, image_format, options, profile.target_bytes)
+    return _save(images, image_format, options)
+
+
+def encode_image(image: Image.Image, profile: OutputProfile, template_format: str = 'PNG') -> bytes:
+    """Закодировать изображение по профилю"""
+    return encode_images([image], profile, template_format)
+
+
+def _encode_to_target(images: List[Image.Image], image_format: str, options: Dict, target_bytes: int) -> bytes:
+    """Подобрать двоичным поиском максимальное качество, при котором файл не больше target_bytes"""
+    high = options.get('quality', 90)
+    content = _save(images, image_format, options)
+    if len(content) <= target_bytes:
+        return content
+
+    low = MIN_TARGET_QUALITY
+    best = None
+    high -= 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = _save(images, image_format, {**options, 'quality': quality})
+        if len(candidate) <= target_bytes:
+            best = candidate
+            low = quality + 1
+        else:
+            high = quality - 1
+            if best is None:
+                content = candidate
+
+    if best is None:
+        logger.warning(f"Не удалось уложиться в {target_bytes} байт даже при quality={MIN_TARGET_QUALITY}")
+        return content
+    return best
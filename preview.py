@@ -0,0 +1,128 @@
+from PIL import Image
+from collections import OrderedDict
+import os
+import threading
+from typing import Callable, Dict, Tuple
+import logging
+
+from template_cache import image_nbytes
+
+logger = logging.getLogger(__name__)
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+class _PreviewEntry:
+    __slots__ = ('image', 'original_size', 'mtime_ns', 'file_size', 'nbytes')
+
+    def __init__(self, image: Image.Image, original_size: Tuple[int, int], mtime_ns: int, file_size: int):
+        self.image = image
+        self.original_size = original_size
+        self.mtime_ns = mtime_ns
+        self.file_size = file_size
+        self.nbytes = image_nbytes(image)
+
+
+class PreviewCache:
+    """
+    Уменьшенные копии шаблонов для черновиков
+
+    JPEG декодируется сразу в уменьшенном виде (draft: декодер пропускает
+    коэффициенты DCT и отдает изображение в 2, 4 или 8 раз меньше), поэтому
+    полноразмерный шаблон для черновика не нужен. Для остальных форматов
+    шаблон уменьшается вдвое (Image.reduce), пока длинная сторона больше
+    2 * max_side, и хранится только этот уровень пирамиды: черновик из него
+    получается одним дешевым масштабированием. Черновики всегда в RGB.
+    """
+
+    def __init__(self, max_side: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_side: длинная сторона черновика, пикселей
+            max_bytes: бюджет памяти кэша
+        """
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _PreviewEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template_path: str, load_base: Callable[[str], Image.Image]) -> Tuple[Image.Image, float]:
+        """
+        Получить основу черновика (новое изображение, его можно изменять)
+
+        Args:
+            load_base: функция, возвращающая полноразмерный шаблон (для форматов без draft)
+
+        Returns:
+            (изображение, масштаб относительно шаблона)
+
+        Raises:
+            FileNotFoundError: файл шаблона не найден
+        """
+        stat = os.stat(template_path)
+        with self._lock:
+            entry = self._entries.get(template_path)
+            if entry is not None and (entry.mtime_ns, entry.file_size) != (stat.st_mtime_ns, stat.st_size):
+                self._remove(template_path)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(template_path)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is None:
+            entry = self._build(template_path, load_base, stat)
+            if entry.nbytes <= self.max_bytes:
+                with self._lock:
+                    self._remove(template_path)
+                    self._entries[template_path] = entry
+                    self.current_bytes += entry.nbytes
+                    while self.current_bytes > self.max_bytes:
+                        self._remove(next(iter(self._entries)))
+
+        level = entry.image
+        scale = min(1.0, self.max_side / max(entry.original_size))
+        size = (max(1, round(entry.original_size[0] * scale)), max(1, round(entry.original_size[1] * scale)))
+        image = level.resize(size, Image.Resampling.BILINEAR) if level.size != size else level.copy()
+        return image, size[0] / entry.original_size[0]
+
+    def _build(self, template_path: str, load_base: Callable[[str], Image.Image], stat: os.stat_result) -> _PreviewEntry:
+        if template_path.lower().endswith(JPEG_EXTENSIONS):
+            image = Image.open(template_path)
+            original_size = image.size
+            scale = min(1.0, self.max_side / max(original_size))
+            image.draft('RGB', (round(original_size[0] * scale), round(original_size[1] * scale)))
+            image.load()
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            return _PreviewEntry(image, original_size, stat.st_mtime_ns, stat.st_size)
+
+        base = load_base(template_path)
+        original_size = base.size
+        # Кэшированный шаблон изменять нельзя: convert и reduce возвращают новые изображения
+        level = base.convert('RGB') if base.mode != 'RGB' else base
+        while max(level.size) > 2 * self.max_side:
+            level = level.reduce(2)
+        if level is base:
+            level = base.copy()
+        return _PreviewEntry(level, original_size, stat.st_mtime_ns, stat.st_size)
+
+    def _remove(self, template_path: str):
+        entry = self._entries.pop(template_path, None)
+        if entry is not None:
+            self.current_bytes -= entry.nbytes
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
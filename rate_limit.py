@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+from typing import Dict, Hashable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов каждого пользователя (token bucket)
+
+    У пользователя есть запас из burst запросов, который пополняется со
+    скоростью rate запросов в секунду. Корзины хранятся только для недавно
+    активных пользователей: первыми вытесняются давно не обращавшиеся, чьи
+    корзины к этому времени уже полны и ничем не отличаются от новых.
+    """
+
+    def __init__(self, per_minute: float = 10, burst: int = 5, max_users: int = 10000):
+        """
+        Args:
+            per_minute: сколько запросов в минуту восполняется (0 - без ограничения)
+            burst: сколько запросов можно сделать подряд
+            max_users: сколько корзин хранить
+        """
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.max_users = max_users
+        self.limited = 0
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        return cls(
+            per_minute=float(os.getenv("RATE_LIMIT_PER_MINUTE", "10")),
+            burst=int(os.getenv("RATE_LIMIT_BURST", "5")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, user_id: Hashable, cost: float = 1.0) -> Optional[float]:
+        """
+        Списать cost запросов из корзины пользователя
+
+        Returns:
+            None, если запрос разрешен, иначе сколько секунд подождать до повтора
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        cost = min(cost, self.burst)
+        with self._lock:
+            tokens, updated = self._buckets.pop(user_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                retry_after = None
+            else:
+                retry_after = (cost - tokens) / self.rate
+                self.limited += 1
+            self._buckets[user_id] = (tokens, now)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def stats(self) -> Dict:
+        return {
+            'users': len(self._buckets),
+            'limited': self.limited,
+            'per_minute': self.rate * 60,
+            'burst': self.burst,
+        }
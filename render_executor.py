@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """Очередь рендеринга переполнена"""
+
+
+class RenderExecutor:
+    """
+    Пул воркеров для рендеринга документов вне event loop
+
+    Когда все воркеры заняты, задачи ждут в очередях своих владельцев
+    (пользователей), а освободившийся воркер достается очередям по кругу:
+    пакет из сотни документов одного пользователя не задерживает одиночный
+    документ другого больше чем на одну задачу. Задачи с приоритетом
+    (администратор) обслуживаются раньше остальных.
+    """
+
+    def __init__(self, workers: Optional[int] = None, mode: str = "thread", max_queue: int = 50):
+        """
+        Args:
+            workers: количество воркеров (по умолчанию - число ядер)
+            mode: тип пула - 'thread' или 'process'
+            max_queue: сколько задач может ждать свободного воркера
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Неизвестный тип пула рендеринга: {mode}")
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._free = self.workers
+        # Очереди ожидания по владельцам: приоритетная и обычная
+        self._lanes: Dict[bool, "OrderedDict[Hashable, Deque[asyncio.Future]]"] = {
+            True: OrderedDict(), False: OrderedDict()
+        }
+        self._waiting = 0
+        self._running = 0
+
+    @classmethod
+    def from_env(cls) -> "RenderExecutor":
+        """Создать пул по переменным окружения RENDER_WORKERS, RENDER_POOL, RENDER_QUEUE_SIZE"""
+        workers = int(os.getenv("RENDER_WORKERS", "0") or 0) or None
+        mode = os.getenv("RENDER_POOL", "thread").strip().lower()
+        max_queue = int(os.getenv("RENDER_QUEUE_SIZE", "50") or 50)
+        return cls(workers=workers, mode=mode, max_queue=max_queue)
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество задач, ожидающих свободного воркера"""
+        return self._waiting
+
+    @property
+    def active(self) -> int:
+        """Количество задач, выполняющихся прямо сейчас"""
+        return self._running
+
+    @property
+    def waiting_owners(self) -> int:
+        """Количество владельцев, у которых есть задачи в очереди"""
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def _position(self, owner: Hashable, priority: bool) -> int:
+        """Оценка позиции последней задачи владельца при обслуживании очередей по кругу"""
+        lane = self._lanes[priority]
+        own = len(lane[owner])
+        ahead = sum(len(queue) for queue in self._lanes[True].values()) if not priority else 0
+        ahead += sum(min(len(queue), own) for key, queue in lane.items() if key != owner)
+        return ahead + own
+
+    async def _acquire(self, owner: Hashable, priority: bool,
+                       on_queued: Optional[Callable[[int], Awaitable[Any]]]):
+        if self._free > 0 and not self._waiting:
+            self._free -= 1
+            return
+        if self._waiting >= self.max_queue:
+            raise RenderQueueFull(f"В очереди уже {self._waiting} задач")
+
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes[priority]
+        lane.setdefault(owner, deque()).append(future)
+        self._waiting += 1
+        try:
+            if on_queued:
+                try:
+                    await on_queued(self._position(owner, priority))
+                except Exception as e:
+                    # Уведомление о позиции необязательно: задача остается в очереди
+                    logger.warning(f"Не удалось сообщить позицию в очереди рендеринга: {e}")
+            await future
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Воркер уже был передан этой задаче - возвращаем его следующей
+                self._release()
+            else:
+                future.cancel()
+                queue = lane.get(owner)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    self._waiting -= 1
+                    if not queue:
+                        del lane[owner]
+            raise
+
+    def _release(self):
+        """Передать освободившийся воркер следующей задаче (по кругу между владельцами)"""
+        for priority in (True, False):
+            lane = self._lanes[priority]
+            while lane:
+                owner, queue = next(iter(lane.items()))
+                future = queue.popleft()
+                self._waiting -= 1
+                if queue:
+                    lane.move_to_end(owner)
+                else:
+                    del lane[owner]
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self._free += 1
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.mode == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render")
+            logger.info(f"Пул рендеринга запущен: {self.mode}, воркеров: {self.workers}, очередь: {self.max_queue}")
+        return self._executor
+
+    async def submit(self, func: Callable[..., Any], *args,
+                     on_queued: Optional[Callable[[int], Awaitable[Any]]] = None,
+                     owner: Hashable = None, priority: bool = False,
+                     stage: Optional[str] = None, template: Optional[str] = None) -> Any:
+        """
+        Выполнить func(*args) в пуле, не блокируя event loop
+
+        Если все воркеры заняты, задача встает в очередь владельца, а on_queued
+        вызывается с ее примерной позицией. При переполненной очереди
+        выбрасывается RenderQueueFull.
+
+        Args:
+            owner: владелец задачи (id пользователя); задачи без владельца делят одну очередь
+            priority: обслуживать раньше задач без приоритета
+            stage: этап метрик, в который записывается время выполнения (без ожидания в очереди)
+            template: шаблон для метрики этапа
+        """
+        started = time.perf_counter()
+        await self._acquire(owner, priority, on_queued)
+        METRICS.observe("queue_wait", None, time.perf_counter() - started)
+
+        self._running += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            if stage:
+                METRICS.observe(stage, template, time.perf_counter() - started)
+            self._running -= 1
+            self._release()
+
+    def shutdown(self, wait: bool = True):
+        """Остановить пул воркеров"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,314 @@
+from PIL import Image
+import asyncio
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from output_profiles import IMAGE_FORMATS, OutputProfile, encode_image, get_profile
+from state_storage import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+# Имя файла, которое бот дает готовым документам: filled_<дата>_<время>_<мкс>_<user_id>_<шаблон>.<ext>
+_FILENAME_RE = re.compile(r"^filled_\d{8}_\d{6}(?:_\d+)?_(\d+)_(.+)\.\w+$")
+
+DOCUMENT_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.pdf')
+
+
+class RetentionManager:
+    """
+    Хранилище готовых документов с правилами хранения
+
+    Документы раскладываются по каталогам <root>/ГГГГ/ММ/ДД, а каждый файл
+    учитывается в манифесте SQLite. Количество и объем файлов хранятся в памяти
+    и обновляются при записи и удалении, поэтому /stats не обходит каталог.
+    Очистка по возрасту, общему объему и количеству файлов пользователя
+    выполняется фоновой задачей порциями по batch_size файлов, каждая порция -
+    в потоке вне event loop.
+    """
+
+    def __init__(self, root: str, manifest_path: str, max_age_days: float = 0, max_total_bytes: int = 0,
+                 max_per_user: int = 0, batch_size: int = 500, archive_after_days: float = 0,
+                 archive_profile: Optional[OutputProfile] = None):
+        """
+        Args:
+            root: каталог готовых документов
+            manifest_path: файл SQLite с манифестом
+            max_age_days: удалять документы старше (0 - не ограничено)
+            max_total_bytes: общий объем документов (0 - не ограничен), удаляются самые старые
+            max_per_user: документов на пользователя (0 - не ограничено), удаляются самые старые
+            batch_size: сколько файлов обрабатывать за одну порцию
+            archive_after_days: перекодировать документы старше (0 - не перекодировать)
+            archive_profile: профиль перекодирования (файл заменяется, только если стал меньше)
+        """
+        self.root = root
+        self.max_age_days = max_age_days
+        self.max_total_bytes = max_total_bytes
+        self.max_per_user = max_per_user
+        self.batch_size = max(1, batch_size)
+        self.archive_after_days = archive_after_days
+        self.archive_profile = archive_profile
+        self.count = 0
+        self.total_bytes = 0
+        self.deleted = 0
+        self.archived = 0
+        self.last_sweep: Optional[float] = None
+        self._lock = threading.Lock()
+
+        self.db = SQLiteDatabase(manifest_path)
+        self.db._execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "path TEXT PRIMARY KEY, user_id INTEGER, template TEXT, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, archived INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db._execute("CREATE INDEX IF NOT EXISTS documents_created ON documents (created_at)")
+        self.db._execute("CREATE INDEX IF NOT EXISTS documents_user ON documents (user_id, created_at)")
+        self.db._execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.count, self.total_bytes = self.db._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents")[0]
+
+    @classmethod
+    def from_env(cls, root: Optional[str] = None) -> "RetentionManager":
+        """Менеджер по переменным окружения; каталог документов - root или OUTPUT_DIR"""
+        archive_profile = os.getenv("RETENTION_ARCHIVE_PROFILE", "webp").strip()
+        return cls(
+            root or os.getenv("OUTPUT_DIR", "filled_documents"),
+            manifest_path=os.getenv("RETENTION_MANIFEST_PATH", "data/filled_documents.db"),
+            max_age_days=float(os.getenv("RETENTION_MAX_AGE_DAYS", "0")),
+            max_total_bytes=int(float(os.getenv("RETENTION_MAX_TOTAL_MB", "0")) * 1024 * 1024),
+            max_per_user=int(os.getenv("RETENTION_MAX_PER_USER", "0")),
+            batch_size=int(os.getenv("RETENTION_SWEEP_BATCH", "500")),
+            archive_after_days=float(os.getenv("RETENTION_ARCHIVE_AFTER_DAYS", "0")),
+            archive_profile=get_profile(archive_profile) if archive_profile else None,
+        )
+
+    def output_path(self, filename: str, when: Optional[datetime] = None) -> str:
+        """Путь нового документа в каталоге его даты"""
+        when = when or datetime.now()
+        return os.path.join(self.root, when.strftime("%Y"), when.strftime("%m"), when.strftime("%d"), filename)
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    async def record(self, path: str, user_id: Optional[int], template: Optional[str], size: int):
+        """Учесть записанный документ в манифесте (повторная запись того же пути заменяет прежнюю)"""
+        await asyncio.to_thread(self._record, self._relative(path), user_id, template, size)
+
+    def _record(self, path: str, user_id: Optional[int], template: Optional[str], size: int):
+        # Под одной блокировкой: иначе два учета одного пути оба сочли бы его новым
+        with self._lock:
+            previous = self.db._execute("SELECT size FROM documents WHERE path = ?", (path,))
+            self.db._execute(
+                "INSERT OR REPLACE INTO documents (path, user_id, template, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (path, user_id, template, size, time.time())
+            )
+            if previous:
+                self.total_bytes += size - previous[0][0]
+            else:
+                self.count += 1
+                self.total_bytes += size
+
+    def import_existing(self) -> int:
+        """
+        Однократно перенести в манифест файлы, сохраненные до его появления
+
+        Файлы из корня каталога переносятся в каталоги по дате изменения.
+
+        Returns:
+            количество учтенных файлов
+        """
+        if self.db._execute("SELECT 1 FROM meta WHERE key = 'imported'"):
+            return 0
+        known = {row[0] for row in self.db._execute("SELECT path FROM documents")}
+        imported = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.lower().endswith(DOCUMENT_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                if self._relative(path) in known:
+                    continue
+                stat = os.stat(path)
+                if directory == self.root:
+                    target = self.output_path(name, datetime.fromtimestamp(stat.st_mtime))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(path, target)
+                    path = target
+                match = _FILENAME_RE.match(name)
+                self.db._execute(
+                    "INSERT OR REPLACE INTO documents (path, user_id, template, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (self._relative(path), int(match.group(1)) if match else None,
+                     match.group(2) if match else None, stat.st_size, stat.st_mtime)
+                )
+                imported += 1
+        self.db._execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (str(time.time()),))
+        if imported:
+            with self._lock:
+                self.count, self.total_bytes = self.db._execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents"
+                )[0]
+        return imported
+
+    def _expired_batch(self) -> List[Tuple[str, int]]:
+        """Следующая порция документов, которые нарушают правила хранения"""
+        limit = self.batch_size
+        if self.max_age_days:
+            rows = self.db._execute(
+                "SELECT path, size FROM documents WHERE created_at < ? ORDER BY created_at LIMIT ?",
+                (time.time() - self.max_age_days * DAY, limit)
+            )
+            if rows:
+                return rows
+        if self.max_per_user:
+            rows = []
+            for user_id, count in self.db._execute(
+                "SELECT user_id, COUNT(*) FROM documents WHERE user_id IS NOT NULL "
+                "GROUP BY user_id HAVING COUNT(*) > ?", (self.max_per_user,)
+            ):
+                rows += self.db._execute(
+                    "SELECT path, size FROM documents WHERE user_id = ? ORDER BY created_at LIMIT ?",
+                    (user_id, min(count - self.max_per_user, limit - len(rows)))
+                )
+                if len(rows) >= limit:
+                    break
+            if rows:
+                return rows
+        if self.max_total_bytes and self.total_bytes > self.max_total_bytes:
+            excess = self.total_bytes - self.max_total_bytes
+            rows = []
+            for path, size in self.db._execute(
+                "SELECT path, size FROM documents ORDER BY created_at LIMIT ?", (limit,)
+            ):
+                rows.append((path, size))
+                excess -= size
+                if excess <= 0:
+                    break
+            return rows
+        return []
+
+    def _delete(self, rows: List[Tuple[str, int]]):
+        directories = set()
+        for path, _ in rows:
+            full_path = os.path.join(self.root, path)
+            try:
+                os.remove(full_path)
+            except FileNotFoundError:
+                pass
+            directories.add(os.path.dirname(full_path))
+        paths = [path for path, _ in rows]
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            self.db._execute(f"DELETE FROM documents WHERE path IN ({', '.join('?' * len(chunk))})", tuple(chunk))
+        with self._lock:
+            self.count -= len(rows)
+            self.total_bytes -= sum(size for _, size in rows)
+            self.deleted += len(rows)
+        # Пустые каталоги дат удаляются вместе с последним файлом
+        for directory in sorted(directories, reverse=True):
+            while os.path.normpath(directory) != os.path.normpath(self.root):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
+
+    def _sweep_batch(self) -> int:
+        """Удалить одну порцию документов; возвращает количество удаленных"""
+        rows = self._expired_batch()
+        if rows:
+            self._delete(rows)
+        return len(rows)
+
+    def _archive_batch(self) -> int:
+        """Перекодировать одну порцию старых документов профилем archive_profile"""
+        rows = self.db._execute(
+            "SELECT path, size FROM documents WHERE archived = 0 AND created_at < ? ORDER BY created_at LIMIT ?",
+            (time.time() - self.archive_after_days * DAY, self.batch_size)
+        )
+        for path, size in rows:
+            full_path = os.path.join(self.root, path)
+            stem, ext = os.path.splitext(path)
+            new_path, new_size = path, size
+            try:
+                if ext.lower() in IMAGE_FORMATS:
+                    with Image.open(full_path) as image:
+                        content = encode_image(image, self.archive_profile, IMAGE_FORMATS[ext.lower()])
+                    if len(content) < size:
+                        new_path = stem + self.archive_profile.extension(ext)
+                        new_full_path = os.path.join(self.root, new_path)
+                        tmp_path = f"{new_full_path}.tmp"
+                        with open(tmp_path, 'wb') as f:
+                            f.write(content)
+                        os.replace(tmp_path, new_full_path)
+                        if new_full_path != full_path:
+                            os.remove(full_path)
+                        new_size = len(content)
+            except FileNotFoundError:
+                self._delete([(path, size)])
+                continue
+            except Exception as e:
+                logger.warning(f"Не удалось перекодировать {path}: {e}")
+            self.db._execute(
+                "UPDATE documents SET path = ?, size = ?, archived = 1 WHERE path = ?", (new_path, new_size, path)
+            )
+            with self._lock:
+                self.total_bytes += new_size - size
+                self.archived += 1
+        return len(rows)
+
+    async def sweep(self) -> int:
+        """
+        Применить правила хранения порциями, пока есть что удалять
+
+        Между порциями event loop свободен, а манифест не заблокирован надолго.
+
+        Returns:
+            количество удаленных документов
+        """
+        deleted = 0
+        # Порция берется по первому нарушенному правилу, поэтому неполная порция
+        # не значит, что удалять больше нечего: очистка идет до пустой порции
+        while True:
+            removed = await asyncio.to_thread(self._sweep_batch)
+            if not removed:
+                break
+            deleted += removed
+        if self.archive_after_days and self.archive_profile:
+            while await asyncio.to_thread(self._archive_batch) == self.batch_size:
+                pass
+        self.last_sweep = time.time()
+        if deleted:
+            logger.info(f"Очистка готовых документов: удалено {deleted}, осталось {self.count}")
+        return deleted
+
+    async def run_periodically(self, interval: float):
+        """Фоновая задача: при первом запуске перенести старые файлы в манифест, затем очищать по расписанию"""
+        try:
+            imported = await asyncio.to_thread(self.import_existing)
+            if imported:
+                logger.info(f"В манифест готовых документов перенесено {imported} файлов")
+        except Exception as e:
+            logger.error(f"Ошибка переноса готовых документов в манифест: {e}")
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка очистки готовых документов: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict:
+        return {
+            'count': self.count,
+            'bytes': self.total_bytes,
+            'deleted': self.deleted,
+            'archived': self.archived,
+            'last_sweep': self.last_sweep,
+        }
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,309 @@
+from PIL import Image
+import base64
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Optional, Tuple
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: процессы могут одновременно собрать один файл, результат тот же
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TPLRAW1\0"
+# Пиксели начинаются с границы страницы, чтобы отображение файла было выровнено
+PAGE = mmap.ALLOCATIONGRANULARITY
+
+# Режимы, которые Image.frombuffer отображает без копирования
+_MAPPABLE = ('L', 'P', 'I;16', 'RGBA', 'RGBX', 'CMYK')
+
+
+def template_version(stat: os.stat_result) -> str:
+    """Версия шаблона: меняется вместе с mtime или размером файла"""
+    return hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+
+
+def _storage_mode(mode: str) -> Optional[str]:
+    """Режим, в котором пиксели хранятся в файле (None - шаблон в этом режиме не отображается)"""
+    if mode in _MAPPABLE:
+        return mode
+    if mode == 'RGB':
+        # Pillow хранит RGB по 4 байта на пиксель, как RGBX
+        return 'RGBX'
+    return None
+
+
+def _encode_info(info: Dict) -> Dict:
+    """Метаданные шаблона, которые нужны при кодировании результата"""
+    encoded = {}
+    for key in ('dpi', 'transparency', 'gamma', 'icc_profile'):
+        value = info.get(key)
+        if isinstance(value, bytes):
+            encoded[key] = {'b64': base64.b64encode(value).decode('ascii')}
+        elif isinstance(value, (int, float, tuple, list)):
+            encoded[key] = list(value) if isinstance(value, tuple) else value
+    return encoded
+
+
+def _decode_info(encoded: Dict) -> Dict:
+    info = {}
+    for key, value in encoded.items():
+        if isinstance(value, dict):
+            info[key] = base64.b64decode(value['b64'])
+        elif isinstance(value, list):
+            info[key] = tuple(value)
+        else:
+            info[key] = value
+    return info
+
+
+def _map_image(storage_mode: str, size: Tuple[int, int], buffer: memoryview) -> Image.Image:
+    """
+    Изображение поверх буфера без копирования пикселей (только для чтения)
+
+    RGB-шаблоны отображаются в режиме RGBX: frombuffer отображает без копирования
+    только его, а раскладка в памяти у них одинаковая. Копия для заполнения
+    переводится в RGB (TemplateCache.get).
+    """
+    return Image.frombuffer(storage_mode, size, buffer, 'raw', storage_mode, 0, 1)
+
+
+class _Mapping:
+    __slots__ = ('version', 'image', 'mmap')
+
+    def __init__(self, version: str, image: Image.Image, mapped: mmap.mmap):
+        self.version = version
+        self.image = image
+        self.mmap = mapped
+
+
+class SharedTemplateStore:
+    """
+    Декодированные шаблоны, общие для всех процессов пула рендеринга
+
+    Каждый шаблон декодируется один раз в файл с сырыми пикселями: небольшой
+    заголовок (режим, размер, версия исходного файла, палитра и метаданные) и
+    пиксели с границы страницы. Процессы отображают файл через mmap только
+    для чтения и создают изображение поверх него через Image.frombuffer, без
+    копирования, поэтому все воркеры пользуются одной копией шаблона в
+    страничном кэше ОС. Для настоящей общей памяти каталог можно разместить
+    в tmpfs (/dev/shm).
+
+    Файл пересобирается атомарно (временный файл и os.replace), когда
+    изменился исходный шаблон; процессы, отобразившие старую версию,
+    продолжают работать с ней до следующего обращения.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: каталог файлов с сырыми пикселями
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self._mappings: Dict[str, _Mapping] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["SharedTemplateStore"]:
+        """
+        Хранилище по TEMPLATE_SHARED_STORE (auto, on, off) и TEMPLATE_SHARED_DIR
+
+        В режиме auto хранилище используется только с пулом процессов.
+        """
+        enabled = os.getenv("TEMPLATE_SHARED_STORE", "auto").strip().lower()
+        if enabled == "auto":
+            enabled = "on" if os.getenv("RENDER_POOL", "thread").strip().lower() == "process" else "off"
+        if enabled in ("0", "off", "false", "no"):
+            return None
+        return cls(os.getenv("TEMPLATE_SHARED_DIR", "data/template_raw"))
+
+    def raw_path(self, template_path: str) -> str:
+        name = hashlib.sha1(os.path.abspath(template_path).encode()).hexdigest()[:20]
+        return os.path.join(self.directory, f"{name}.raw")
+
+    def get(self, template_path: str, stat: Optional[os.stat_result] = None) -> Image.Image:
+        """
+        Получить шаблон, отображенный из общего файла (изменять его нельзя)
+
+        RGB-шаблон возвращается в режиме RGBX. Если шаблон нельзя отобразить
+        (например, двухцветный или с плавающей точкой), возвращается обычное
+        декодированное изображение.
+
+        Raises:
+            FileNotFoundError: файл шаблона не найден
+        """
+        stat = stat or os.stat(template_path)
+        version = template_version(stat)
+        with self._lock:
+            mapping = self._mappings.get(template_path)
+            if mapping is not None and mapping.version == version:
+                self.hits += 1
+                return mapping.image
+            self.misses += 1
+
+        raw_path = self.raw_path(template_path)
+        mapping = self._open(raw_path, version)
+        if mapping is None:
+            # Шаблон декодирует один процесс, остальные ждут и отображают готовый файл
+            with self._build_lock(raw_path):
+                mapping = self._open(raw_path, version)
+                if mapping is None:
+                    image = self._build(template_path, raw_path, version)
+                    if image is not None:
+                        return image
+                    mapping = self._open(raw_path, version)
+            if mapping is None:
+                # Файл успел пересобрать другой процесс для более новой версии шаблона
+                image = Image.open(template_path)
+                image.load()
+                return image
+
+        with self._lock:
+            # Старое отображение закроется вместе с последним изображением, которое на него ссылается
+            self._mappings[template_path] = mapping
+        return mapping.image
+
+    @contextlib.contextmanager
+    def _build_lock(self, raw_path: str):
+        if fcntl is None:
+            yield
+            return
+        with open(f"{raw_path}.lock", 'wb') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _open(self, raw_path: str, version: str) -> Optional[_Mapping]:
+        """Отобразить файл с сырыми пикселями, если он есть и соответствует версии шаблона"""
+        try:
+            file = open(raw_path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            with file:
+                magic, header_size = struct.unpack('<8sI', file.read(12))
+                if magic != MAGIC:
+                    raise ValueError("неизвестный формат файла")
+                header = json.loads(file.read(header_size))
+                if header['version'] != version:
+                    return None
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            size = tuple(header['size'])
+            offset = header['offset']
+            buffer = memoryview(mapped)[offset:offset + header['nbytes']]
+            image = _map_image(header['storage_mode'], size, buffer)
+            if header.get('palette') is not None:
+                image.putpalette(bytes.fromhex(header['palette']), header.get('palette_mode', 'RGB'))
+            image.info.update(_decode_info(header.get('info', {})))
+            return _Mapping(version, image, mapped)
+        except Exception as e:
+            logger.warning(f"Файл {raw_path} поврежден и будет пересобран: {e}")
+            return None
+
+    def _build(self, template_path: str, raw_path: str, version: str) -> Optional[Image.Image]:
+        """
+        Декодировать шаблон и записать его пиксели в общий файл
+
+        Returns:
+            None, если файл записан, иначе декодированный шаблон (режим не отображается)
+        """
+        image = Image.open(template_path)
+        image.load()
+        storage_mode = _storage_mode(image.mode)
+        if storage_mode is None:
+            logger.debug(f"Шаблон {template_path} в режиме {image.mode} не помещается в общее хранилище")
+            return image
+
+        pixels = image.tobytes('raw', storage_mode)
+        header = {
+            'version': version,
+            'mode': image.mode,
+            'storage_mode': storage_mode,
+            'size': list(image.size),
+            'nbytes': len(pixels),
+            'palette': None,
+            'info': _encode_info(image.info),
+        }
+        if image.mode == 'P':
+            header['palette'] = image.palette.tobytes().hex()
+            header['palette_mode'] = image.palette.mode
+        encoded = json.dumps(header).encode()
+        # Смещение пикселей зависит от длины заголовка, а заголовок содержит смещение
+        offset = -(-(12 + len(encoded) + 32) // PAGE) * PAGE
+        header['offset'] = offset
+        encoded = json.dumps(header).encode()
+
+        tmp_path = f"{raw_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(struct.pack('<8sI', MAGIC, len(encoded)))
+                f.write(encoded)
+                f.seek(offset)
+                f.write(pixels)
+            os.replace(tmp_path, raw_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.builds += 1
+        logger.info(f"Шаблон {template_path} записан в общее хранилище ({len(pixels) // 1048576} МБ)")
+        return None
+
+    def invalidate(self, template_path: Optional[str] = None):
+        """Забыть отображения в этом процессе (файлы остаются для других процессов)"""
+        with self._lock:
+            if template_path is None:
+                self._mappings.clear()
+            else:
+                self._mappings.pop(template_path, None)
+
+    def prune(self, template_paths) -> int:
+        """
+        Удалить файлы шаблонов, которых больше нет
+
+        Args:
+            template_paths: пути всех существующих шаблонов
+
+        Returns:
+            количество удаленных файлов
+        """
+        keep = {os.path.basename(self.raw_path(path)) for path in template_paths}
+        removed = 0
+        for name in os.listdir(self.directory):
+            raw_name = name[:-len('.lock')] if name.endswith('.lock') else name
+            if raw_name.endswith('.raw') and raw_name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    removed += name == raw_name
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        with self._lock:
+            mapped_bytes = sum(len(mapping.mmap) for mapping in self._mappings.values())
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'builds': self.builds,
+            'entries': len(self._mappings),
+            'mapped_bytes': mapped_bytes,
+        }
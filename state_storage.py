@@ -0,0 +1,255 @@
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """Хранилище авторизованных сессий пользователей с ограниченным сроком жизни"""
+
+    def __init__(self, ttl: float):
+        """
+        Args:
+            ttl: время жизни сессии в секундах (0 - бессрочно)
+        """
+        self.ttl = ttl
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl else float('inf')
+
+    @abstractmethod
+    async def add(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def discard(self, user_id: int):
+        ...
+
+    @abstractmethod
+    async def contains(self, user_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    async def count(self) -> int:
+        ...
+
+    async def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """Сессии в памяти процесса (теряются при перезапуске)"""
+
+    def __init__(self, ttl: float):
+        super().__init__(ttl)
+        self._sessions: Dict[int, float] = {}
+
+    async def add(self, user_id: int):
+        self._sessions[user_id] = self._expires_at()
+
+    async def discard(self, user_id: int):
+        self._sessions.pop(user_id, None)
+
+    async def contains(self, user_id: int) -> bool:
+        expires_at = self._sessions.get(user_id)
+        if expires_at is None:
+            return False
+        if expires_at < time.time():
+            del self._sessions[user_id]
+            return False
+        return True
+
+    async def count(self) -> int:
+        now = time.time()
+        for user_id in [user_id for user_id, expires_at in self._sessions.items() if expires_at < now]:
+            del self._sessions[user_id]
+        return len(self._sessions)
+
+
+class SQLiteDatabase:
+    """Общее подключение к SQLite в режиме WAL; запросы выполняются вне event loop"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._lock = threading.Lock()
+
+    def _execute(self, sql: str, params: Tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def execute(self, sql: str, params: Tuple = ()) -> list:
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SQLiteSessionStore(SessionStore):
+    """Сессии в SQLite: переживают перезапуск и доступны нескольким процессам на одной машине"""
+
+    def __init__(self, db: SQLiteDatabase, ttl: float):
+        super().__init__(ttl)
+        self.db = db
+        self.db._execute(
+            "CREATE TABLE IF NOT EXISTS sessions (user_id INTEGER PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+
+    async def add(self, user_id: int):
+        await self.db.execute(
+            "INSERT OR REPLACE INTO sessions (user_id, expires_at) VALUES (?, ?)", (user_id, self._expires_at())
+        )
+
+    async def discard(self, user_id: int):
+        await self.db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    async def contains(self, user_id: int) -> bool:
+        rows = await self.db.execute(
+            "SELECT 1 FROM sessions WHERE user_id = ? AND expires_at >= ?", (user_id, time.time())
+        )
+        return bool(rows)
+
+    async def count(self) -> int:
+        await self.db.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+        rows = await self.db.execute("SELECT COUNT(*) FROM sessions")
+        return rows[0][0]
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Сессии в Redis-совместимом сервере (Redis, KeyDB, Valkey, локальная заглушка)
+
+    Сессии хранятся в sorted set, где score - время истечения.
+    """
+
+    def __init__(self, redis, ttl: float, key: str = "docbot:sessions"):
+        super().__init__(ttl)
+        self.redis = redis
+        self.key = key
+
+    async def add(self, user_id: int):
+        await self.redis.zadd(self.key, {str(user_id): self._expires_at()})
+
+    async def discard(self, user_id: int):
+        await self.redis.zrem(self.key, str(user_id))
+
+    async def contains(self, user_id: int) -> bool:
+        expires_at = await self.redis.zscore(self.key, str(user_id))
+        return expires_at is not None and float(expires_at) >= time.time()
+
+    async def count(self) -> int:
+        await self.redis.zremrangebyscore(self.key, '-inf', f"({time.time()}")
+        return await self.redis.zcard(self.key)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM aiogram в SQLite"""
+
+    def __init__(self, db: SQLiteDatabase, ttl: float = 0):
+        """
+        Args:
+            db: подключение к базе
+            ttl: через сколько секунд без изменений состояние диалога забывается (0 - никогда)
+        """
+        self.db = db
+        self.ttl = ttl
+        self.db._execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)"
+        )
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _fresh_after(self) -> float:
+        return time.time() - self.ttl if self.ttl else float('-inf')
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self.db.execute(
+            "INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (self._key(key), state, time.time())
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        rows = await self.db.execute(
+            "SELECT state FROM fsm WHERE key = ? AND updated_at >= ?", (self._key(key), self._fresh_after())
+        )
+        return rows[0][0] if rows else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.db.execute(
+            "INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (self._key(key), json.dumps(data, ensure_ascii=False), time.time())
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        rows = await self.db.execute(
+            "SELECT data FROM fsm WHERE key = ? AND updated_at >= ?", (self._key(key), self._fresh_after())
+        )
+        return json.loads(rows[0][0]) if rows else {}
+
+    async def close(self) -> None:
+        if self.ttl:
+            await self.db.execute("DELETE FROM fsm WHERE updated_at < ?", (self._fresh_after(),))
+        # Диспетчер закрывает хранилище при остановке, после обработки последних обновлений
+        self.db.close()
+
+
+def create_storage_from_env() -> Tuple[BaseStorage, SessionStore]:
+    """
+    Создать хранилища состояний FSM и сессий по переменной STORAGE_BACKEND
+
+    memory - в памяти процесса (как раньше), sqlite - файл STORAGE_PATH,
+    redis - Redis-совместимый сервер по адресу REDIS_URL.
+    """
+    backend = os.getenv("STORAGE_BACKEND", "memory").strip().lower()
+    session_ttl = float(os.getenv("SESSION_TTL_HOURS", "168")) * 3600
+    state_ttl = float(os.getenv("FSM_STATE_TTL_HOURS", "24")) * 3600
+
+    if backend == "memory":
+        return MemoryStorage(), MemorySessionStore(session_ttl)
+
+    if backend == "sqlite":
+        db = SQLiteDatabase(os.getenv("STORAGE_PATH", "data/bot_state.db"))
+        logger.info(f"Состояния и сессии хранятся в SQLite: {db.path}")
+        return SQLiteStorage(db, state_ttl), SQLiteSessionStore(db, session_ttl)
+
+    if backend == "redis":
+        try:
+            from redis.asyncio import Redis
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            raise RuntimeError("Для STORAGE_BACKEND=redis установите пакет redis")
+
+        redis = Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        logger.info("Состояния и сессии хранятся в Redis")
+        storage = RedisStorage(redis, state_ttl=int(state_ttl) or None, data_ttl=int(state_ttl) or None)
+        return storage, RedisSessionStore(redis, session_ttl)
+
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
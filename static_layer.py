@@ -0,0 +1,305 @@
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+from collections import OrderedDict
+import struct
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Режим изображения -> (тип цвета PNG, байт на пиксель) при глубине 8 бит
+# (RGBX - RGB-шаблоны из общего хранилища, заполняющий байт в PNG не попадает)
+PNG_COLOR_TYPES = {'L': (0, 1), 'RGB': (2, 3), 'RGBX': (2, 3), 'P': (3, 1), 'LA': (4, 2), 'RGBA': (6, 4)}
+
+# Заголовок zlib-потока; уровень сжатия в нем справочный и на декодирование не влияет
+ZLIB_HEADER = b"\x78\x9c"
+ADLER_BASE = 65521
+
+# Фильтры строк PNG
+FILTER_NONE, FILTER_SUB, FILTER_UP, FILTER_AVERAGE = 0, 1, 2, 3
+# Байт как число со знаком по модулю: 0 и 255 одинаково дешевы
+_SIGNED_ABS = [min(value, 256 - value) for value in range(256)]
+
+# Окно deflate: дальше этого расстояния ссылки назад невозможны
+DEFLATE_WINDOW = 32768
+
+# Поле текста расширяется на столько пикселей по вертикали (сглаживание, выносные элементы)
+TEXT_PADDING = 2
+
+_measure_draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+
+def adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """Adler-32 склеенных данных по контрольным суммам частей (как adler32_combine в zlib)"""
+    rem = len2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xffff) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + ADLER_BASE - rem
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum2 >= ADLER_BASE << 1:
+        sum2 -= ADLER_BASE << 1
+    if sum2 >= ADLER_BASE:
+        sum2 -= ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def band_encodable(image: Image.Image) -> bool:
+    """Можно ли собрать PNG этого изображения из полос (без tRNS, iCCP и экзотических режимов)"""
+    return image.mode in PNG_COLOR_TYPES and 'transparency' not in image.info and 'icc_profile' not in image.info
+
+
+def png_compress_level(profile, template_format: str) -> Optional[int]:
+    """Уровень сжатия zlib, если профиль - обычный PNG без квантования и подбора размера, иначе None"""
+    if (profile.format or template_format) != 'PNG' or profile.palette_colors or profile.target_bytes:
+        return None
+    if set(profile.options) - {'compress_level', 'optimize', 'quality'}:
+        return None
+    if profile.options.get('optimize'):
+        return 9
+    return int(profile.options.get('compress_level', 6))
+
+
+def palette_index(image: Image.Image, color: Tuple[int, ...]) -> Optional[int]:
+    """Индекс цвета в палитре изображения режима P (None - такого цвета в палитре нет)"""
+    palette = image.getpalette() or []
+    rgb = list(color[:3])
+    for index in range(len(palette) // 3):
+        if palette[index * 3:index * 3 + 3] == rgb:
+            return index
+    return None
+
+
+def text_rows(position: Tuple[int, int], text: str, font: ImageFont.ImageFont) -> Tuple[int, int]:
+    """Строки изображения [top, bottom), которые затронет текст"""
+    _, top, _, bottom = _measure_draw.textbbox(position, text, font=font)
+    return top - TEXT_PADDING, bottom + TEXT_PADDING
+
+
+def _shifted(image: Image.Image, dx: int, dy: int) -> Image.Image:
+    """Изображение, сдвинутое вправо и вниз; освободившиеся пиксели нулевые"""
+    shifted = Image.new(image.mode, image.size, 0)
+    if image.width > dx and image.height > dy:
+        shifted.paste(image.crop((0, 0, image.width - dx, image.height - dy)), (dx, dy))
+    return shifted
+
+
+def _filtered(image: Image.Image, filter_type: int) -> Image.Image:
+    """Применить фильтр PNG ко всем строкам изображения (по каналам, по модулю 256)"""
+    if filter_type == FILTER_NONE:
+        return image
+    left = _shifted(image, 1, 0)
+    if filter_type == FILTER_SUB:
+        return ImageChops.subtract_modulo(image, left)
+    up = _shifted(image, 0, 1)
+    if filter_type == FILTER_UP:
+        return ImageChops.subtract_modulo(image, up)
+    return ImageChops.subtract_modulo(image, ImageChops.add(left, up, scale=2))
+
+
+def _filter_cost(image: Image.Image) -> int:
+    """Оценка сжимаемости отфильтрованных байтов, как в libpng: сумма модулей байтов со знаком"""
+    return sum(count * _SIGNED_ABS[index & 0xff] for index, count in enumerate(image.histogram()) if count)
+
+
+def _band_raw(image: Image.Image, filter_type: int) -> bytes:
+    """
+    Строки полосы с байтом фильтра PNG перед каждой
+
+    Первая строка фильтруется только по себе (Sub или None): предыдущая строка
+    принадлежит соседней полосе, которая в документе может быть перерисована.
+    """
+    width, height = image.size
+    rawmode = 'RGB' if image.mode == 'RGBX' else image.mode
+    stride = width * PNG_COLOR_TYPES[image.mode][1]
+    first_filter = FILTER_SUB if filter_type != FILTER_NONE else FILTER_NONE
+    raw = bytearray([first_filter])
+    raw += _filtered(image.crop((0, 0, width, 1)), first_filter).tobytes('raw', rawmode)
+    pixels = _filtered(image, filter_type).tobytes('raw', rawmode) if height > 1 else b""
+    for offset in range(stride, len(pixels), stride):
+        raw.append(filter_type)
+        raw += pixels[offset:offset + stride]
+    return bytes(raw)
+
+
+def _compress_band(raw: bytes, level: int, previous: Optional[bytes]) -> Tuple[bytes, int, int]:
+    """
+    Сжать строки полосы во фрагмент deflate
+
+    Фрагмент завершается Z_FULL_FLUSH и выровнен по байту. Ссылки назад допускаются
+    только в строки предыдущей полосы previous (словарь zdict): декодер держит их
+    в окне, поэтому фрагмент склеивается с любым фрагментом, который распаковывается
+    в те же байты.
+
+    Returns:
+        (сжатые данные, adler32 несжатых данных, длина несжатых данных)
+    """
+    if previous:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=previous[-DEFLATE_WINDOW:])
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(raw) + compressor.flush(zlib.Z_FULL_FLUSH)
+    return data, zlib.adler32(raw), len(raw)
+
+
+def _choose_filter(image: Image.Image, level: int, previous: Optional[bytes]) -> Tuple[bytes, Tuple]:
+    """
+    Выбрать фильтр полосы: без фильтра или лучший по оценке из Sub, Up и Average - что сожмется меньше
+
+    На бланках (белый фон, черный текст) обычно выигрывает None, на фотографиях и
+    градиентах - фильтры. Палитровые шаблоны не фильтруются (как и в Pillow).
+
+    Returns:
+        (строки полосы с байтами фильтра, сжатый фрагмент)
+    """
+    raw = _band_raw(image, FILTER_NONE)
+    best = (raw, _compress_band(raw, level, previous))
+    if image.mode == 'P':
+        return best
+    filter_type = min((FILTER_SUB, FILTER_UP, FILTER_AVERAGE), key=lambda f: _filter_cost(_filtered(image, f)))
+    raw = _band_raw(image, filter_type)
+    band = _compress_band(raw, level, previous)
+    if len(band[0]) < len(best[1][0]):
+        best = (raw, band)
+    return best
+
+
+class StaticLayer:
+    """Шаблон, заранее сжатый полосами строк для сборки PNG"""
+
+    __slots__ = ('size', 'mode', 'band_rows', 'bands', 'unchained', 'nbytes')
+
+    def __init__(self, image: Image.Image, band_rows: int, level: int):
+        self.size = image.size
+        self.mode = image.mode
+        self.band_rows = band_rows
+        # Полосы, ссылающиеся на предыдущую полосу шаблона, и те же полосы без ссылок -
+        # для полосы сразу после перерисованной, чтобы не сжимать ее заново
+        self.bands: List[Tuple[bytes, int, int]] = []
+        self.unchained: List[Tuple[bytes, int, int]] = []
+        previous = None
+        for index in range(-(-image.size[1] // band_rows)):
+            raw, band = _choose_filter(image.crop(self.band_box(index)), level, previous)
+            self.bands.append(band)
+            self.unchained.append(_compress_band(raw, level, None) if previous else band)
+            previous = raw
+        self.nbytes = sum(len(band[0]) for band in self.bands + self.unchained)
+
+    def band_range(self, top: int, bottom: int) -> range:
+        """Номера полос, пересекающих строки [top, bottom)"""
+        top = max(0, top)
+        bottom = min(self.size[1], bottom)
+        if bottom <= top:
+            return range(0)
+        return range(top // self.band_rows, (bottom - 1) // self.band_rows + 1)
+
+    def band_box(self, index: int) -> Tuple[int, int, int, int]:
+        top = index * self.band_rows
+        return 0, top, self.size[0], min(self.size[1], top + self.band_rows)
+
+    def encode(self, dirty: Dict[int, Image.Image], level: int, palette: Optional[List[int]] = None) -> bytes:
+        """
+        Собрать PNG: измененные полосы сжимаются заново, остальные берутся готовыми
+
+        Измененные полосы сжимаются без фильтра: текст на бланке так сжимается лучше,
+        чем с фильтром, подобранным для пустой полосы.
+
+        Args:
+            dirty: номер полосы -> изображение полосы с нарисованным текстом
+            palette: палитра для режима P
+        """
+        width, height = self.size
+        color_type = PNG_COLOR_TYPES[self.mode][0]
+        parts = [ZLIB_HEADER]
+        adler = 1
+        previous: Optional[bytes] = None
+        for index, band in enumerate(self.bands):
+            image = dirty.get(index)
+            if image is not None:
+                raw = _band_raw(image, FILTER_NONE)
+                band = _compress_band(raw, level, previous)
+            elif previous is not None:
+                band = self.unchained[index]
+            data, band_adler, length = band
+            parts.append(data)
+            adler = adler32_combine(adler, band_adler, length)
+            previous = raw if image is not None else None
+        # Пустой последний блок deflate (BFINAL) и контрольная сумма zlib
+        parts.append(zlib.compressobj(level, zlib.DEFLATED, -15).flush(zlib.Z_FINISH))
+        parts.append(struct.pack(">I", adler))
+
+        chunks = [PNG_SIGNATURE, png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))]
+        if self.mode == 'P':
+            chunks.append(png_chunk(b"PLTE", bytes(palette[:768])))
+        chunks.append(png_chunk(b"IDAT", b"".join(parts)))
+        chunks.append(png_chunk(b"IEND", b""))
+        return b"".join(chunks)
+
+
+class StaticLayerCache:
+    """LRU-кэш сжатых полос шаблонов с ограничением по памяти"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, band_rows: int = 64):
+        self.max_bytes = max_bytes
+        self.band_rows = band_rows
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[Tuple[int, int], StaticLayer]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, template_path: str, version: Tuple[int, int], image: Image.Image, level: int) -> StaticLayer:
+        """
+        Получить сжатые полосы шаблона (при первом обращении - сжать весь шаблон)
+
+        Args:
+            version: (mtime_ns, размер файла) шаблона - при изменении файла полосы пересчитываются
+        """
+        key = (template_path, level)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        layer = StaticLayer(image, self.band_rows, level)
+        if layer.nbytes > self.max_bytes:
+            return layer
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1].nbytes
+            self._entries[key] = (version, layer)
+            self.current_bytes += layer.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+        return layer
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,134 @@
+from PIL import Image
+from collections import OrderedDict
+import os
+import threading
+from typing import Dict, Optional
+import logging
+
+from shared_templates import SharedTemplateStore
+
+logger = logging.getLogger(__name__)
+
+
+def image_nbytes(image: Image.Image) -> int:
+    """Оценить объем памяти, занимаемый декодированным изображением"""
+    if len(image.getbands()) > 1:
+        # Многоканальные режимы Pillow хранит по 4 байта на пиксель
+        bytes_per_pixel = 4
+    elif image.mode in ('I', 'F'):
+        bytes_per_pixel = 4
+    elif image.mode.startswith('I;16'):
+        bytes_per_pixel = 2
+    else:
+        bytes_per_pixel = 1
+    return image.width * image.height * bytes_per_pixel
+
+
+class _CacheEntry:
+    __slots__ = ('image', 'mtime_ns', 'file_size', 'nbytes')
+
+    def __init__(self, image: Image.Image, mtime_ns: int, file_size: int, nbytes: int):
+        self.image = image
+        self.mtime_ns = mtime_ns
+        self.file_size = file_size
+        self.nbytes = nbytes
+
+
+class TemplateCache:
+    """
+    LRU-кэш декодированных шаблонов с ограничением по памяти
+
+    С общим хранилищем (shared) шаблоны не декодируются в память процесса, а
+    отображаются из файлов хранилища; такие шаблоны не расходуют бюджет кэша.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, shared: Optional[SharedTemplateStore] = None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, template_path: str) -> Image.Image:
+        """
+        Получить копию декодированного шаблона для заполнения
+
+        Запись кэша считается устаревшей, если у файла изменились mtime или размер.
+
+        Raises:
+            FileNotFoundError: файл шаблона не найден
+        """
+        base = self.get_base(template_path)
+        if base.mode == 'RGBX' and base.readonly:
+            # Общее хранилище отображает RGB-шаблоны как RGBX; convert заодно копирует пиксели
+            return base.convert('RGB')
+        return base.copy()
+
+    def get_base(self, template_path: str) -> Image.Image:
+        """Получить закэшированный шаблон без копирования (изменять его нельзя; RGB из общего хранилища - в режиме RGBX)"""
+        stat = os.stat(template_path)
+
+        with self._lock:
+            entry = self._entries.get(template_path)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.file_size == stat.st_size:
+                self._entries.move_to_end(template_path)
+                self.hits += 1
+                return entry.image
+
+        if self.shared is not None:
+            image = self.shared.get(template_path, stat)
+            if image.readonly:
+                # Отображение из общего хранилища (попадания учитываются в его статистике)
+                return image
+        else:
+            image = Image.open(template_path)
+            image.load()
+        with self._lock:
+            self.misses += 1
+        nbytes = image_nbytes(image)
+
+        if nbytes > self.max_bytes:
+            logger.warning(f"Шаблон {template_path} ({nbytes} байт) больше бюджета кэша и не кэшируется")
+            return image
+
+        with self._lock:
+            self._remove(template_path)
+            self._entries[template_path] = _CacheEntry(image, stat.st_mtime_ns, stat.st_size, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                evicted_path, _ = next(iter(self._entries.items()))
+                self._remove(evicted_path)
+                self.evictions += 1
+        return image
+
+    def invalidate(self, template_path: Optional[str] = None):
+        """Удалить шаблон из кэша (или очистить кэш целиком)"""
+        with self._lock:
+            if template_path is None:
+                self._entries.clear()
+                self.current_bytes = 0
+            else:
+                self._remove(template_path)
+        if self.shared is not None:
+            self.shared.invalidate(template_path)
+
+    def _remove(self, template_path: str):
+        entry = self._entries.pop(template_path, None)
+        if entry is not None:
+            self.current_bytes -= entry.nbytes
+
+    def stats(self) -> Dict:
+        """Статистика кэша шаблонов"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,353 @@
+from bisect import bisect_left, insort
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def _normalize(text: str) -> str:
+    return text.casefold().replace('ё', 'е')
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(_normalize(text))
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CatalogEntry:
+    """Запись каталога шаблонов"""
+    __slots__ = ('id', 'name', 'category', 'tags', 'mtime_ns', 'size', 'sort_key', 'search_text')
+
+    def __init__(self, entry_id: int, name: str, mtime_ns: int, size: int,
+                 category: str = '', tags: Tuple[str, ...] = ()):
+        self.id = entry_id
+        self.name = name
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.category = category
+        self.tags = tags
+        self.sort_key = _normalize(name)
+        self.search_text = _normalize(" ".join((os.path.splitext(name)[0], category) + tags))
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'mtime_ns': self.mtime_ns,
+            'size': self.size,
+            'category': self.category,
+            'tags': list(self.tags),
+        }
+
+
+class TemplateCatalog:
+    """
+    Индекс шаблонов с поиском по префиксу и триграммам
+
+    Индекс хранится на диске и обновляется инкрементально: при обращении каталог
+    шаблонов пересканируется, только когда меняется его mtime. Перезапись файла
+    на месте mtime каталога не меняет, поэтому фоновое обновление вызывает
+    refresh(force=True) и сверяет mtime и размер каждого файла.
+    """
+
+    def __init__(self, templates_dir: str, index_path: str,
+                 metadata_lookup: Optional[Callable[[str], Optional[Dict]]] = None,
+                 check_interval: float = 5.0):
+        """
+        Args:
+            templates_dir: каталог с изображениями шаблонов
+            index_path: файл, в котором хранится индекс между перезапусками
+            metadata_lookup: функция, возвращающая конфигурацию шаблона (для category и tags)
+            check_interval: как часто (в секундах) проверять mtime каталога шаблонов;
+                math.inf - только при явном вызове refresh() (например, из фоновой задачи)
+        """
+        self.templates_dir = templates_dir
+        self.index_path = index_path
+        self.metadata_lookup = metadata_lookup
+        self.check_interval = check_interval
+        self._entries: Dict[str, CatalogEntry] = {}
+        self._by_id: Dict[int, CatalogEntry] = {}
+        self._sorted: List[Tuple[str, str]] = []
+        self._prefix: List[Tuple[str, str]] = []
+        self._exact: Dict[str, str] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self._next_id = 1
+        self._dir_mtime_ns = 0
+        self._last_check = 0.0
+        self._lock = threading.RLock()
+
+        self._load_index()
+        # При запуске сверяются все файлы: шаблоны могли перезаписать, пока бот не работал
+        self.refresh(force=True)
+
+    def __len__(self) -> int:
+        self._maybe_refresh()
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        self._maybe_refresh()
+        return name in self._entries
+
+    def names(self) -> List[str]:
+        """Все шаблоны в стабильном порядке"""
+        self._maybe_refresh()
+        return [name for _, name in self._sorted]
+
+    def page(self, page: int, per_page: int) -> Tuple[List[CatalogEntry], int]:
+        """
+        Получить страницу каталога
+
+        Returns:
+            (записи страницы, количество страниц)
+        """
+        self._maybe_refresh()
+        total_pages = max(1, -(-len(self._sorted) // per_page))
+        page = min(max(page, 0), total_pages - 1)
+        start = page * per_page
+        return [self._entries[name] for _, name in self._sorted[start:start + per_page]], total_pages
+
+    def get(self, name: str) -> Optional[CatalogEntry]:
+        self._maybe_refresh()
+        return self._entries.get(name)
+
+    def find(self, query: str) -> Optional[CatalogEntry]:
+        """Найти шаблон по точному имени (с расширением или без, без учета регистра)"""
+        self._maybe_refresh()
+        name = self._exact.get(_normalize(query.strip()))
+        return self._entries.get(name) if name else None
+
+    def get_by_id(self, entry_id: int) -> Optional[CatalogEntry]:
+        self._maybe_refresh()
+        return self._by_id.get(entry_id)
+
+    def get_by_position(self, position: int) -> Optional[CatalogEntry]:
+        """Получить шаблон по номеру (с нуля) в стабильном порядке"""
+        self._maybe_refresh()
+        if 0 <= position < len(self._sorted):
+            return self._entries[self._sorted[position][1]]
+        return None
+
+    def search(self, query: str, limit: int = 20) -> List[CatalogEntry]:
+        """
+        Найти шаблоны по имени, категории или тегам
+
+        Точное совпадение имени идет первым, затем совпадения по префиксу слова,
+        затем по подстроке (через триграммный индекс).
+        """
+        self._maybe_refresh()
+        query_norm = _normalize(query.strip())
+        if not query_norm:
+            return []
+
+        with self._lock:
+            exact = [self._exact[query_norm]] if query_norm in self._exact else []
+
+            prefix_matches: Set[str] = set()
+            query_tokens = _tokens(query_norm)
+            for token in query_tokens[-1:]:
+                i = bisect_left(self._prefix, (token, ''))
+                while i < len(self._prefix) and self._prefix[i][0].startswith(token):
+                    prefix_matches.add(self._prefix[i][1])
+                    i += 1
+            if len(query_tokens) > 1:
+                prefix_matches = {name for name in prefix_matches
+                                  if all(t in self._entries[name].search_text for t in query_tokens[:-1])}
+
+            substring_matches: Set[str] = set()
+            grams = _trigrams(query_norm)
+            if grams and len(exact) + len(prefix_matches) < limit:
+                postings = sorted((self._trigrams.get(g, set()) for g in grams), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+                substring_matches = {name for name in candidates if query_norm in self._entries[name].search_text}
+
+            result: List[str] = list(exact)
+            for group in (prefix_matches, substring_matches):
+                group = group.difference(result)
+                result.extend(heapq.nsmallest(limit - len(result), group, key=lambda n: self._entries[n].sort_key))
+                if len(result) >= limit:
+                    break
+            return [self._entries[name] for name in result[:limit]]
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Синхронизировать индекс с каталогом шаблонов
+
+        Args:
+            force: сверить файлы, даже если mtime каталога не изменился
+
+        Returns:
+            True, если индекс изменился
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                dir_mtime_ns = os.stat(self.templates_dir).st_mtime_ns
+            except FileNotFoundError:
+                dir_mtime_ns = 0
+            if not force and dir_mtime_ns == self._dir_mtime_ns:
+                return False
+
+            found: Dict[str, os.stat_result] = {}
+            if dir_mtime_ns:
+                with os.scandir(self.templates_dir) as entries:
+                    for entry in entries:
+                        if entry.name.lower().endswith(TEMPLATE_EXTENSIONS) and entry.is_file():
+                            found[entry.name] = entry.stat()
+
+            removed = [name for name in self._entries if name not in found]
+            for name in removed:
+                self._remove(name)
+            changed = [name for name, stat in found.items()
+                       if name not in self._entries
+                       or self._entries[name].mtime_ns != stat.st_mtime_ns
+                       or self._entries[name].size != stat.st_size]
+            # При массовом добавлении сортируем один раз в конце вместо вставки по одному
+            bulk = len(changed) > 64
+            ids = {}
+            for name in changed:
+                if name in self._entries:
+                    ids[name] = self._entries[name].id
+                    self._remove(name)
+            for name in changed:
+                self._add(name, found[name].st_mtime_ns, found[name].st_size,
+                          entry_id=ids.get(name), bulk=bulk)
+            if bulk:
+                self._sort()
+
+            if removed or changed or dir_mtime_ns != self._dir_mtime_ns:
+                self._dir_mtime_ns = dir_mtime_ns
+                self._save_index()
+            if removed or changed:
+                logger.info(f"Каталог шаблонов обновлен: +{len(changed)}, -{len(removed)}, всего {len(self._entries)}")
+            return bool(removed or changed)
+
+    def update_metadata(self, names: Iterable[str]):
+        """Обновить категорию и теги шаблонов после изменения их конфигураций"""
+        with self._lock:
+            changed = False
+            for name in names:
+                entry = self._entries.get(name)
+                if entry is not None and (entry.category, entry.tags) != self._metadata(name):
+                    self._add(name, entry.mtime_ns, entry.size)
+                    changed = True
+            if changed:
+                self._save_index()
+
+    def _metadata(self, name: str) -> Tuple[str, Tuple[str, ...]]:
+        config = self.metadata_lookup(name) if self.metadata_lookup else None
+        if not config:
+            return '', ()
+        category = str(config.get('category') or '')
+        tags = config.get('tags') or ()
+        if isinstance(tags, str):
+            tags = (tags,)
+        return category, tuple(str(tag) for tag in tags)
+
+    def _add(self, name: str, mtime_ns: int, size: int,
+             category: Optional[str] = None, tags: Optional[Tuple[str, ...]] = None,
+             entry_id: Optional[int] = None, bulk: bool = False):
+        previous = self._entries.get(name)
+        if previous is not None:
+            entry_id = previous.id
+            self._remove(name)
+        if entry_id is None:
+            entry_id = self._next_id
+        self._next_id = max(self._next_id, entry_id + 1)
+        if category is None or tags is None:
+            category, tags = self._metadata(name)
+
+        entry = CatalogEntry(entry_id, name, mtime_ns, size, category, tags)
+        self._entries[name] = entry
+        self._by_id[entry_id] = entry
+        self._exact[_normalize(name)] = name
+        self._exact.setdefault(_normalize(os.path.splitext(name)[0]), name)
+        add = list.append if bulk else insort
+        add(self._sorted, (entry.sort_key, name))
+        for token in set(_tokens(entry.search_text)):
+            add(self._prefix, (token, name))
+        for gram in _trigrams(entry.search_text):
+            self._trigrams.setdefault(gram, set()).add(name)
+
+    def _remove(self, name: str):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self._by_id.pop(entry.id, None)
+        for key in (_normalize(name), _normalize(os.path.splitext(name)[0])):
+            if self._exact.get(key) == name:
+                del self._exact[key]
+        self._discard_sorted(self._sorted, (_normalize(name), name))
+        for token in set(_tokens(entry.search_text)):
+            self._discard_sorted(self._prefix, (token, name))
+        for gram in _trigrams(entry.search_text):
+            names = self._trigrams.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._trigrams[gram]
+
+    def _sort(self):
+        self._sorted.sort()
+        self._prefix.sort()
+
+    @staticmethod
+    def _discard_sorted(items: List[Tuple[str, str]], item: Tuple[str, str]):
+        i = bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('templates_dir') != os.path.abspath(self.templates_dir):
+                return
+            for name, item in index.get('entries', {}).items():
+                self._add(name, item['mtime_ns'], item['size'], item.get('category', ''),
+                          tuple(item.get('tags', ())), item['id'], bulk=True)
+            self._sort()
+            self._next_id = max(self._next_id, index.get('next_id', 1))
+            self._dir_mtime_ns = index.get('dir_mtime_ns', 0)
+            logger.info(f"Индекс каталога шаблонов загружен: {len(self._entries)} шаблонов")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки индекса каталога {self.index_path}: {e}")
+            self._entries.clear()
+            self._by_id.clear()
+            self._sorted.clear()
+            self._prefix.clear()
+            self._exact.clear()
+            self._trigrams.clear()
+            self._dir_mtime_ns = 0
+
+    def _save_index(self):
+        index = {
+            'templates_dir': os.path.abspath(self.templates_dir),
+            'dir_mtime_ns': self._dir_mtime_ns,
+            'next_id': self._next_id,
+            'entries': {name: entry.to_dict() for name, entry in self._entries.items()},
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения индекса каталога {self.index_path}: {e}")
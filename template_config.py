@@ -0,0 +1,257 @@
+from PIL import ImageColor, ImageFont
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import logging
+
+from fonts import DEFAULT_FAMILY, DEFAULT_WEIGHT, FontCache
+from output_profiles import OutputProfile, get_profile
+from text_layout import TextBox, parse_text_box
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FONT_SIZE = 24
+DEFAULT_COLOR = '#000000'
+
+
+class FieldConfig:
+    """Скомпилированная конфигурация одного поля шаблона"""
+    __slots__ = ('name', 'x', 'y', 'font_size', 'color', 'font_family', 'font_weight', 'font', 'box',
+                 'common_values', '_inks')
+
+    def __init__(self, name: str, x: int, y: int, font_size: int, color: str,
+                 font_family: str, font_weight: str, font: Optional[ImageFont.ImageFont] = None,
+                 box: Optional[TextBox] = None, common_values: Tuple[str, ...] = ()):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.font_size = font_size
+        self.color = color
+        self.font_family = font_family
+        self.font_weight = font_weight
+        self.font = font
+        # Область для переноса и подбора размера (None - одна строка без ограничений)
+        self.box = box
+        # Частые значения поля: растеризуются заранее при запуске
+        self.common_values = common_values
+        self._inks: Dict[str, Union[int, Tuple[int, ...]]] = {}
+
+    @property
+    def position(self) -> Tuple[int, int]:
+        return self.x, self.y
+
+    def ink(self, mode: str) -> Union[int, Tuple[int, ...]]:
+        """Цвет поля в представлении режима изображения (число для 'L', кортеж для 'RGB' и т.д.)"""
+        ink = self._inks.get(mode)
+        if ink is None:
+            ink = self._inks[mode] = ImageColor.getcolor(self.color, mode)
+        return ink
+
+
+class TemplateConfig:
+    """Скомпилированная конфигурация шаблона"""
+    __slots__ = ('template_name', 'fields', 'field_names', 'raw', 'version', 'output_profile')
+
+    def __init__(self, template_name: str, fields: Tuple[FieldConfig, ...], raw: Dict, version: str,
+                 output_profile: Optional[OutputProfile] = None):
+        self.template_name = template_name
+        self.fields = fields
+        self.field_names = tuple(field.name for field in fields)
+        self.raw = raw
+        self.version = version
+        self.output_profile = output_profile
+
+
+def compile_template_config(template_name: str, raw: Dict,
+                            font_cache: Optional[FontCache] = None) -> TemplateConfig:
+    """
+    Проверить конфигурацию и привести ее к компактному типизированному виду
+
+    Raises:
+        ValueError: конфигурация некорректна
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("конфигурация должна быть JSON-объектом")
+    fields_raw = raw.get('fields', {})
+    if not isinstance(fields_raw, dict):
+        raise ValueError("'fields' должен быть объектом")
+
+    fields: List[FieldConfig] = []
+    for name, field in fields_raw.items():
+        if not isinstance(field, dict):
+            raise ValueError(f"поле '{name}' должно быть объектом")
+        try:
+            x = int(field['x'])
+            y = int(field['y'])
+            font_size = int(field.get('font_size', DEFAULT_FONT_SIZE))
+        except KeyError as e:
+            raise ValueError(f"у поля '{name}' нет координаты {e}")
+        except (TypeError, ValueError):
+            raise ValueError(f"у поля '{name}' некорректные координаты или размер шрифта")
+        if font_size <= 0:
+            raise ValueError(f"у поля '{name}' некорректный размер шрифта: {font_size}")
+        color = field.get('color', DEFAULT_COLOR)
+        try:
+            ImageColor.getrgb(color)
+        except (AttributeError, ValueError):
+            raise ValueError(f"у поля '{name}' некорректный цвет: {field.get('color')}")
+
+        font_family = field.get('font_family', DEFAULT_FAMILY)
+        font_weight = field.get('font_weight', DEFAULT_WEIGHT)
+        font = font_cache.get_font(font_size, font_family, font_weight) if font_cache else None
+        box = parse_text_box(name, field)
+        common_values = field.get('common_values', [])
+        if not isinstance(common_values, list) or not all(isinstance(value, str) for value in common_values):
+            raise ValueError(f"у поля '{name}' common_values должен быть списком строк")
+        fields.append(FieldConfig(name, x, y, font_size, color, font_family, font_weight, font, box,
+                                  tuple(common_values)))
+
+    output_profile = get_profile(raw['output']) if raw.get('output') else None
+
+    content = json.dumps(raw, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    version = hashlib.sha1(content).hexdigest()[:16]
+    return TemplateConfig(template_name, tuple(fields), raw, version, output_profile)
+
+
+class ConfigRegistry:
+    """Реестр скомпилированных конфигураций шаблонов с инкрементальной перезагрузкой"""
+
+    def __init__(self, config_dir: str, font_cache: Optional[FontCache] = None, check_interval: float = 5.0):
+        """
+        Args:
+            config_dir: каталог с файлами <шаблон>.json
+            font_cache: кэш шрифтов для разрешения шрифтов полей
+            check_interval: как часто (в секундах) проверять mtime файлов конфигураций;
+                math.inf - только при явном вызове refresh() (например, из фоновой задачи)
+        """
+        self.config_dir = config_dir
+        self.font_cache = font_cache
+        self.check_interval = check_interval
+        self._configs: Dict[str, TemplateConfig] = {}
+        self._listeners: List[Callable[[List[str]], None]] = []
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def get(self, template_name: str) -> Optional[TemplateConfig]:
+        """Получить скомпилированную конфигурацию шаблона"""
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh(blocking=False)
+        return self._configs.get(template_name)
+
+    def add_listener(self, listener: Callable[[List[str]], None]):
+        """Подписаться на изменения конфигураций (listener получает список шаблонов)"""
+        self._listeners.append(listener)
+
+    def _notify(self, changed: List[str]):
+        for listener in self._listeners:
+            try:
+                listener(changed)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика изменения конфигураций: {e}")
+
+    def names(self) -> List[str]:
+        """Имена шаблонов, для которых есть конфигурация"""
+        return list(self._configs)
+
+    def refresh(self, blocking: bool = True) -> List[str]:
+        """
+        Перечитать только изменившиеся, новые и удаленные файлы конфигураций
+
+        Returns:
+            список шаблонов, конфигурация которых изменилась
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return []
+        try:
+            self._last_check = time.monotonic()
+            if not os.path.isdir(self.config_dir):
+                return []
+
+            changed = []
+            seen = set()
+            with os.scandir(self.config_dir) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.') or not entry.name.endswith('.json') or not entry.is_file():
+                        continue
+                    template_name = entry.name[:-len('.json')]
+                    seen.add(template_name)
+                    stat = entry.stat()
+                    stamp = (stat.st_mtime_ns, stat.st_size)
+                    if self._stamps.get(template_name) == stamp:
+                        continue
+                    self._stamps[template_name] = stamp
+                    config = self._load_file(template_name, entry.path)
+                    if config is None:
+                        self._configs.pop(template_name, None)
+                    else:
+                        self._configs[template_name] = config
+                    changed.append(template_name)
+
+            for template_name in set(self._stamps) - seen:
+                del self._stamps[template_name]
+                self._configs.pop(template_name, None)
+                changed.append(template_name)
+        finally:
+            self._lock.release()
+
+        if changed:
+            logger.info(f"Конфигурации обновлены: {changed}")
+            self._notify(changed)
+        return changed
+
+    def _load_file(self, template_name: str, config_file: str) -> Optional[TemplateConfig]:
+        try:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            return compile_template_config(template_name, raw, self.font_cache)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки конфигурации {config_file}: {e}")
+            return None
+
+    def save(self, template_name: str, raw: Dict) -> TemplateConfig:
+        """
+        Проверить, атомарно записать на диск и опубликовать конфигурацию
+
+        Raises:
+            ValueError: конфигурация некорректна
+            OSError: ошибка записи файла
+        """
+        config = self.compile(template_name, raw)
+
+        os.makedirs(self.config_dir, exist_ok=True)
+        config_file = self.config_path(template_name)
+        tmp_file = f"{config_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(raw, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, config_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        self.publish(template_name, config, os.stat(config_file))
+        return config
+
+    def compile(self, template_name: str, raw: Dict) -> TemplateConfig:
+        """
+        Проверить конфигурацию без записи на диск
+
+        Raises:
+            ValueError: конфигурация некорректна
+        """
+        return compile_template_config(template_name, raw, self.font_cache)
+
+    def config_path(self, template_name: str) -> str:
+        return os.path.join(self.config_dir, f"{template_name}.json")
+
+    def publish(self, template_name: str, config: TemplateConfig, stat: os.stat_result):
+        """Опубликовать конфигурацию, уже записанную на диск (stat - результат os.stat ее файла)"""
+        with self._lock:
+            self._stamps[template_name] = (stat.st_mtime_ns, stat.st_size)
+            self._configs[template_name] = config
+        self._notify([template_name])
@@ -0,0 +1,278 @@
+from PIL import ImageFont
+from collections import OrderedDict
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENTS = ('left', 'center', 'right')
+DEFAULT_MIN_FONT_SIZE = 8
+DEFAULT_LINE_SPACING = 1.2
+ELLIPSIS = "…"
+
+
+class TextBox:
+    """Область поля: текст переносится по словам и уменьшается, чтобы поместиться в нее"""
+    __slots__ = ('width', 'height', 'align', 'max_lines', 'min_font_size', 'line_spacing')
+
+    def __init__(self, width: int, height: Optional[int] = None, align: str = 'left',
+                 max_lines: Optional[int] = None, min_font_size: int = DEFAULT_MIN_FONT_SIZE,
+                 line_spacing: float = DEFAULT_LINE_SPACING):
+        self.width = width
+        self.height = height
+        self.align = align
+        # Без высоты и явного количества строк поле остается однострочным
+        self.max_lines = max_lines if max_lines is not None else (None if height else 1)
+        self.min_font_size = min_font_size
+        self.line_spacing = line_spacing
+
+    def key(self) -> Tuple:
+        return self.width, self.height, self.align, self.max_lines, self.min_font_size, self.line_spacing
+
+
+def parse_text_box(name: str, field: Dict) -> Optional[TextBox]:
+    """
+    Прочитать область поля из конфигурации ({"width": 220, "height": 40, "align": "center", "max_lines": 2})
+
+    Raises:
+        ValueError: параметры области некорректны
+    """
+    if 'width' not in field:
+        if any(key in field for key in ('height', 'align', 'max_lines', 'min_font_size')):
+            raise ValueError(f"у поля '{name}' параметры области заданы без ширины 'width'")
+        return None
+    try:
+        box = TextBox(
+            width=int(field['width']),
+            height=int(field['height']) if field.get('height') is not None else None,
+            align=field.get('align', 'left'),
+            max_lines=int(field['max_lines']) if field.get('max_lines') is not None else None,
+            min_font_size=int(field.get('min_font_size', DEFAULT_MIN_FONT_SIZE)),
+            line_spacing=float(field.get('line_spacing', DEFAULT_LINE_SPACING)),
+        )
+    except (TypeError, ValueError):
+        raise ValueError(f"у поля '{name}' некорректные параметры области")
+    if box.width <= 0 or (box.height is not None and box.height <= 0):
+        raise ValueError(f"у поля '{name}' ширина и высота области должны быть положительными")
+    if box.align not in ALIGNMENTS:
+        raise ValueError(f"у поля '{name}' неизвестное выравнивание: {box.align}")
+    if box.max_lines is not None and box.max_lines <= 0:
+        raise ValueError(f"у поля '{name}' max_lines должно быть положительным")
+    if box.min_font_size <= 0 or box.line_spacing <= 0:
+        raise ValueError(f"у поля '{name}' некорректные min_font_size или line_spacing")
+    return box
+
+
+class TextLayout:
+    """Результат раскладки: шрифт и строки со смещениями относительно позиции поля"""
+    __slots__ = ('font', 'font_size', 'lines', 'line_height')
+
+    def __init__(self, font: ImageFont.ImageFont, font_size: int, lines: Tuple[Tuple[str, int, int], ...],
+                 line_height: int):
+        self.font = font
+        self.font_size = font_size
+        self.lines = lines
+        self.line_height = line_height
+
+    def rows(self, y: int, padding: int = 2) -> Tuple[int, int]:
+        """Строки изображения [top, bottom), которые может затронуть текст (с запасом на выносные элементы)"""
+        return y - padding, y + (len(self.lines) - 1) * self.line_height + math.ceil(self.font_size * 1.3) + padding
+
+
+class GlyphMetrics:
+    """Кэш ширин символов для каждой пары (шрифт, размер)"""
+
+    def __init__(self):
+        self._advances: Dict[Tuple, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _font_key(font: ImageFont.ImageFont) -> Tuple:
+        path = getattr(font, 'path', None)
+        return (path, getattr(font, 'size', None)) if path else (id(font),)
+
+    def width(self, font: ImageFont.ImageFont, text: str) -> float:
+        """Ширина строки как сумма ширин символов (без кернинга)"""
+        key = self._font_key(font)
+        advances = self._advances.get(key)
+        if advances is None:
+            with self._lock:
+                advances = self._advances.setdefault(key, {})
+        total = 0.0
+        for char in text:
+            advance = advances.get(char)
+            if advance is None:
+                advance = advances[char] = font.getlength(char)
+            total += advance
+        return total
+
+
+class TextLayoutEngine:
+    """
+    Перенос по словам и подбор размера шрифта для полей с областью
+
+    Размер подбирается двоичным поиском между min_font_size и размером поля.
+    Ширины символов кэшируются для каждого размера, а готовые раскладки - для
+    каждой пары (стиль поля, значение), поэтому повторные значения не измеряются.
+    """
+
+    def __init__(self, font_loader: Callable[[int, str, str], ImageFont.ImageFont], cache_size: int = 4096):
+        """
+        Args:
+            font_loader: функция (размер, семейство, начертание) -> шрифт, обычно FontCache.get_font
+            cache_size: сколько раскладок хранить
+        """
+        self.font_loader = font_loader
+        self.cache_size = cache_size
+        self.metrics = GlyphMetrics()
+        self.hits = 0
+        self.misses = 0
+        self._layouts: "OrderedDict[Tuple, TextLayout]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def layout(self, field, text: str) -> TextLayout:
+        """Разложить значение поля в его области"""
+        box: TextBox = field.box
+        key = (field.font_family, field.font_weight, field.font_size, box.key(), text)
+        with self._lock:
+            layout = self._layouts.get(key)
+            if layout is not None:
+                self._layouts.move_to_end(key)
+                self.hits += 1
+                return layout
+            self.misses += 1
+
+        layout = self._compute(field, box, text)
+
+        with self._lock:
+            self._layouts[key] = layout
+            while len(self._layouts) > self.cache_size:
+                self._layouts.popitem(last=False)
+        return layout
+
+    def _font(self, field, size: int) -> ImageFont.ImageFont:
+        return self.font_loader(size, field.font_family, field.font_weight)
+
+    def _try_size(self, field, box: TextBox, text: str, size: int, break_words: bool) -> Optional[List[str]]:
+        """Строки при данном размере или None, если текст не помещается"""
+        font = self._font(field, size)
+        line_height = max(1, round(size * box.line_spacing))
+        max_lines = box.max_lines
+        if box.height is not None:
+            by_height = (box.height - size) // line_height + 1
+            max_lines = min(max_lines, by_height) if max_lines else by_height
+            if max_lines <= 0:
+                return None
+        lines = self.wrap(font, text, box.width, max_lines, break_words)
+        if lines is None:
+            return None
+        # Сумма ширин символов не учитывает кернинг - проверяем итоговые строки точно
+        if any(font.getlength(line) > box.width for line in lines):
+            return None
+        return lines
+
+    def _search(self, field, box: TextBox, text: str, break_words: bool) -> Optional[Tuple[int, List[str]]]:
+        """Наибольший размер шрифта, при котором текст помещается (двоичный поиск)"""
+        low, high = min(box.min_font_size, field.font_size), field.font_size
+        best = None
+        while low <= high:
+            middle = (low + high) // 2
+            lines = self._try_size(field, box, text, middle, break_words)
+            if lines is not None:
+                best = (middle, lines)
+                low = middle + 1
+            else:
+                high = middle - 1
+        return best
+
+    def _compute(self, field, box: TextBox, text: str) -> TextLayout:
+        # Сначала без разрыва слов, затем с разрывом, в крайнем случае - обрезка
+        lines = self._try_size(field, box, text, field.font_size, break_words=False)
+        if lines is not None:
+            size = field.font_size
+        else:
+            best = self._search(field, box, text, break_words=False) or self._search(field, box, text, break_words=True)
+            if best is not None:
+                size, lines = best
+            else:
+                size = min(box.min_font_size, field.font_size)
+                lines = self._truncate(field, box, text, size)
+
+        font = self._font(field, size)
+        line_height = max(1, round(size * box.line_spacing))
+        placed = []
+        for i, line in enumerate(lines):
+            free = box.width - self.metrics.width(font, line)
+            dx = 0 if box.align == 'left' else round(free / 2 if box.align == 'center' else free)
+            placed.append((line, max(0, dx), i * line_height))
+        return TextLayout(font, size, tuple(placed), line_height)
+
+    def _truncate(self, field, box: TextBox, text: str, size: int) -> List[str]:
+        """Текст не помещается даже минимальным шрифтом: обрезать последнюю строку с многоточием"""
+        font = self._font(field, size)
+        line_height = max(1, round(size * box.line_spacing))
+        max_lines = box.max_lines or 1
+        if box.height is not None:
+            max_lines = max(1, min(max_lines, (box.height - size) // line_height + 1))
+        lines = self.wrap(font, text, box.width, None, break_words=True)[:max_lines]
+        last = lines[-1] if lines else ""
+        while last and self.metrics.width(font, last + ELLIPSIS) > box.width:
+            last = last[:-1]
+        lines[-1:] = [last.rstrip() + ELLIPSIS]
+        return lines
+
+    def wrap(self, font: ImageFont.ImageFont, text: str, width: int, max_lines: Optional[int],
+             break_words: bool = True) -> Optional[List[str]]:
+        """
+        Жадный перенос по словам; слова шире области переносятся по символам
+
+        Returns:
+            строки или None, если их больше max_lines (или, при break_words=False,
+            какое-то слово не помещается в строку)
+        """
+        measure = self.metrics.width
+        space = measure(font, " ")
+        lines: List[str] = []
+        for paragraph in text.split("\n"):
+            current, current_width = "", 0.0
+            for word in paragraph.split():
+                word_width = measure(font, word)
+                if current and current_width + space + word_width <= width:
+                    current += " " + word
+                    current_width += space + word_width
+                    continue
+                if current:
+                    lines.append(current)
+                current, current_width = word, word_width
+                if current_width > width and not break_words:
+                    return None
+                while current_width > width and len(current) > 1:
+                    # Слово не помещается в строку целиком - отрезаем столько символов, сколько влезает
+                    cut, cut_width = 0, 0.0
+                    for char in current:
+                        char_width = measure(font, char)
+                        if cut and cut_width + char_width > width:
+                            break
+                        cut += 1
+                        cut_width += char_width
+                    lines.append(current[:cut])
+                    current = current[cut:]
+                    current_width = measure(font, current)
+                if max_lines is not None and len(lines) > max_lines:
+                    return None
+            lines.append(current)
+            if max_lines is not None and len(lines) > max_lines:
+                return None
+        return lines
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._layouts),
+            'max_size': self.cache_size,
+        }
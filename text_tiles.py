@@ -0,0 +1,153 @@
+from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+import threading
+from typing import Dict, Hashable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TextTile:
+    """Растеризованная строка: маска прозрачности и ее смещение от точки вывода текста"""
+    __slots__ = ('mask', 'offset', 'nbytes')
+
+    def __init__(self, mask: Optional[Image.Image], offset: Tuple[int, int]):
+        # None - строка без видимых символов (например, из одних пробелов)
+        self.mask = mask
+        self.offset = offset
+        self.nbytes = mask.width * mask.height if mask is not None else 0
+
+    def draw(self, draw: ImageDraw.ImageDraw, position: Tuple[int, int], fill):
+        """Вывести строку цветом fill, как draw.text в той же точке"""
+        if self.mask is not None:
+            draw.bitmap((position[0] + self.offset[0], position[1] + self.offset[1]), self.mask, fill=fill)
+
+
+def _font_key(font: ImageFont.ImageFont) -> Hashable:
+    path = getattr(font, 'path', None)
+    if path is None:
+        # Встроенный шрифт без файла: объект живет в кэше шрифтов
+        return id(font)
+    return path, getattr(font, 'index', 0), getattr(font, 'size', 0)
+
+
+def render_tile(text: str, font: ImageFont.ImageFont, mode: str = 'L') -> TextTile:
+    """
+    Растеризовать однострочный текст в маску (getbbox не учитывает переводы строк)
+
+    Args:
+        mode: режим сглаживания ImageDraw.fontmode изображения, на которое выводится
+            текст ('L' - со сглаживанием, '1' - без него, например для палитровых шаблонов)
+    """
+    left, top, right, bottom = font.getbbox(text, mode=mode)
+    if right <= left or bottom <= top:
+        return TextTile(None, (0, 0))
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.fontmode = mode
+    draw.text((-left, -top), text, fill=255, font=font)
+    return TextTile(mask, (left, top))
+
+
+class TextTileCache:
+    """
+    LRU-кэш растеризованных строк с ограничением по памяти
+
+    Маска не зависит от цвета, поэтому ключ - (строка, шрифт и размер, режим
+    сглаживания), а цвет задается при выводе. Чтобы уникальные значения
+    (ФИО, номера) не вытесняли повторяющиеся, строка попадает в кэш только
+    при повторном обращении; значения, известные заранее (common_values из
+    конфигурации шаблона), добавляются сразу через warm().
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_seen: int = 10000):
+        """
+        Args:
+            max_bytes: бюджет памяти масок (0 - кэш выключен)
+            max_seen: сколько однократно встреченных строк помнить
+        """
+        self.max_bytes = max_bytes
+        self.max_seen = max_seen
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, TextTile]" = OrderedDict()
+        self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, text: str, font: ImageFont.ImageFont, mode: str = 'L') -> Optional[TextTile]:
+        """
+        Получить маску строки
+
+        Returns:
+            None, если строка встречается впервые (ее выгоднее нарисовать напрямую)
+            или состоит из нескольких строк (draw.text выводит их построчно)
+        """
+        if not self.enabled or '\n' in text:
+            return None
+        key = (text, _font_key(font), mode)
+        with self._lock:
+            tile = self._entries.get(key)
+            if tile is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+            if key not in self._seen:
+                self._seen[key] = None
+                if len(self._seen) > self.max_seen:
+                    self._seen.popitem(last=False)
+                return None
+            del self._seen[key]
+
+        tile = render_tile(text, font, mode)
+        self._put(key, tile)
+        return tile
+
+    def warm(self, text: str, font: ImageFont.ImageFont, mode: str = 'L') -> bool:
+        """Растеризовать строку заранее; False - она уже в кэше, не помещается или многострочная"""
+        if not self.enabled or '\n' in text:
+            return False
+        key = (text, _font_key(font), mode)
+        with self._lock:
+            if key in self._entries:
+                return False
+        return self._put(key, render_tile(text, font, mode))
+
+    def _put(self, key: Hashable, tile: TextTile) -> bool:
+        if tile.nbytes > self.max_bytes:
+            return False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous.nbytes
+            self._entries[key] = tile
+            self.current_bytes += tile.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,95 @@
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+import asyncio
+import hmac
+import time
+from typing import Callable, Dict, Optional, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """aiohttp-сервер, принимающий обновления Telegram через webhook"""
+
+    def __init__(self, bot: Bot, dp: Dispatcher, path: str = "/webhook",
+                 secret_token: Optional[str] = None, max_concurrent: int = 50,
+                 health_info: Optional[Callable[[], Dict]] = None):
+        """
+        Args:
+            path: путь, на который Telegram отправляет обновления
+            secret_token: секрет из setWebhook, проверяется в заголовке каждого запроса
+            max_concurrent: сколько обновлений обрабатывается одновременно; следующие запросы
+                ждут освобождения места, и Telegram придерживает новые обновления
+            health_info: функция с дополнительными данными для /health
+        """
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret_token = secret_token
+        self.max_concurrent = max_concurrent
+        self.health_info = health_info
+        self.processed = 0
+        self.failed = 0
+        self._started_at = time.monotonic()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/health", self.handle_health)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        """Принять обновление и передать его диспетчеру в фоне"""
+        if self.secret_token and not hmac.compare_digest(
+                request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            logger.warning(f"Webhook: неверный секрет от {request.remote}")
+            return web.Response(status=401)
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Webhook: некорректное обновление: {e}")
+            return web.Response(status=400)
+
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        info = {
+            'status': 'ok',
+            'uptime_seconds': round(time.monotonic() - self._started_at, 1),
+            'in_flight': self.in_flight,
+            'max_concurrent': self.max_concurrent,
+            'processed': self.processed,
+            'failed': self.failed,
+        }
+        if self.health_info:
+            info.update(self.health_info())
+        return web.json_response(info)
+
+    async def _on_shutdown(self, app: web.Application):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)